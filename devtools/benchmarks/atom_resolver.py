@@ -0,0 +1,132 @@
+"""
+Benchmark the resolution of the atom indices used by compute_simple_protein_features.
+
+Compares the per-atom loop that used to live in compute_simple_protein_features with
+kinomodel.features.protein.resolve_protein_feature_atoms on topologies of increasing size.
+Topologies are built by joining copies of the four kinase chains of the bundled Abl:nilotinib
+structure (PDB 3CS9), and the last chain is featurized, so both methods have to traverse every atom.
+
+Usage:
+
+    python devtools/benchmarks/atom_resolver.py [--repeats 5] [--copies 1 2 4 6]
+
+"""
+
+import argparse
+import os
+import time
+
+import mdtraj as md
+import numpy as np
+
+from kinomodel.features.protein import resolve_protein_feature_atoms
+
+# Abl kinase (PDB 3CS9) residue numbers for the KLIFS positions used by the features
+ABL_NUMBERING = list(range(255, 340))
+ABL_NUMBERING[16] = 271  # beta3 K
+ABL_NUMBERING[23] = 286  # aC E
+ABL_NUMBERING[27] = 290  # ExxxX
+ABL_NUMBERING[78:83] = [379, 380, 381, 382, 383]  # xx-DFG-
+
+
+def legacy_resolve(topology, chainid, numbering):
+    """The per-atom loop previously inlined in compute_simple_protein_features."""
+    table, bonds = topology.to_dataframe()
+    atoms = table.values
+    chain_index = ord(str(chainid).lower()) - 97
+    dih = np.zeros(shape=(8, 4), dtype=int, order='C')
+    dis = np.zeros(shape=(5, 2), dtype=int, order='C')
+    count = 0
+    for line in atoms:
+        if line[5] == chain_index:
+            dih[0][0] = count if line[3] == numbering[20] and line[1] == 'CA' else dih[0][0]
+            dih[0][1] = count if line[3] == numbering[28] and line[1] == 'CA' else dih[0][1]
+            dih[0][2] = count if line[3] == numbering[60] and line[1] == 'CA' else dih[0][2]
+            dih[0][3] = count if line[3] == numbering[62] and line[1] == 'CA' else dih[0][3]
+            dih[1][0] = count if line[3] == numbering[78] and line[1] == 'C' else dih[1][0]
+            dih[1][1] = count if line[3] == numbering[79] and line[1] == 'N' else dih[1][1]
+            dih[1][2] = count if line[3] == numbering[79] and line[1] == 'CA' else dih[1][2]
+            dih[1][3] = count if line[3] == numbering[79] and line[1] == 'C' else dih[1][3]
+            dih[2][0] = dih[1][1]
+            dih[2][1] = dih[1][2]
+            dih[2][2] = dih[1][3]
+            dih[2][3] = count if line[3] == numbering[80] and line[1] == 'N' else dih[2][3]
+            dih[3][0] = dih[1][3]
+            dih[3][1] = dih[2][3]
+            dih[3][2] = count if line[3] == numbering[80] and line[1] == 'CA' else dih[3][2]
+            dih[3][3] = count if line[3] == numbering[80] and line[1] == 'C' else dih[3][3]
+            dih[4][0] = dih[3][1]
+            dih[4][1] = dih[3][2]
+            dih[4][2] = dih[3][3]
+            dih[4][3] = count if line[3] == numbering[81] and line[1] == 'N' else dih[4][3]
+            dih[5][0] = dih[3][3]
+            dih[5][1] = dih[4][3]
+            dih[5][2] = count if line[3] == numbering[81] and line[1] == 'CA' else dih[5][2]
+            dih[5][3] = count if line[3] == numbering[81] and line[1] == 'C' else dih[5][3]
+            dih[6][0] = dih[5][1]
+            dih[6][1] = dih[5][2]
+            dih[6][2] = dih[5][3]
+            dih[6][3] = count if line[3] == numbering[82] and line[1] == 'N' else dih[6][3]
+            dih[7][0] = dih[5][1]
+            dih[7][1] = dih[5][2]
+            dih[7][2] = count if line[3] == numbering[81] and line[1] == 'CB' else dih[7][2]
+            dih[7][3] = count if line[3] == numbering[81] and line[1] == 'CG' else dih[7][3]
+            dis[0][0] = count if line[3] == numbering[16] and line[1] == 'NZ' else dis[0][0]
+            dis[0][1] = count if line[3] == numbering[23] and line[1] == 'OE1' else dis[0][1]
+            dis[1][0] = count if line[3] == numbering[16] and line[1] == 'NZ' else dis[1][0]
+            dis[1][1] = count if line[3] == numbering[23] and line[1] == 'OE2' else dis[1][1]
+            dis[2][0] = count if line[3] == numbering[27] and line[1] == 'CA' else dis[2][0]
+            dis[2][1] = count if line[3] == numbering[81] and line[1] == 'CZ' else dis[2][1]
+            dis[3][0] = count if line[3] == numbering[16] and line[1] == 'CA' else dis[3][0]
+            dis[3][1] = dis[2][1]
+            dis[4][0] = count if line[3] == int(numbering[80] + 10) and line[1] == 'CA' else dis[4][0]
+            dis[4][1] = count if line[3] == int(numbering[80] - 20) and line[1] == 'CA' else dis[4][1]
+        if line[5] > chain_index:
+            break
+        count += 1
+    for i in range(len(dih)):
+        if 0 in dih[i]:
+            dih[i] = [0, 0, 0, 0]
+    for i in range(len(dis)):
+        if 0 in dis[i]:
+            dis[i] = [0, 0]
+    return dih, dis
+
+
+def best_time(function, repeats, *args):
+    """Return the best wall time (in seconds) over several calls and the last result."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeats', type=int, default=5, help='number of timed calls per system size')
+    parser.add_argument('--copies', type=int, nargs='+', default=[1, 2, 4, 6],
+                        help='numbers of copies of the 3CS9 kinase chains to join (at most 6)')
+    args = parser.parse_args()
+
+    pdb = os.path.join(os.path.dirname(__file__), '..', '..', 'kinomodel', 'data', 'docking', '3cs9.pdb')
+    topology = md.load(pdb).topology
+    # chains A-D are the kinase chains; ligand and water chains follow them
+    unit = topology.subset(topology.select('chainid 0 to 3'))
+    print('{:>8s} {:>8s} {:>12s} {:>12s} {:>8s}'.format('copies', 'atoms', 'loop (ms)', 'keyed (ms)', 'speedup'))
+    for copies in args.copies:
+        topology = unit.copy()
+        for _ in range(copies - 1):
+            topology = topology.join(unit)
+        chainid = chr(97 + topology.n_chains - 1)
+        legacy_time, (dih, dis) = best_time(legacy_resolve, args.repeats, topology, chainid, ABL_NUMBERING)
+        keyed_time, (new_dih, new_dis, _, _) = best_time(resolve_protein_feature_atoms, args.repeats, topology,
+                                                         chainid, ABL_NUMBERING)
+        assert np.array_equal(dih, new_dih) and np.array_equal(dis, new_dis)
+        print('{:8d} {:8d} {:12.2f} {:12.2f} {:8.1f}'.format(copies, topology.n_atoms, legacy_time * 1000,
+                                                             keyed_time * 1000, legacy_time / keyed_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark docking throughput and pose accuracy on the Abl complexes of the Hauser benchmark set.
+
+Each benchmark ligand is docked into its own receptor with each docking mode:
+
+    dock    OEDock, as used by dock_molecule for receptors without a bound ligand
+    hybrid  OEHybrid (Hybrid2, high resolution), as used by dock_molecule for receptors with a bound ligand
+    posit   OEPosit, as used by pose_molecule
+
+Docking starts from the isomeric SMILES of the crystal ligand, so no information about the crystal
+pose leaks into the input. The time of every stage (receptor preparation, Omega conformers, AM1-BCC
+ELF10 charges and docking) is recorded, along with the symmetry-corrected heavy-atom RMSD of the top
+pose and of the best of the returned poses to the crystal ligand. Receptor preparation is reported
+but not counted in the throughput, since a receptor is built once per campaign.
+
+The report is written as JSON: the toolkit versions and settings of the run, one record per
+(ligand, mode) and a summary per mode (molecules per second, median and mean RMSD, fraction of
+ligands with a top pose within 2 A).
+
+Usage:
+
+    python devtools/benchmarks/docking.py [--modes dock hybrid posit] [--ligands imatinib nilotinib]
+                                          [--poses 10] [--output docking-benchmark.json]
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+BENCHMARK = os.path.join(os.path.dirname(__file__), '..', '..', 'kinomodel', 'data', 'hauser-abl-benchmark')
+MODES = ['dock', 'hybrid', 'posit']
+
+
+def load_ligand(ligand):
+    """Return the crystal pose of a benchmark ligand and the path of its file."""
+    from openeye import oechem
+
+    # ligands are named after the receptor, without the _nowat suffix unless both variants exist
+    path = os.path.join(BENCHMARK, 'ligands', '{}.mol2'.format(ligand))
+    if not os.path.exists(path):
+        path = os.path.join(BENCHMARK, 'ligands', '{}.mol2'.format(ligand[:-len('_nowat')]))
+    crystal = oechem.OEGraphMol()
+    oechem.OEReadMolecule(oechem.oemolistream(path), crystal)
+    return crystal, path
+
+
+def create_docker(receptor, mode):
+    """Create and initialize the docking object of a mode, as dock_molecule and pose_molecule do."""
+    from openeye import oedocking
+
+    if mode == 'dock':
+        docker = oedocking.OEDock()
+    elif mode == 'hybrid':
+        docker = oedocking.OEHybrid(oedocking.OEDockMethod_Hybrid2, oedocking.OESearchResolution_High)
+    elif mode == 'posit':
+        docker = oedocking.OEPosit()
+    else:
+        raise ValueError("Unknown docking mode '{}'".format(mode))
+    docker.Initialize(receptor)
+    return docker
+
+
+def pose_rmsds(crystal, docked):
+    """Return the symmetry-corrected heavy-atom RMSD (in A) of every docked pose to the crystal pose."""
+    from openeye import oechem
+
+    return [oechem.OERMSD(crystal, pose, True, True, False) for pose in docked.GetConfs()]
+
+
+def run_ligand(ligand, modes, n_poses, receptor_cache):
+    """Dock one benchmark ligand with every mode; return one record per mode."""
+    from openeye import oechem, oequacpac
+    from kinomodel.docking import create_bound_receptor
+    from kinomodel.docking.ligand_cache import create_omega
+
+    crystal, ligand_path = load_ligand(ligand)
+    receptor_path = os.path.join(BENCHMARK, 'receptors', 'cAbl-{}.pdb'.format(ligand))
+    start = time.perf_counter()
+    receptor = create_bound_receptor(receptor_path, ligand_path, receptor_cache=receptor_cache)
+    receptor_time = time.perf_counter() - start
+
+    records = []
+    for mode in modes:
+        docker = create_docker(receptor, mode)
+        molecule = oechem.OEMol()
+        oechem.OESmilesToMol(molecule, oechem.OEMolToSmiles(crystal))
+        record = {'ligand': ligand, 'mode': mode, 'receptor_time': receptor_time, 'heavy_atoms':
+                  oechem.OECount(crystal, oechem.OEIsHeavy())}
+
+        # the ligand is prepared again for every mode, so the timings of all modes are comparable
+        start = time.perf_counter()
+        ok = create_omega()(molecule)
+        record['conformer_time'] = time.perf_counter() - start
+        record['n_conformers'] = molecule.NumConfs() if ok else 0
+        if not ok:
+            record.update(status='failed', error='no conformers')
+            records.append(record)
+            continue
+
+        start = time.perf_counter()
+        oequacpac.OEAssignCharges(molecule, oequacpac.OEAM1BCCELF10Charges())
+        record['charge_time'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        docked = oechem.OEMol()
+        docker.DockMultiConformerMolecule(docked, molecule, n_poses)
+        record['docking_time'] = time.perf_counter() - start
+
+        rmsds = pose_rmsds(crystal, docked) if docked.NumAtoms() else []
+        record.update(status='ok' if rmsds else 'failed', n_poses=len(rmsds),
+                      top_rmsd=rmsds[0] if rmsds else None, best_rmsd=min(rmsds) if rmsds else None)
+        records.append(record)
+
+    return records
+
+
+def summarize(records):
+    """Return the throughput and accuracy of each mode."""
+    summary = {}
+    for mode in sorted(set(record['mode'] for record in records)):
+        selected = [record for record in records if record['mode'] == mode]
+        docked = [record for record in selected if record['status'] == 'ok']
+        total = sum(record.get(stage, 0.0) for record in selected
+                    for stage in ('conformer_time', 'charge_time', 'docking_time'))
+        top = np.array([record['top_rmsd'] for record in docked])
+        summary[mode] = {
+            'n_molecules': len(selected),
+            'n_docked': len(docked),
+            'molecules_per_second': len(selected) / total if total else None,
+            'conformer_time': sum(record.get('conformer_time', 0.0) for record in selected),
+            'charge_time': sum(record.get('charge_time', 0.0) for record in selected),
+            'docking_time': sum(record.get('docking_time', 0.0) for record in selected),
+            'median_top_rmsd': float(np.median(top)) if len(top) else None,
+            'mean_top_rmsd': float(top.mean()) if len(top) else None,
+            'mean_best_rmsd': float(np.mean([record['best_rmsd'] for record in docked])) if docked else None,
+            'success_rate_2A': float((top <= 2.0).sum() / len(selected)) if selected else None,
+        }
+    return summary
+
+
+def main():
+    ligands = sorted(os.path.basename(path)[len('cAbl-'):-len('.pdb')]
+                     for path in glob.glob(os.path.join(BENCHMARK, 'receptors', 'cAbl-*_nowat.pdb')))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES, help='docking modes to benchmark')
+    parser.add_argument('--ligands', nargs='+', default=ligands, help='complexes to benchmark')
+    parser.add_argument('--poses', type=int, default=10, help='number of poses per molecule')
+    parser.add_argument('--no-receptor-cache', action='store_true',
+                        help='build every receptor from scratch instead of using the receptor cache')
+    parser.add_argument('--output', default='docking-benchmark.json', help='path of the JSON report')
+    args = parser.parse_args()
+
+    from openeye import oechem, oedocking, oeomega, oequacpac
+    from kinomodel.docking.ligand_cache import OMEGA_SETTINGS, CHARGE_MODEL
+
+    records = []
+    print('{:>20s} {:>7s} {:>10s} {:>10s} {:>10s} {:>9s} {:>9s}'.format(
+        'complex', 'mode', 'confs (s)', 'charge (s)', 'dock (s)', 'top (A)', 'best (A)'))
+    for ligand in args.ligands:
+        for record in run_ligand(ligand, args.modes, args.poses, False if args.no_receptor_cache else None):
+            records.append(record)
+            print('{:>20s} {:>7s} {:10.2f} {:10.2f} {:10.2f} {:>9s} {:>9s}'.format(
+                ligand, record['mode'], record['conformer_time'], record.get('charge_time', float('nan')),
+                record.get('docking_time', float('nan')),
+                '{:.2f}'.format(record['top_rmsd']) if record.get('top_rmsd') is not None else '-',
+                '{:.2f}'.format(record['best_rmsd']) if record.get('best_rmsd') is not None else '-'))
+
+    report = {
+        'benchmark': 'hauser-abl-benchmark',
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'python': platform.python_version()},
+        'versions': {'oechem': oechem.OEChemGetVersion(), 'oedocking': oedocking.OEDockingGetVersion(),
+                     'oeomega': oeomega.OEOmegaGetVersion(), 'oequacpac': oequacpac.OEQuacPacGetVersion()},
+        'settings': {'n_poses': args.poses, 'omega': OMEGA_SETTINGS, 'charges': CHARGE_MODEL},
+        'summary': summarize(records),
+        'records': records,
+    }
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=1)
+
+    for mode, summary in report['summary'].items():
+        print('{:>7s}: {:.3f} molecules/s, median top-pose RMSD {} A, {}/{} docked'.format(
+            mode, summary['molecules_per_second'] or 0.0,
+            '{:.2f}'.format(summary['median_top_rmsd']) if summary['median_top_rmsd'] is not None else '-',
+            summary['n_docked'], summary['n_molecules']))
+    print('Report written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark the startup time of kinomodel modules and command-line tools.
+
+Every module is imported in a fresh interpreter with ``python -X importtime``, several times, and the
+median cumulative import time of the module is reported, along with the heavy dependencies (mdtraj,
+openeye, pdbfixer, OpenMM, NumPy, pandas, ...) it pulled in. Short featurization jobs launched by a
+scheduler pay this cost once per job, so none of the command-line modules should import a heavy
+dependency before it is needed.
+
+The report is written as JSON. With --max-ms, the exit status is 1 if any module takes longer to import,
+or imports a heavy dependency, so the benchmark can guard against regressions.
+
+Usage:
+
+    python devtools/benchmarks/import_time.py [--modules kinomodel kinomodel.features.featurize]
+                                              [--repeats 5] [--max-ms 100] [--output import-time.json]
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+# the package and the modules of the console scripts
+MODULES = ['kinomodel', 'kinomodel.features.featurize', 'kinomodel.features.batch', 'kinomodel.features.update']
+HEAVY = ['mdtraj', 'openeye', 'pdbfixer', 'simtk', 'openmm', 'openmoltools', 'numpy', 'pandas', 'pyarrow', 'scipy',
+         'requests']
+
+
+def import_time(module):
+    """Import a module in a fresh interpreter and return its cumulative import time (in ms) and the heavy
+    dependencies it imported."""
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(ROOT)] +
+                                                              os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                             stderr=subprocess.PIPE, universal_newlines=True, env=environment, check=True)
+    timings = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                timings[name.strip()] = int(cumulative) / 1000
+    heavy = sorted(set(name.split('.')[0] for name in timings) & set(HEAVY))
+
+    return timings.get(module, 0.0), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of kinomodel modules')
+    parser.add_argument('--modules', nargs='+', default=MODULES, help='the modules to import')
+    parser.add_argument('--repeats', type=int, default=5, help='the number of imports of each module')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail if the median import time of a module exceeds this (in ms)')
+    parser.add_argument('--output', default='import-time.json', help='the JSON report')
+    args = parser.parse_args()
+
+    records = []
+    for module in args.modules:
+        times, heavy = [], []
+        for _ in range(args.repeats):
+            elapsed, heavy = import_time(module)
+            times.append(elapsed)
+        records.append({'module': module, 'median_ms': float(np.median(times)), 'min_ms': float(np.min(times)),
+                        'heavy_imports': heavy})
+        print('{:40s} {:8.1f} ms  {}'.format(module, records[-1]['median_ms'], ' '.join(heavy)))
+
+    report = {'python': sys.version, 'platform': platform.platform(), 'repeats': args.repeats, 'records': records}
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=2)
+
+    if args.max_ms is not None:
+        slow = [record['module'] for record in records
+                if record['median_ms'] > args.max_ms or record['heavy_imports']]
+        if slow:
+            print('Slow imports: {}'.format(', '.join(slow)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark the ligand-pocket distance features computed by compute_simple_interaction_features.
+
+Compares the pair-list implementation that used to live in compute_simple_interaction_features
+(an 8500-row pair buffer, mdtraj.compute_distances and a per-frame reduction loop) with the
+broadcasted kinomodel.features.interactions.pocket_distance_kernel on the Abl complexes of the
+Hauser benchmark set. Each receptor is stacked with its ligand, the 85 residues whose CA is closest
+to the ligand are used as the pocket, and the complex is tiled into a trajectory of perturbed frames.
+
+Usage:
+
+    python devtools/benchmarks/pocket_distances.py [--frames 1000] [--repeats 3] [--ligands imatinib nilotinib]
+
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import mdtraj as md
+import numpy as np
+
+from kinomodel.features.interactions import resolve_interaction_atoms, pocket_distance_kernel
+
+BENCHMARK = os.path.join(os.path.dirname(__file__), '..', '..', 'kinomodel', 'data', 'hauser-abl-benchmark')
+
+
+def load_complex(ligand, n_frames, seed=0):
+    """Stack a receptor with its ligand and tile the complex into n_frames perturbed frames."""
+    receptor = md.load(os.path.join(BENCHMARK, 'receptors', 'cAbl-{}.pdb'.format(ligand)))
+    # ligands are named after the receptor, without the _nowat suffix unless both variants exist
+    path = os.path.join(BENCHMARK, 'ligands', '{}.mol2'.format(ligand))
+    if not os.path.exists(path):
+        path = os.path.join(BENCHMARK, 'ligands', '{}.mol2'.format(ligand[:-len('_nowat')]))
+    molecule = md.load(path)
+    receptor = receptor.atom_slice(receptor.topology.select('protein and chainid 0'))
+    complex_ = receptor.stack(molecule)
+    ligand_name = molecule.topology.residue(0).name
+
+    # the 85 residues whose CA is closest to the ligand centroid
+    cas = complex_.topology.select('name CA and chainid 0')
+    centroid = molecule.xyz[0].mean(axis=0)
+    closest = cas[np.argsort(np.linalg.norm(complex_.xyz[0, cas] - centroid, axis=1))[:85]]
+    resids = sorted(complex_.topology.atom(index).residue.resSeq for index in closest)
+
+    random = np.random.RandomState(seed)
+    xyz = complex_.xyz + 0.02 * random.standard_normal((n_frames,) + complex_.xyz.shape[1:]).astype(np.float32)
+    return md.Trajectory(xyz, complex_.topology), ligand_name, resids
+
+
+def legacy_mean_dist(traj, ligand_atoms, pocket_atoms, pocket_missing):
+    """The pair-list computation previously inlined in compute_simple_interaction_features."""
+    pairs = np.zeros(shape=(8500, 2), dtype=int, order='C')
+    index = 0
+    for ligand_atom in ligand_atoms:
+        for pocket_atom, missing in zip(pocket_atoms, pocket_missing):
+            if not missing:
+                pairs[index] = [ligand_atom, pocket_atom]
+            index += 1
+    pairs = pairs[~np.all(pairs == 0, axis=1)]
+    distances = md.compute_distances(traj, pairs)
+    mean_dist = []
+    for frame in distances:
+        mean_dist.append(np.sum(frame) / (len(ligand_atoms) * len(pocket_atoms)))
+    return np.array(mean_dist)
+
+
+def kernel_mean_dist(traj, ligand_atoms, pocket_atoms, pocket_missing):
+    """The broadcasted kernel, reducing to the same mean as compute_simple_interaction_features."""
+    features = pocket_distance_kernel(traj.xyz, ligand_atoms, pocket_atoms, pocket_missing,
+                                      statistics=['per_residue'])
+    return np.nansum(features['per_residue'], axis=1) / len(pocket_atoms)
+
+
+def best_time(function, repeats, *args):
+    """Return the best wall time (in seconds) over several calls and the last result."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    ligands = sorted(os.path.basename(path)[len('cAbl-'):-len('.pdb')]
+                     for path in glob.glob(os.path.join(BENCHMARK, 'receptors', 'cAbl-*_nowat.pdb')))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--frames', type=int, default=1000, help='number of frames per complex')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed calls per complex')
+    parser.add_argument('--ligands', nargs='+', default=ligands, help='complexes to benchmark')
+    args = parser.parse_args()
+
+    print('{:>20s} {:>8s} {:>12s} {:>12s} {:>8s}'.format('complex', 'pairs', 'legacy (ms)', 'kernel (ms)',
+                                                          'speedup'))
+    for ligand in args.ligands:
+        traj, ligand_name, resids = load_complex(ligand, args.frames)
+        # atom resolution is shared by both implementations and is not timed
+        atoms = resolve_interaction_atoms(traj.topology, 'A', ligand_name, resids)
+        n_pairs = len(atoms[0]) * len(resids)
+        legacy_time, legacy = best_time(legacy_mean_dist, args.repeats, traj, *atoms)
+        kernel_time, kernel = best_time(kernel_mean_dist, args.repeats, traj, *atoms)
+        assert np.allclose(legacy, kernel, atol=1e-5)
+        print('{:>20s} {:8d} {:12.2f} {:12.2f} {:8.1f}'.format(ligand, n_pairs, legacy_time * 1000,
+                                                               kernel_time * 1000, legacy_time / kernel_time))
+
+
+if __name__ == '__main__':
+    main()
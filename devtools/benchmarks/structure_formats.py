@@ -0,0 +1,100 @@
+"""
+Benchmark the download size and parse time of structure formats.
+
+For each test entry of the repository (3PP0, 3RCD and 1M17 by default), the legacy PDB text file and
+the mmCIF file are downloaded from RCSB, with and without gzip compression on the wire, and parsed with
+mdtraj. The PDB text path (uncompressed download and text parse, as kinomodel used to do) is compared
+with gzip transfer and with the native binary cache written by kinomodel.structures.load_structure.
+
+The report is written as JSON.
+
+Usage:
+
+    python devtools/benchmarks/structure_formats.py [--pdb-ids 3PP0 3RCD 1M17] [--repeats 3]
+                                                    [--output structure-formats.json]
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import urllib.request
+
+import mdtraj as md
+import numpy as np
+
+from kinomodel.structures import DEFAULT_BASE_URL, FORMATS, read_parsed_structure, save_parsed_structure
+from kinomodel.utils import read_url
+
+PDB_IDS = ['3PP0', '3RCD', '1M17']
+
+
+def download(url, compressed):
+    """Return the contents of a URL, the bytes transferred and the download time (in s)."""
+    start = time.perf_counter()
+    if compressed:
+        contents, transferred = read_url(url)
+    else:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            contents = response.read()
+        transferred = len(contents)
+
+    return contents, transferred, time.perf_counter() - start
+
+
+def parse_time(load, path, repeats):
+    """Return the median time (in s) of loading a file."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load(path)
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the structure formats used by kinomodel')
+    parser.add_argument('--pdb-ids', nargs='+', default=PDB_IDS, help='the PDB entries')
+    parser.add_argument('--repeats', type=int, default=3, help='the number of parses of each file')
+    parser.add_argument('--output', default='structure-formats.json', help='the JSON report')
+    args = parser.parse_args()
+
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        for pdbid in args.pdb_ids:
+            record = {'pdb': pdbid}
+            for fmt in ('pdb', 'cif'):
+                url = '{}/{}'.format(DEFAULT_BASE_URL, FORMATS[fmt][0].format(pdbid))
+                contents, plain, plain_time = download(url, compressed=False)
+                _, compressed, compressed_time = download(url, compressed=True)
+                path = os.path.join(directory, pdbid + FORMATS[fmt][1])
+                with open(path, 'wb') as outfile:
+                    outfile.write(contents)
+                record[fmt] = {'bytes': plain, 'download_s': plain_time, 'gzip_bytes': compressed,
+                               'gzip_download_s': compressed_time, 'parse_s': parse_time(md.load, path, args.repeats)}
+
+            binary = os.path.join(directory, pdbid + '.npz')
+            save_parsed_structure(md.load(os.path.join(directory, pdbid + '.pdb')), binary)
+            record['binary'] = {'bytes': os.path.getsize(binary),
+                                'parse_s': parse_time(read_parsed_structure, binary, args.repeats)}
+            record['speedup'] = record['pdb']['parse_s'] / record['binary']['parse_s']
+            records.append(record)
+            print('{}  pdb {:8d} B (gzip {:8d} B) {:6.3f} s | cif {:8d} B (gzip {:8d} B) {:6.3f} s | '
+                  'binary {:8d} B {:6.3f} s ({:.1f}x)'.format(
+                      pdbid, record['pdb']['bytes'], record['pdb']['gzip_bytes'], record['pdb']['parse_s'],
+                      record['cif']['bytes'], record['cif']['gzip_bytes'], record['cif']['parse_s'],
+                      record['binary']['bytes'], record['binary']['parse_s'], record['speedup']))
+
+    report = {'python': sys.version, 'platform': platform.platform(), 'mdtraj': md.__version__,
+              'repeats': args.repeats, 'records': records}
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
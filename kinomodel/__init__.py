@@ -2,9 +2,27 @@
 # Safe to remove with Python 3-only code
 from __future__ import absolute_import
 
-# Handle versioneer
-from ._version import get_versions
-versions = get_versions()
-__version__ = versions['version']
-__git_revision__ = versions['full-revisionid']
-del get_versions, versions
+# Subpackages are imported on first access (PEP 562), so that importing kinomodel, or running one of
+# its command-line tools, only loads what is used; heavy dependencies (mdtraj, openeye, pdbfixer) are
+# imported inside the functions that need them.
+_SUBMODULES = ['analysis', 'cv', 'datasets', 'docking', 'features', 'instrumentation', 'ml', 'models', 'structures',
+               'utils']
+
+
+def __getattr__(name):
+    import importlib
+
+    if name in ('__version__', '__git_revision__'):
+        # versioneer writes a static _version.py into builds; in a source checkout it may run git,
+        # so the version is only resolved when it is asked for
+        from ._version import get_versions
+        versions = get_versions()
+        globals().update(__version__=versions['version'], __git_revision__=versions['full-revisionid'])
+        return globals()[name]
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + ['__version__', '__git_revision__'] + _SUBMODULES)
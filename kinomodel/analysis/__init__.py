@@ -0,0 +1,7 @@
+"""
+analysis
+Analysis of kinase structures, simulations and free energy calculations.
+"""
+
+from .states import (MISSING, DFG_STATES, AC_STATES, classify_dfg, classify_ac, classify_states, state_populations,
+                     store_state_populations)
@@ -0,0 +1,198 @@
+"""
+states.py
+Assignment of DFG and alphaC-helix conformational states to kinase structures and trajectory frames.
+
+States are assigned from the distances computed by features.protein, with vectorized rules, so that
+arrays of millions of frames are classified at once and feature stores are classified chunk by chunk.
+States are stored as int8, with -1 for frames whose features are missing.
+
+The DFG state follows the spatial criteria of Modi and Dunbrack (PNAS 2019), based on the distances
+of the DFG-Phe CZ to the CA of the alphaC-Glu+4 residue (DFG_conf1) and of the beta3-Lys (DFG_conf2):
+
+    DFG-in     DFG_conf1 <= 1.1 nm and DFG_conf2 >= 1.1 nm
+    DFG-out    DFG_conf1 >  1.1 nm and DFG_conf2 <= 1.4 nm
+    DFG-inter  DFG_conf1 <= 1.1 nm and DFG_conf2 <  1.1 nm
+    other      DFG_conf1 >  1.1 nm and DFG_conf2 >  1.4 nm
+
+The alphaC helix is in when the beta3-Lys NZ is within 0.4 nm of either carboxylate oxygen of the
+alphaC-Glu (K_E1, K_E2), that is when the salt bridge is formed, and out otherwise.
+
+"""
+
+MISSING = -1
+DFG_STATES = ['DFG-in', 'DFG-out', 'DFG-inter', 'DFG-other']
+AC_STATES = ['aC-in', 'aC-out']
+
+
+def _column(distances, name):
+    """Return a distance column, with missing values (NaN, or 0 for features computed without atoms) as NaN."""
+    import numpy as np
+    from kinomodel.features.protein import dis_names
+
+    values = np.asarray(distances)[..., dis_names.index(name)].astype(np.float32)
+    # features.protein computes features with missing atoms on atom 0, which gives a zero distance
+    values[values == 0] = np.nan
+    return values
+
+
+def classify_dfg(distances, in_cutoff=1.1, out_cutoff=1.4):
+    """
+    Assign the DFG state of every frame.
+
+    Parameters
+    ----------
+    distances : np.ndarray, shape (..., 5)
+        Distances (in nm), as returned by compute_simple_protein_features.
+    in_cutoff : float, optional, default=1.1
+        The DFG_conf1 and DFG_conf2 cutoff (in nm) of the DFG-in and DFG-inter states.
+    out_cutoff : float, optional, default=1.4
+        The largest DFG_conf2 (in nm) of the DFG-out state.
+
+    Returns
+    -------
+    states : np.ndarray of int8, shape (...)
+        The index of the state in DFG_STATES, or -1 if DFG_conf1 or DFG_conf2 is missing.
+
+    """
+    import numpy as np
+
+    d1, d2 = _column(distances, 'DFG_conf1'), _column(distances, 'DFG_conf2')
+    states = np.full(d1.shape, 3, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        near = d1 <= in_cutoff
+        states[near & (d2 >= in_cutoff)] = 0
+        states[~near & (d2 <= out_cutoff)] = 1
+        states[near & (d2 < in_cutoff)] = 2
+    states[np.isnan(d1) | np.isnan(d2)] = MISSING
+
+    return states
+
+
+def classify_ac(distances, cutoff=0.4):
+    """
+    Assign the alphaC-helix state of every frame from the K-E salt bridge.
+
+    Parameters
+    ----------
+    distances : np.ndarray, shape (..., 5)
+        Distances (in nm), as returned by compute_simple_protein_features.
+    cutoff : float, optional, default=0.4
+        The largest salt bridge distance (in nm) of the aC-in state.
+
+    Returns
+    -------
+    states : np.ndarray of int8, shape (...)
+        The index of the state in AC_STATES, or -1 if both K_E1 and K_E2 are missing.
+
+    """
+    import numpy as np
+
+    salt_bridge = np.fmin(_column(distances, 'K_E1'), _column(distances, 'K_E2'))
+    states = np.ones(salt_bridge.shape, dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        states[salt_bridge <= cutoff] = 0
+    states[np.isnan(salt_bridge)] = MISSING
+
+    return states
+
+
+def classify_states(distances, **kwargs):
+    """
+    Assign the DFG and alphaC-helix states of every frame.
+
+    Parameters
+    ----------
+    distances : np.ndarray, shape (..., 5)
+        Distances (in nm), as returned by compute_simple_protein_features.
+    kwargs : optional
+        Cutoffs passed to classify_dfg (in_cutoff, out_cutoff) and classify_ac (ac_cutoff as cutoff).
+
+    Returns
+    -------
+    states : dict of str: np.ndarray of int8
+        'dfg' (indices in DFG_STATES) and 'ac' (indices in AC_STATES), -1 where features are missing.
+
+    """
+    dfg_kwargs = {name: kwargs[name] for name in ('in_cutoff', 'out_cutoff') if name in kwargs}
+    ac_kwargs = {'cutoff': kwargs['ac_cutoff']} if 'ac_cutoff' in kwargs else {}
+
+    return {'dfg': classify_dfg(distances, **dfg_kwargs), 'ac': classify_ac(distances, **ac_kwargs)}
+
+
+def state_populations(states, n_states):
+    """
+    Return the population of each state.
+
+    Parameters
+    ----------
+    states : np.ndarray of int
+        States, with -1 for missing frames.
+    n_states : int
+        The number of states (e.g. len(DFG_STATES)).
+
+    Returns
+    -------
+    populations : np.ndarray of float, shape (n_states,)
+        The fraction of assigned frames in each state (NaN if no frame is assigned).
+    n_missing : int
+        The number of frames without a state.
+
+    """
+    import numpy as np
+
+    states = np.asarray(states).ravel()
+    counts = np.bincount(states[states >= 0].astype(np.intp), minlength=n_states)[:n_states]
+    total = counts.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        populations = counts / total if total else np.full(n_states, np.nan)
+
+    return populations, int((states < 0).sum())
+
+
+def store_state_populations(path, batch_size=1048576, **kwargs):
+    """
+    Return the state populations of every trajectory of a feature store, reading it chunk by chunk.
+
+    Parameters
+    ----------
+    path : str
+        The directory of a feature store (see features.store.FeatureStore).
+    batch_size : int, optional, default=1048576
+        The maximum number of frames read at a time.
+    kwargs : optional
+        Cutoffs passed to classify_states.
+
+    Returns
+    -------
+    populations : pandas.DataFrame
+        One row per (pdb, chain): the number of frames, the fraction of assigned frames in every DFG and
+        alphaC state, and the number of frames with a missing DFG or alphaC state.
+
+    """
+    import numpy as np
+    import pandas as pd
+    from kinomodel.features.protein import dis_names
+    from kinomodel.features.store import iter_trajectories
+
+    counts = {}
+    for _, chunk in iter_trajectories(path, columns=dis_names, batch_size=batch_size):
+        states = classify_states(chunk[dis_names].values, **kwargs)
+        key = (chunk['pdb'].iloc[0], chunk['chain'].iloc[0])
+        # counts of the states, with missing frames counted in the last bin
+        dfg = np.bincount(np.where(states['dfg'] < 0, len(DFG_STATES), states['dfg']), minlength=len(DFG_STATES) + 1)
+        ac = np.bincount(np.where(states['ac'] < 0, len(AC_STATES), states['ac']), minlength=len(AC_STATES) + 1)
+        counts[key] = counts.get(key, 0) + np.concatenate([dfg, ac])
+
+    rows = []
+    for (pdb, chain), trajectory_counts in counts.items():
+        dfg, ac = trajectory_counts[:len(DFG_STATES) + 1], trajectory_counts[len(DFG_STATES) + 1:]
+        row = {'pdb': pdb, 'chain': chain, 'n_frames': int(dfg.sum())}
+        for names, state_counts in ((DFG_STATES, dfg), (AC_STATES, ac)):
+            assigned = state_counts[:-1].sum()
+            for name, count in zip(names, state_counts[:-1]):
+                row[name] = count / assigned if assigned else np.nan
+        row['DFG-missing'], row['aC-missing'] = int(dfg[-1]), int(ac[-1])
+        rows.append(row)
+
+    columns = ['pdb', 'chain', 'n_frames'] + DFG_STATES + AC_STATES + ['DFG-missing', 'aC-missing']
+    return pd.DataFrame(rows, columns=columns)
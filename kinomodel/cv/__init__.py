@@ -1 +1,6 @@
-#
+"""
+cv
+Collective variables of kinase conformation for enhanced sampling.
+"""
+
+from .kinase import kinase_cv_atoms, create_kinase_cv_force, get_cv_values
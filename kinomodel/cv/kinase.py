@@ -0,0 +1,135 @@
+"""
+kinase.py
+OpenMM collective variables of kinase conformation.
+
+The 8 dihedrals and 5 distances computed after the fact by features.protein are defined here as
+OpenMM forces, so they can be evaluated (and biased) by the engine during a simulation. The atoms
+of every collective variable are resolved from the KLIFS pocket numbering exactly as in
+features.protein.resolve_protein_feature_atoms; collective variables with missing atoms are left out.
+
+"""
+
+
+def _mdtraj_topology(topology):
+    """Return an mdtraj topology from an mdtraj or OpenMM topology."""
+    import mdtraj as md
+
+    if isinstance(topology, md.Topology):
+        return topology
+
+    return md.Topology.from_openmm(topology)
+
+
+def kinase_cv_atoms(topology, chainid, numbering):
+    """
+    Return the atoms of the kinase collective variables that can be computed for a structure.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology or simtk.openmm.app.Topology
+        The topology of the system; atom indices are those of the system.
+    chainid : str
+        The chain index of the kinase.
+    numbering : list of int
+        The residue indices of the 85 pocket residues specific to the structure (0 for gaps).
+
+    Returns
+    -------
+    atoms : dict of str: tuple of int
+        The four atoms of each dihedral and the two atoms of each distance, keyed by the names in
+        features.protein.dih_names and features.protein.dis_names, in that order.
+
+    """
+    from kinomodel.features.protein import resolve_protein_feature_atoms, dih_names, dis_names
+
+    dih, dis, dih_missing, dis_missing = resolve_protein_feature_atoms(_mdtraj_topology(topology), chainid, numbering)
+    atoms = {}
+    for names, indices, missing in ((dih_names, dih, dih_missing), (dis_names, dis, dis_missing)):
+        for name, feature_atoms, feature_missing in zip(names, indices, missing):
+            if not feature_missing.any():
+                atoms[name] = tuple(int(index) for index in feature_atoms)
+
+    return atoms
+
+
+def create_kinase_cv_force(topology, klifs=None, chainid=None, numbering=None, names=None, energy='0',
+                           periodic=False):
+    """
+    Create an OpenMM force whose collective variables are the kinase dihedrals and distances.
+
+    Each collective variable is a single-bond CustomCompoundBondForce, evaluating dihedral(p1,p2,p3,p4)
+    (in radians) or distance(p1,p2) (in nm). They are gathered in a CustomCVForce, whose energy expression
+    can be any function of the collective variables, e.g. a restraint '0.5*k*(K_E1-0.4)^2' with a global
+    parameter k added by the caller.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology or simtk.openmm.app.Topology
+        The topology of the system; atom indices are those of the system.
+    klifs : kinomodel.features.klifs.Klifs, optional
+        The KLIFS record of the kinase, giving the chain and the pocket numbering.
+    chainid : str, optional
+        The chain index of the kinase, if klifs is not given.
+    numbering : list of int, optional
+        The residue indices of the 85 pocket residues (0 for gaps), if klifs is not given.
+    names : list of str, optional
+        The collective variables to define (see features.protein.dih_names and dis_names). All those
+        whose atoms are present by default.
+    energy : str, optional, default='0'
+        The energy expression of the force (in kJ/mol); the default leaves the dynamics unchanged.
+    periodic : bool, optional, default=False
+        If True, distances and dihedrals use periodic boundary conditions.
+
+    Returns
+    -------
+    force : simtk.openmm.CustomCVForce
+        The force, with one collective variable per feature, in the order of dih_names and dis_names.
+
+    """
+    from simtk import openmm
+    from kinomodel.features.protein import dih_names
+
+    if klifs is not None:
+        chainid, numbering = klifs.chain, klifs.numbering
+    if chainid is None or numbering is None:
+        raise ValueError('Either a KLIFS record or a chain and a numbering must be given')
+    atoms = kinase_cv_atoms(topology, chainid, numbering)
+    if names is not None:
+        unknown = [name for name in names if name not in atoms]
+        if unknown:
+            raise ValueError('Collective variables {} cannot be defined for this structure'.format(', '.join(unknown)))
+        atoms = {name: atoms[name] for name in atoms if name in names}
+
+    force = openmm.CustomCVForce(energy)
+    for name, cv_atoms in atoms.items():
+        if name in dih_names:
+            cv = openmm.CustomCompoundBondForce(4, 'dihedral(p1,p2,p3,p4)')
+        else:
+            cv = openmm.CustomCompoundBondForce(2, 'distance(p1,p2)')
+        cv.addBond(list(cv_atoms), [])
+        cv.setUsesPeriodicBoundaryConditions(periodic)
+        force.addCollectiveVariable(name, cv)
+
+    return force
+
+
+def get_cv_values(force, context):
+    """
+    Return the current values of the collective variables of a force.
+
+    Parameters
+    ----------
+    force : simtk.openmm.CustomCVForce
+        A force created by create_kinase_cv_force and added to the system of the context.
+    context : simtk.openmm.Context
+        The context to evaluate the collective variables in.
+
+    Returns
+    -------
+    values : dict of str: float
+        The value of every collective variable (dihedrals in radians, distances in nm).
+
+    """
+    values = force.getCollectiveVariableValues(context)
+
+    return {force.getCollectiveVariableName(i): float(value) for i, value in enumerate(values)}
@@ -1 +1,6 @@
-#
+"""
+datasets
+Retrieval and indexing of kinase:inhibitor binding affinity datasets.
+"""
+
+from .affinity import MEASURES, canonical_smiles, read_affinities, build_affinity_store, AffinityStore
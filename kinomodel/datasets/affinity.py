@@ -0,0 +1,433 @@
+"""
+affinity.py
+An indexed, memory-mapped store of kinase:inhibitor binding affinities.
+
+Affinity tables exported from ChEMBL, KinomeScan or Davis-style datasets are read into records of
+(KLIFS kinase_ID, canonical isomeric SMILES, pAffinity, measure, source), where pAffinity is -log10 of
+the affinity in M. A store is a directory of NumPy arrays holding the records sorted by (kinase, ligand)
+pair, and the offsets of the records of every pair. Arrays are memory-mapped when the store is opened,
+and pairs are found through hash tables, so looking up the affinity of a pair does not depend on the
+size of the store.
+
+"""
+
+import json
+import os
+
+MEASURES = ['Kd', 'Ki', 'IC50', 'EC50']
+# factors converting affinities to M
+UNITS = {'M': 1.0, 'mM': 1e-3, 'uM': 1e-6, 'nM': 1e-9, 'pM': 1e-12}
+AGGREGATES = ('median', 'mean', 'min', 'max')
+RECORD_COLUMNS = ['kinase_id', 'ligand_id', 'p_affinity', 'measure', 'source']
+
+
+def canonical_smiles(smiles):
+    """
+    Return the canonical isomeric SMILES of a molecule.
+
+    Parameters
+    ----------
+    smiles : str
+        The SMILES of the molecule.
+
+    Returns
+    -------
+    smiles : str
+        The canonical isomeric SMILES generated by OpenEye.
+
+    """
+    from openeye import oechem
+
+    molecule = oechem.OEGraphMol()
+    if not oechem.OESmilesToMol(molecule, smiles):
+        raise ValueError('Invalid SMILES: {}'.format(smiles))
+
+    return oechem.OECreateIsoSmiString(molecule)
+
+
+def _p_affinity(values, units):
+    """Convert affinities to -log10 of the affinity in M; 'p' units are already -log10 values."""
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    units = np.broadcast_to(np.asarray(units, dtype=object), values.shape)
+    factors = np.array([UNITS.get(unit, np.nan) if unit != 'p' else 1.0 for unit in units])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        converted = np.where(values > 0, -np.log10(values * factors), np.nan)
+
+    return np.where(units == 'p', values, converted)
+
+
+def read_affinities(path, kinase_column, smiles_column, value_column, units='nM', units_column=None, measure='Kd',
+                    measure_column=None, relation_column=None, kinase_ids=None, source=None,
+                    canonicalize=canonical_smiles, sep=None, chunksize=100000):
+    """
+    Read the affinities of a local CSV or TSV dump into records.
+
+    Tables must have one row per measurement; wide tables (e.g. the kinase x compound matrix of
+    Davis et al.) can be reshaped with pandas.melt and passed as a DataFrame.
+
+    Parameters
+    ----------
+    path : str or pandas.DataFrame
+        The CSV (or TSV, by extension) file, or an already loaded table.
+    kinase_column : str
+        The column identifying the kinase.
+    smiles_column : str
+        The column with the SMILES of the ligand.
+    value_column : str
+        The column with the affinity.
+    units : str, optional, default='nM'
+        The units of the affinities ('M', 'mM', 'uM', 'nM', 'pM', or 'p' for -log10 values).
+    units_column : str, optional
+        A column with the units of every row (e.g. standard_units in ChEMBL), instead of units.
+    measure : str, optional, default='Kd'
+        The kind of affinity (see MEASURES).
+    measure_column : str, optional
+        A column with the kind of affinity of every row (e.g. standard_type in ChEMBL), instead of measure.
+    relation_column : str, optional
+        A column with the relation of the values (e.g. standard_relation in ChEMBL); only '=' rows are kept.
+    kinase_ids : dict, optional
+        Maps the values of kinase_column to KLIFS kinase_IDs; rows of other kinases are dropped.
+        By default, kinase_column holds KLIFS kinase_IDs.
+    source : str, optional
+        The name of the dataset. The file name by default.
+    canonicalize : callable, optional, default=canonical_smiles
+        Canonicalizes SMILES; rows with invalid SMILES are dropped. None if SMILES are already canonical.
+    sep : str, optional
+        The field separator. Inferred from the extension by default.
+    chunksize : int, optional, default=100000
+        The number of rows read at a time.
+
+    Returns
+    -------
+    affinities : pandas.DataFrame
+        One row per measurement: kinase_id, smiles, p_affinity, measure and source.
+
+    """
+    import logging
+    import numpy as np
+    import pandas as pd
+
+    if measure_column is None and measure not in MEASURES:
+        raise ValueError('Unknown measure {}, expected one of {}'.format(measure, ', '.join(MEASURES)))
+    if units_column is None and units not in UNITS and units != 'p':
+        raise ValueError('Unknown units {}'.format(units))
+
+    if isinstance(path, pd.DataFrame):
+        chunks, source = [path], source or 'table'
+    else:
+        if sep is None:
+            sep = '\t' if os.path.splitext(path)[1].lower() in ('.tsv', '.tab', '.txt') else ','
+        columns = [column for column in (kinase_column, smiles_column, value_column, units_column, measure_column,
+                                         relation_column) if column is not None]
+        chunks = pd.read_csv(path, sep=sep, usecols=columns, chunksize=chunksize)
+        source = source or os.path.basename(path)
+
+    canonical = {}
+    tables = []
+    n_rows, n_invalid = 0, 0
+    for chunk in chunks:
+        n_rows += len(chunk)
+        chunk = chunk.dropna(subset=[kinase_column, smiles_column, value_column])
+        if relation_column is not None:
+            chunk = chunk[chunk[relation_column].astype(str).str.strip("'") == '=']
+        measures = chunk[measure_column].values if measure_column is not None else np.full(len(chunk), measure)
+        if kinase_ids is not None:
+            kinases = chunk[kinase_column].map(kinase_ids).values
+        else:
+            kinases = chunk[kinase_column].values
+        p_affinity = _p_affinity(pd.to_numeric(chunk[value_column], errors='coerce').values,
+                                 chunk[units_column].values if units_column is not None else units)
+
+        smiles = []
+        for molecule in chunk[smiles_column].astype(str):
+            if molecule not in canonical:
+                try:
+                    canonical[molecule] = canonicalize(molecule) if canonicalize is not None else molecule
+                except ValueError:
+                    canonical[molecule] = None
+                    n_invalid += 1
+            smiles.append(canonical[molecule])
+
+        table = pd.DataFrame({'kinase_id': kinases, 'smiles': smiles, 'p_affinity': p_affinity,
+                              'measure': measures, 'source': source})
+        keep = (table['kinase_id'].notna() & table['smiles'].notna() & np.isfinite(table['p_affinity'])
+                & table['measure'].isin(MEASURES))
+        tables.append(table[keep])
+
+    columns = ['kinase_id', 'smiles', 'p_affinity', 'measure', 'source']
+    affinities = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
+    affinities['kinase_id'] = affinities['kinase_id'].astype(np.int64)
+    if n_invalid:
+        logging.warning('{} SMILES of {} could not be parsed'.format(n_invalid, source))
+    if len(affinities) < n_rows:
+        logging.info('{} of {} rows of {} were kept'.format(len(affinities), n_rows, source))
+
+    return affinities[columns]
+
+
+def build_affinity_store(path, affinities):
+    """
+    Write an affinity store.
+
+    The store is written to a temporary directory and renamed into place, replacing any store at path.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the store.
+    affinities : pandas.DataFrame or list of pandas.DataFrame
+        Records, as returned by read_affinities.
+
+    Returns
+    -------
+    store : AffinityStore
+        The new store.
+
+    """
+    import shutil
+    import tempfile
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(affinities, pd.DataFrame):
+        affinities = pd.concat(list(affinities), ignore_index=True)
+    smiles = sorted(set(affinities['smiles']))
+    sources = sorted(set(affinities['source']))
+    ligand_ids = {molecule: i for i, molecule in enumerate(smiles)}
+    source_ids = {name: i for i, name in enumerate(sources)}
+
+    records = {
+        'kinase_id': affinities['kinase_id'].values.astype(np.int32),
+        'ligand_id': np.array([ligand_ids[molecule] for molecule in affinities['smiles']], dtype=np.int32),
+        'p_affinity': affinities['p_affinity'].values.astype(np.float32),
+        'measure': np.array([MEASURES.index(measure) for measure in affinities['measure']], dtype=np.int8),
+        'source': np.array([source_ids[name] for name in affinities['source']], dtype=np.int8),
+    }
+    # records of a pair are contiguous; pairs are sorted by their key
+    keys = _pair_keys(records['kinase_id'], records['ligand_id'])
+    order = np.argsort(keys, kind='stable')
+    records = {name: values[order] for name, values in records.items()}
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        for name, values in records.items():
+            np.save(os.path.join(temporary, name + '.npy'), values)
+        np.save(os.path.join(temporary, 'pair_key.npy'), keys[starts])
+        np.save(os.path.join(temporary, 'pair_offset.npy'), np.r_[starts, len(keys)].astype(np.int64))
+        with open(os.path.join(temporary, 'metadata.json'), 'w') as outfile:
+            json.dump({'measures': MEASURES, 'sources': sources, 'smiles': smiles}, outfile)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(temporary, path)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+    return AffinityStore(path)
+
+
+def _pair_keys(kinase_ids, ligand_ids):
+    """Return the int64 keys of (kinase_id, ligand_id) pairs."""
+    import numpy as np
+
+    return (np.asarray(kinase_ids, dtype=np.int64) << 32) | np.asarray(ligand_ids, dtype=np.int64)
+
+
+class AffinityStore(object):
+
+    def __init__(self, path, canonicalize=canonical_smiles):
+        """A read-only store of binding affinities indexed by KLIFS kinase_ID and canonical SMILES.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the store (see build_affinity_store).
+        canonicalize: callable, optional, default=canonical_smiles
+            Canonicalizes query SMILES that are not found as given. None to only match SMILES exactly.
+
+        """
+        import numpy as np
+
+        self.path = path
+        self.canonicalize = canonicalize
+        with open(os.path.join(path, 'metadata.json')) as infile:
+            metadata = json.load(infile)
+        self.measures = metadata['measures']
+        self.sources = metadata['sources']
+        self.smiles = metadata['smiles']
+        self._records = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in RECORD_COLUMNS}
+        self._offsets = np.load(os.path.join(path, 'pair_offset.npy'), mmap_mode='r')
+        pair_keys = np.load(os.path.join(path, 'pair_key.npy'), mmap_mode='r')
+        self._pairs = dict(zip(pair_keys.tolist(), range(len(pair_keys))))
+        self._ligand_ids = {molecule: i for i, molecule in enumerate(self.smiles)}
+
+    def __len__(self):
+        """The number of (kinase, ligand) pairs."""
+        return len(self._pairs)
+
+    def __contains__(self, pair):
+        return self._pair(*pair) is not None
+
+    @property
+    def n_records(self):
+        """The number of measurements."""
+        return len(self._records['p_affinity'])
+
+    def _ligand_id(self, smiles):
+        """Return the ligand index of a SMILES, canonicalizing it if it is not found as given."""
+        ligand_id = self._ligand_ids.get(smiles)
+        if ligand_id is None and self.canonicalize is not None:
+            try:
+                ligand_id = self._ligand_ids.get(self.canonicalize(smiles))
+            except ValueError:
+                return None
+            # remember the canonical form, so that the SMILES is canonicalized only once
+            if ligand_id is not None:
+                self._ligand_ids[smiles] = ligand_id
+
+        return ligand_id
+
+    def _pair(self, kinase_id, smiles):
+        """Return the index of a pair, or None."""
+        ligand_id = self._ligand_id(smiles)
+        if ligand_id is None:
+            return None
+
+        return self._pairs.get((int(kinase_id) << 32) | ligand_id)
+
+    def records(self, kinase_id, smiles):
+        """Return the measurements of a kinase:ligand pair.
+
+        Parameters
+        ----------
+        kinase_id: int
+            The KLIFS kinase_ID.
+        smiles: str
+            The SMILES of the ligand.
+
+        Returns
+        -------
+        records: pandas.DataFrame
+            One row per measurement: p_affinity, measure and source.
+
+        """
+        import pandas as pd
+
+        pair = self._pair(kinase_id, smiles)
+        begin, end = (self._offsets[pair], self._offsets[pair + 1]) if pair is not None else (0, 0)
+
+        return pd.DataFrame({
+            'p_affinity': self._records['p_affinity'][begin:end],
+            'measure': [self.measures[index] for index in self._records['measure'][begin:end]],
+            'source': [self.sources[index] for index in self._records['source'][begin:end]],
+        })
+
+    def _aggregate(self, pair, measures, aggregate):
+        import numpy as np
+
+        if pair is None:
+            return np.nan
+        begin, end = self._offsets[pair], self._offsets[pair + 1]
+        values = self._records['p_affinity'][begin:end]
+        if measures is not None:
+            values = values[np.isin(self._records['measure'][begin:end], measures)]
+        if not len(values):
+            return np.nan
+
+        return float(getattr(np, aggregate)(values))
+
+    def _measure_indices(self, measure):
+        if measure is None:
+            return None
+        measures = [measure] if isinstance(measure, str) else list(measure)
+
+        return [self.measures.index(name) for name in measures]
+
+    def get(self, kinase_id, smiles, measure=None, aggregate='median'):
+        """Return the affinity of a kinase:ligand pair.
+
+        Parameters
+        ----------
+        kinase_id: int
+            The KLIFS kinase_ID.
+        smiles: str
+            The SMILES of the ligand.
+        measure: str or list of str, optional
+            The kinds of affinity to use (see MEASURES). All by default.
+        aggregate: str, optional, default='median'
+            How measurements of the pair are combined ('median', 'mean', 'min' or 'max' of pAffinity).
+
+        Returns
+        -------
+        p_affinity: float
+            -log10 of the affinity in M, or NaN if the pair has no measurement.
+
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError('Unknown aggregate {}, expected one of {}'.format(aggregate, ', '.join(AGGREGATES)))
+
+        return self._aggregate(self._pair(kinase_id, smiles), self._measure_indices(measure), aggregate)
+
+    def lookup(self, kinase_ids, smiles, measure=None, aggregate='median'):
+        """Return the affinities of many kinase:ligand pairs.
+
+        Parameters
+        ----------
+        kinase_ids: list of int
+            The KLIFS kinase_IDs.
+        smiles: list of str
+            The SMILES of the ligands, one per kinase.
+        measure: str or list of str, optional
+            The kinds of affinity to use (see MEASURES). All by default.
+        aggregate: str, optional, default='median'
+            How measurements of a pair are combined ('median', 'mean', 'min' or 'max' of pAffinity).
+
+        Returns
+        -------
+        p_affinity: np.ndarray of float, shape (n_pairs,)
+            -log10 of the affinities in M, NaN for pairs without measurements.
+
+        """
+        import numpy as np
+
+        if aggregate not in AGGREGATES:
+            raise ValueError('Unknown aggregate {}, expected one of {}'.format(aggregate, ', '.join(AGGREGATES)))
+        if len(kinase_ids) != len(smiles):
+            raise ValueError('Got {} kinases and {} ligands'.format(len(kinase_ids), len(smiles)))
+        measures = self._measure_indices(measure)
+
+        return np.array([self._aggregate(self._pair(kinase_id, molecule), measures, aggregate)
+                         for kinase_id, molecule in zip(kinase_ids, smiles)], dtype=np.float64)
+
+    def join(self, frame, kinase_column='kinase_id', smiles_column='smiles', column='p_affinity', measure=None,
+             aggregate='median'):
+        """Add the affinity of every row of a table, e.g. of featurized kinase:ligand models.
+
+        Parameters
+        ----------
+        frame: pandas.DataFrame
+            The table, with KLIFS kinase_IDs and ligand SMILES.
+        kinase_column, smiles_column: str, optional
+            The columns of frame holding the kinase_IDs and the SMILES.
+        column: str, optional, default='p_affinity'
+            The name of the column added.
+        measure, aggregate: optional
+            See lookup.
+
+        Returns
+        -------
+        frame: pandas.DataFrame
+            A copy of frame with the affinity column (NaN for pairs without measurements).
+
+        """
+        frame = frame.copy()
+        frame[column] = self.lookup(frame[kinase_column].values, frame[smiles_column].values, measure=measure,
+                                    aggregate=aggregate)
+
+        return frame
@@ -2,7 +2,7 @@
 # Borrowed from yank-benchmark: https://github.com/choderalab/yank-benchmark/blob/master/scripts/docking.py
 # Written by AXR, modified by SKA to enable hybrid, cleaned up by JDC
 
-def create_receptor(protein_pdb_path, box):
+def create_receptor(protein_pdb_path, box, receptor_cache=None):
     """Create an OpenEye receptor from a PDB file.
 
     Parameters
@@ -12,6 +12,9 @@ def create_receptor(protein_pdb_path, box):
     box : 1x6 array of float
         The minimum and maximum values of the coordinates of the box
         representing the binding site [xmin, ymin, zmin, xmax, ymax, zmax].
+    receptor_cache : kinomodel.docking.receptor_cache.ReceptorCache or False, optional
+        The cache of prepared receptors, keyed by the PDB file, the box and the toolkit versions.
+        Defaults to the shared cache; False disables caching.
 
     Returns
     -------
@@ -19,19 +22,22 @@ def create_receptor(protein_pdb_path, box):
         The OpenEye receptor object.
     """
 
-    from openeye import oechem
-    input_mol_stream = oechem.oemolistream(protein_pdb_path)
-    protein_oemol = oechem.OEGraphMol()
-    oechem.OEReadMolecule(input_mol_stream, protein_oemol)
+    from openeye import oechem, oedocking
+    from .receptor_cache import cached_receptor
 
-    box = oedocking.OEBox(*box)
-    receptor = oechem.OEGraphMol()
-    oedocking.OEMakeReceptor(receptor, protein_oemol, box)
+    def build():
+        input_mol_stream = oechem.oemolistream(protein_pdb_path)
+        protein_oemol = oechem.OEGraphMol()
+        oechem.OEReadMolecule(input_mol_stream, protein_oemol)
 
-    return receptor
+        receptor = oechem.OEGraphMol()
+        oedocking.OEMakeReceptor(receptor, protein_oemol, oedocking.OEBox(*box))
+        return receptor
 
+    return cached_receptor(protein_pdb_path, list(box), build, cache=receptor_cache)
 
-def create_bound_receptor(protein_pdb_path, ligand_file_path):
+
+def create_bound_receptor(protein_pdb_path, ligand_file_path, receptor_cache=None):
     """Create an OpenEye receptor from a PDB file and ligand file.
 
     Parameters
@@ -41,27 +47,33 @@ def create_bound_receptor(protein_pdb_path, ligand_file_path):
     ligand_file_path : str
         Path to the ligand file (e.g. Tripos mol2).
         Can be any file format supported by openeye.
+    receptor_cache : kinomodel.docking.receptor_cache.ReceptorCache or False, optional
+        The cache of prepared receptors, keyed by the PDB and ligand files and the toolkit versions.
+        Defaults to the shared cache; False disables caching.
     Returns
     -------
     receptor : openeye.oedocking.OEReceptor
         The OpenEye receptor object
     """
     from openeye import oechem, oedocking
+    from .receptor_cache import cached_receptor
 
-    # Load in protein
-    input_mol_stream = oechem.oemolistream(protein_pdb_path)
-    protein_oemol = oechem.OEGraphMol()
-    oechem.OEReadMolecule(input_mol_stream, protein_oemol)
+    def build():
+        # Load in protein
+        input_mol_stream = oechem.oemolistream(protein_pdb_path)
+        protein_oemol = oechem.OEGraphMol()
+        oechem.OEReadMolecule(input_mol_stream, protein_oemol)
 
-    # Load in ligand
-    input_mol_stream = oechem.oemolistream(ligand_file_path)
-    ligand_oemol = oechem.OEGraphMol()
-    oechem.OEReadMolecule(input_mol_stream, ligand_oemol)
+        # Load in ligand
+        input_mol_stream = oechem.oemolistream(ligand_file_path)
+        ligand_oemol = oechem.OEGraphMol()
+        oechem.OEReadMolecule(input_mol_stream, ligand_oemol)
 
-    receptor = oechem.OEGraphMol()
-    oedocking.OEMakeReceptor(receptor, protein_oemol, ligand_oemol)
+        receptor = oechem.OEGraphMol()
+        oedocking.OEMakeReceptor(receptor, protein_oemol, ligand_oemol)
+        return receptor
 
-    return receptor
+    return cached_receptor(protein_pdb_path, ligand_file_path, build, cache=receptor_cache)
 
 def load_receptor(receptor_oeb_path):
     """Load an OpenEye receptor file in oeb format.
@@ -86,7 +98,7 @@ def load_receptor(receptor_oeb_path):
     oedocking.OEReadReceptorFile(receptor, receptor_oeb_path)
     return receptor
 
-def dock_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
+def dock_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2, ligand_cache=None):
     """Run the multi-conformer docker.
 
     Parameters
@@ -100,6 +112,9 @@ def dock_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
         docker (default is 10).
     n_poses : int, optional
         Number of binding poses to return.
+    ligand_cache : kinomodel.docking.ligand_cache.LigandCache or False, optional
+        The cache of charged conformers, reused across runs and receptors.
+        Defaults to the shared cache; False disables caching.
 
     Returns
     -------
@@ -107,7 +122,8 @@ def dock_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
         The docked multi-conformer OpenEye molecule.
     """
     from openeye import oechem, oedocking
-    import openmoltools as moltools
+    from kinomodel.instrumentation import stage
+    from .ligand_cache import get_charged_conformers
 
     if oedocking.OEReceptorHasBoundLigand(receptor):
         dock = oedocking.OEHybrid(oedocking.OEDockMethod_Hybrid2, oedocking.OESearchResolution_High)
@@ -116,17 +132,17 @@ def dock_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
 
     dock.Initialize(receptor)
 
-    molecule_oemol = moltools.openeye.smiles_to_oemol(molecule_smiles)
-    molecule_oemol = moltools.openeye.get_charges(molecule_oemol, keep_confs=n_conformations)
+    molecule_oemol = get_charged_conformers(molecule_smiles, n_conformations=n_conformations, cache=ligand_cache)
 
     docked_oemol = oechem.OEMol()
 
-    dock.DockMultiConformerMolecule(docked_oemol, molecule_oemol, n_poses)
+    with stage('docking', molecule=molecule_smiles, method='dock'):
+        dock.DockMultiConformerMolecule(docked_oemol, molecule_oemol, n_poses)
 
     return docked_oemol
 
 
-def pose_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
+def pose_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2, ligand_cache=None):
     """Run the multi-conformer docker.
 
     Parameters
@@ -140,6 +156,9 @@ def pose_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
         docker (default is 10).
     n_poses : int, optional
         Number of binding poses to return.
+    ligand_cache : kinomodel.docking.ligand_cache.LigandCache or False, optional
+        The cache of charged conformers, reused across runs and receptors.
+        Defaults to the shared cache; False disables caching.
 
     Returns
     -------
@@ -147,16 +166,18 @@ def pose_molecule(receptor, molecule_smiles, n_conformations=10, n_poses=2):
         The docked multi-conformer OpenEye molecule.
     """
     from openeye import oechem, oedocking
+    from kinomodel.instrumentation import stage
+    from .ligand_cache import get_charged_conformers
 
     poser = oedocking.OEPosit()
 
     poser.Initialize(receptor)
 
-    molecule_oemol = moltools.openeye.smiles_to_oemol(molecule_smiles)
-    molecule_oemol = moltools.openeye.get_charges(molecule_oemol, keep_confs=n_conformations)
+    molecule_oemol = get_charged_conformers(molecule_smiles, n_conformations=n_conformations, cache=ligand_cache)
 
     posed_oemol = oechem.OEMol()
 
-    poser.DockMultiConformerMolecule(posed_oemol, molecule_oemol, n_poses)
+    with stage('docking', molecule=molecule_smiles, method='posit'):
+        poser.DockMultiConformerMolecule(posed_oemol, molecule_oemol, n_poses)
 
     return posed_oemol
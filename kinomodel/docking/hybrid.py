@@ -1,4 +1,5 @@
-def hybrid_docking(receptor_path, molecules_path, docked_molecules_path, n_poses=10):
+def hybrid_docking(receptor_path, molecules_path, docked_molecules_path, n_poses=10, n_workers=1, chunk=8,
+                   ligand_cache=None, receptor_cache=None):
     """Automated hybrid docking of small molecules to a receptor.
 
     Parameters
@@ -15,18 +16,61 @@ def hybrid_docking(receptor_path, molecules_path, docked_molecules_path, n_poses
         Number of docked poses to generate
     receptor_filename : str, optional, default=None
         If not None, the pre-prepared receptor is loaded
+    n_workers : int, optional, default=1
+        Number of worker processes docking molecules in parallel. With more than one worker, each worker
+        initializes its own docking object from the receptor once, and docked molecules are written in
+        the order of the input molecules.
+    chunk : int, optional, default=8
+        Number of molecules sent to a worker at a time when n_workers > 1
+    ligand_cache : kinomodel.docking.ligand_cache.LigandCache or False, optional
+        The cache of molecules with conformers and charges, reused across runs and receptors.
+        Defaults to the shared cache; False disables caching.
+    receptor_cache : kinomodel.docking.receptor_cache.ReceptorCache or False, optional
+        The cache of receptors built from a complex, keyed by the complex file and the toolkit versions.
+        Defaults to the shared cache; False disables caching.
 
     TODO: How can this API be improved?
 
     """
-    from .docking import create_receptor, load_receptor, pose_molecule
+    if n_workers < 1:
+        raise ValueError('n_workers must be at least 1, not {}'.format(n_workers))
+
+    from openeye import oechem
+    from .ligand_cache import get_ligand_cache
+
+    receptor = _load_or_create_receptor(receptor_path, receptor_cache)
+    if ligand_cache is None:
+        ligand_cache = get_ligand_cache()
+
+    # Open file for writing docked molecules
+    docked_molecules_ostream = oechem.oemolostream(docked_molecules_path)
+
+    molecules_istream = oechem.oemolistream(molecules_path)
+    if n_workers == 1:
+        dock, omega = _initialize_docking(receptor)
+        for molecule in molecules_istream.GetOEMols():
+            docked_molecule = _dock(dock, omega, molecule, ligand_cache)
+            if docked_molecule is not None:
+                oechem.OEWriteMolecule(docked_molecules_ostream, docked_molecule)
+    else:
+        for docked_molecule in _dock_in_parallel(receptor, molecules_istream.GetOEMols(), n_workers, chunk,
+                                                 ligand_cache):
+            oechem.OEWriteMolecule(docked_molecules_ostream, docked_molecule)
+    docked_molecules_ostream.close()
+
+
+def _load_or_create_receptor(receptor_path, receptor_cache=None):
+    """Load a pre-prepared receptor, or create one from a complex of receptor and reference ligand."""
     from openeye import oedocking, oechem
-    #import openmoltools as moltools # TODO: Bring these methods into this module
+    from .receptor_cache import cached_receptor
 
     # Try to load pre-prepared receptor from specified file
     receptor = oechem.OEGraphMol()
     print('Attempting to load receptor from {}...'.format(receptor_path))
-    if not oedocking.OEReadReceptorFile(receptor, receptor_path):
+    if oedocking.OEReadReceptorFile(receptor, receptor_path):
+        return receptor
+
+    def build():
         # Load complex of receptor and reference ligand
         complex_istream = oechem.oemolistream(receptor_path)
         complex = oechem.OEGraphMol()
@@ -38,55 +82,134 @@ def hybrid_docking(receptor_path, molecules_path, docked_molecules_path, n_poses
         protein = oechem.OEGraphMol()
         water = oechem.OEGraphMol()
         other = oechem.OEGraphMol()
-        if oechem.OESplitMolComplex(ligand, protein, water, other, complex):
-            # Create receptor using bound ligand reference
-            print('Creating receptor using reference ligand...')
-            oedocking.OEMakeReceptor(receptor, protein, ligand)
-            # TODO: We can store prepared receptor file if desired
-            oedocking.OEWriteReceptorFile(receptor, '/home/guoj1/projects/INSPIRE/kinomodel/kinomodel/data/docking/prepared_receptor.oeb')
-
-        else:
+        if not oechem.OESplitMolComplex(ligand, protein, water, other, complex):
             raise Exception('Could not split specified PDB file {} into receptor and reference ligand'.format(receptor_path))
 
-    # Open file for writing docked molecules
-    docked_molecules_ostream = oechem.oemolostream(docked_molecules_path)
+        # Create receptor using bound ligand reference
+        print('Creating receptor using reference ligand...')
+        receptor = oechem.OEGraphMol()
+        oedocking.OEMakeReceptor(receptor, protein, ligand)
+        return receptor
+
+    # the reference ligand is part of the complex file, which is all the key depends on
+    return cached_receptor(receptor_path, b'', build, cache=receptor_cache)
+
+
+def _initialize_docking(receptor):
+    """Create the docking object and the conformer generator used for every molecule."""
+    from openeye import oedocking
 
     # Configure omega
-    # From canonical recipe: https://docs.eyesopen.com/toolkits/cookbook/python/modeling/am1-bcc.html
-    from openeye import oeomega
-    omega = oeomega.OEOmega()
-    omega.SetIncludeInput(False)
-    omega.SetCanonOrder(False)
-    omega.SetSampleHydrogens(True)
-    eWindow = 15.0
-    omega.SetEnergyWindow(eWindow)
-    omega.SetMaxConfs(800)
-    omega.SetRMSThreshold(1.0)
+    from .ligand_cache import create_omega
+    omega = create_omega()
 
     # Dock all molecules requested
     dock_method = oedocking.OEDockMethod_Hybrid2
     dock_resolution = oedocking.OESearchResolution_Standard
     dock = oedocking.OEDock(dock_method, dock_resolution)
     dock.Initialize(receptor)
-    molecules_istream = oechem.oemolistream(molecules_path)
-    molecule = oechem.OEGraphMol()
-    for molecule in molecules_istream.GetOEMols():
-        print("docking", molecule.GetTitle())
-        #docked_molecules = pose_molecule(receptor, molecule, n_poses=n_poses)
-        #molecule = moltools.openeye.get_charges(molecule, keep_confs=10)
-
-        # Generate conformers
-        if not omega(molecule):
-            continue
-
-        # Apply charges
-        from openeye import oequacpac
-        oequacpac.OEAssignCharges(molecule, oequacpac.OEAM1BCCELF10Charges())
-
-        # Dock
-        docked_molecule = oechem.OEGraphMol()
+
+    return dock, omega
+
+
+def _dock(dock, omega, molecule, ligand_cache):
+    """Generate (or load cached) conformers and charges of a molecule and dock it.
+
+    Returns None if no conformer could be generated.
+
+    """
+    from openeye import oechem, oedocking
+    from kinomodel.instrumentation import stage
+    from .ligand_cache import prepare_ligand
+
+    print("docking", molecule.GetTitle())
+    #docked_molecules = pose_molecule(receptor, molecule, n_poses=n_poses)
+
+    # Generate conformers and apply charges
+    molecule = prepare_ligand(molecule, omega=omega, cache=ligand_cache)
+    if molecule is None:
+        return None
+
+    # Dock
+    docked_molecule = oechem.OEGraphMol()
+    with stage('docking', molecule=molecule.GetTitle(), method='hybrid'):
         dock.DockMultiConformerMolecule(docked_molecule, molecule)
-        sdtag = oedocking.OEDockMethodGetName(dock_method)
-        oedocking.OESetSDScore(docked_molecule, dock, sdtag)
-        dock.AnnotatePose(docked_molecule)
-        oechem.OEWriteMolecule(docked_molecules_ostream, docked_molecule)
+    sdtag = oedocking.OEDockMethodGetName(oedocking.OEDockMethod_Hybrid2)
+    oedocking.OESetSDScore(docked_molecule, dock, sdtag)
+    dock.AnnotatePose(docked_molecule)
+
+    return docked_molecule
+
+
+# docking object, conformer generator and ligand cache of a worker process, created once by _initialize_worker
+_worker_docking = None
+
+
+def _initialize_worker(receptor_bytes, ligand_cache):
+    """Initialize the docking object of a worker process from the receptor (in OEB format)."""
+    global _worker_docking
+    from openeye import oechem
+
+    receptor = oechem.OEGraphMol()
+    oechem.OEReadMolFromBytes(receptor, '.oeb', False, receptor_bytes)
+    _worker_docking = _initialize_docking(receptor) + (ligand_cache,)
+
+
+def _dock_chunk(molecules_bytes):
+    """Dock a chunk of molecules (in OEB format) in a worker process; None for molecules that failed."""
+    from openeye import oechem
+
+    dock, omega, ligand_cache = _worker_docking
+    docked = []
+    for molecule_bytes in molecules_bytes:
+        molecule = oechem.OEMol()
+        oechem.OEReadMolFromBytes(molecule, '.oeb', False, molecule_bytes)
+        docked_molecule = _dock(dock, omega, molecule, ligand_cache)
+        docked.append(None if docked_molecule is None else oechem.OEWriteMolToBytes('.oeb', False, docked_molecule))
+
+    return docked
+
+
+def _dock_in_parallel(receptor, molecules, n_workers, chunk, ligand_cache):
+    """Dock molecules on a pool of worker processes, yielding the docked molecules in input order.
+
+    Molecules are sent to the workers in chunks, and at most a few chunks per worker are in flight,
+    so that memory use does not grow with the number of input molecules.
+
+    """
+    import collections
+    import itertools
+    from concurrent.futures import ProcessPoolExecutor
+    from openeye import oechem
+
+    def chunks():
+        molecules_bytes = (oechem.OEWriteMolToBytes('.oeb', False, molecule) for molecule in molecules)
+        while True:
+            molecules_chunk = list(itertools.islice(molecules_bytes, chunk))
+            if not molecules_chunk:
+                return
+            yield molecules_chunk
+
+    receptor_bytes = oechem.OEWriteMolToBytes('.oeb', False, receptor)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_initialize_worker,
+                             initargs=(receptor_bytes, ligand_cache)) as executor:
+        pending = collections.deque()
+        for molecules_chunk in chunks():
+            pending.append(executor.submit(_dock_chunk, molecules_chunk))
+            while len(pending) > 2 * n_workers:
+                for docked_molecule in _read_docked(pending.popleft().result()):
+                    yield docked_molecule
+        while pending:
+            for docked_molecule in _read_docked(pending.popleft().result()):
+                yield docked_molecule
+
+
+def _read_docked(docked):
+    """Convert the docked molecules returned by a worker back into molecules."""
+    from openeye import oechem
+
+    for docked_bytes in docked:
+        if docked_bytes is not None:
+            docked_molecule = oechem.OEGraphMol()
+            oechem.OEReadMolFromBytes(docked_molecule, '.oeb', False, docked_bytes)
+            yield docked_molecule
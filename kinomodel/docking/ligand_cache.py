@@ -0,0 +1,320 @@
+"""
+ligand_cache.py
+An on-disk cache of prepared docking ligands.
+
+Generating Omega conformers and AM1-BCC ELF10 charges is the most expensive step of docking.
+Prepared multi-conformer molecules are stored in OEB format under a key derived from the canonical
+isomeric SMILES of the molecule and the conformer and charge settings, so they are reused across
+runs and receptors. Molecules are appended to shard files, and a SQLite index maps every key to the
+shard, offset and length of its record.
+
+"""
+
+import json
+import os
+
+# Omega settings used for docking (from the canonical recipe:
+# https://docs.eyesopen.com/toolkits/cookbook/python/modeling/am1-bcc.html) and the charge model
+OMEGA_SETTINGS = {
+    'include_input': False,
+    'canon_order': False,
+    'sample_hydrogens': True,
+    'energy_window': 15.0,
+    'max_confs': 800,
+    'rms_threshold': 1.0,
+}
+CHARGE_MODEL = 'AM1BCCELF10'
+
+
+def ligand_cache_key(smiles, settings):
+    """
+    Return the cache key of a prepared molecule.
+
+    Parameters
+    ----------
+    smiles : str
+        The canonical isomeric SMILES of the molecule.
+    settings : dict
+        Everything that determines the prepared molecule (conformer and charge settings, toolkit versions).
+
+    Returns
+    -------
+    key : str
+        A SHA-256 hex digest.
+
+    """
+    import hashlib
+
+    return hashlib.sha256(json.dumps([smiles, settings], sort_keys=True).encode()).hexdigest()
+
+
+class LigandCache(object):
+
+    def __init__(self, root=None, shard_size=256 * 1024**2):
+        """A cache of prepared molecules stored in OEB shards with a SQLite index.
+
+        Parameters
+        ----------
+        root: str, optional
+            The cache directory. Defaults to the 'ligands' directory under KINOMODEL_CACHE_DIR
+            (~/.cache/kinomodel by default).
+        shard_size: int, optional, default=256 MiB
+            Size in bytes beyond which a new shard file is started.
+
+        """
+        import threading
+        from kinomodel.utils import get_cache_dir
+
+        self.root = root if root else get_cache_dir('ligands')
+        self.shard_size = shard_size
+        self._lock = threading.RLock()
+        self._pid = None
+        self._connection = None
+        self._shard = None
+        os.makedirs(os.path.join(self.root, 'shards'), exist_ok=True)
+        with self._lock, self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS molecules '
+                       '(key TEXT PRIMARY KEY, smiles TEXT, shard TEXT, offset INTEGER, length INTEGER)')
+
+    def __getstate__(self):
+        # the lock, the database connection and the current shard are recreated in the receiving process
+        state = dict(self.__dict__)
+        del state['_lock'], state['_connection']
+        state.update(_pid=None, _shard=None)
+        return state
+
+    def __setstate__(self, state):
+        import threading
+
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _db(self):
+        """Return the database connection of the current process (connections must not cross a fork)."""
+        import sqlite3
+
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=60,
+                                               check_same_thread=False)
+            self._pid = os.getpid()
+            # every process appends to shards of its own
+            self._shard = None
+
+        return self._connection
+
+    def get(self, key):
+        """Return the record stored under a key, or None on a miss.
+
+        Parameters
+        ----------
+        key: str
+            The key, as returned by ligand_cache_key.
+
+        Returns
+        -------
+        record: bytes or None
+            The prepared molecule in OEB format.
+
+        """
+        with self._lock:
+            row = self._db().execute('SELECT shard, offset, length FROM molecules WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        shard, offset, length = row
+        try:
+            with open(os.path.join(self.root, 'shards', shard), 'rb') as infile:
+                infile.seek(offset)
+                record = infile.read(length)
+        except FileNotFoundError:
+            return None
+
+        return record if len(record) == length else None
+
+    def put(self, key, record, smiles=None):
+        """Store a record under a key.
+
+        The record is appended to a shard file before it is added to the index, so an interrupted
+        write never leaves an index entry pointing to an incomplete record.
+
+        Parameters
+        ----------
+        key: str
+            The key, as returned by ligand_cache_key.
+        record: bytes
+            The prepared molecule in OEB format.
+        smiles: str, optional
+            The SMILES of the molecule, stored in the index for reference.
+
+        """
+        import time
+
+        with self._lock:
+            db = self._db()
+            path = os.path.join(self.root, 'shards', self._shard) if self._shard else None
+            if path is None or os.path.getsize(path) + len(record) > self.shard_size:
+                self._shard = 'shard-{:.0f}-{}.oeb'.format(time.time() * 1e6, os.getpid())
+                path = os.path.join(self.root, 'shards', self._shard)
+            with open(path, 'ab') as outfile:
+                offset = outfile.tell()
+                outfile.write(record)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            with db:
+                db.execute('INSERT OR REPLACE INTO molecules VALUES (?, ?, ?, ?, ?)',
+                           (key, smiles, self._shard, offset, len(record)))
+
+    def __len__(self):
+        with self._lock:
+            return self._db().execute('SELECT COUNT(*) FROM molecules').fetchone()[0]
+
+
+_ligand_cache = None
+
+
+def get_ligand_cache():
+    """Return the ligand cache used by default."""
+    global _ligand_cache
+    if _ligand_cache is None:
+        _ligand_cache = LigandCache()
+
+    return _ligand_cache
+
+
+def set_ligand_cache(cache):
+    """Replace the ligand cache used by default.
+
+    Parameters
+    ----------
+    cache: LigandCache
+        The new default cache.
+
+    """
+    global _ligand_cache
+    _ligand_cache = cache
+
+
+def create_omega(settings=OMEGA_SETTINGS):
+    """
+    Create an Omega conformer generator.
+
+    Parameters
+    ----------
+    settings : dict, optional
+        The Omega settings, as in OMEGA_SETTINGS.
+
+    Returns
+    -------
+    omega : openeye.oeomega.OEOmega
+
+    """
+    from openeye import oeomega
+
+    omega = oeomega.OEOmega()
+    omega.SetIncludeInput(settings['include_input'])
+    omega.SetCanonOrder(settings['canon_order'])
+    omega.SetSampleHydrogens(settings['sample_hydrogens'])
+    omega.SetEnergyWindow(settings['energy_window'])
+    omega.SetMaxConfs(settings['max_confs'])
+    omega.SetRMSThreshold(settings['rms_threshold'])
+
+    return omega
+
+
+def prepare_ligand(molecule, omega=None, settings=OMEGA_SETTINGS, cache=None):
+    """
+    Generate the conformers and AM1-BCC ELF10 charges of a molecule, or load them from the cache.
+
+    Parameters
+    ----------
+    molecule : openeye.oechem.OEMol
+        The molecule to prepare.
+    omega : openeye.oeomega.OEOmega, optional
+        A conformer generator configured with settings; created if not given.
+    settings : dict, optional
+        The Omega settings, as in OMEGA_SETTINGS.
+    cache : LigandCache or False, optional
+        The cache of prepared molecules. Defaults to the shared cache; False disables caching.
+
+    Returns
+    -------
+    prepared : openeye.oechem.OEMol or None
+        The charged multi-conformer molecule, or None if no conformer could be generated.
+
+    """
+    from openeye import oechem, oeomega, oequacpac
+    from kinomodel.instrumentation import stage
+
+    if cache is None:
+        cache = get_ligand_cache()
+    key = None
+    if cache is not False:
+        smiles = oechem.OECreateIsoSmiString(molecule)
+        key = ligand_cache_key(smiles, dict(settings, charges=CHARGE_MODEL, omega=oeomega.OEOmegaGetVersion(),
+                                            quacpac=oequacpac.OEQuacPacGetVersion()))
+        record = cache.get(key)
+        if record is not None:
+            prepared = oechem.OEMol()
+            if oechem.OEReadMolFromBytes(prepared, '.oeb', False, record):
+                prepared.SetTitle(molecule.GetTitle())
+                return prepared
+
+    prepared = oechem.OEMol(molecule)
+    # Generate conformers
+    with stage('omega', molecule=molecule.GetTitle()):
+        if not (omega if omega is not None else create_omega(settings))(prepared):
+            return None
+    # Apply charges
+    with stage('charges', molecule=molecule.GetTitle(), conformers=prepared.NumConfs()):
+        oequacpac.OEAssignCharges(prepared, oequacpac.OEAM1BCCELF10Charges())
+
+    if key is not None:
+        cache.put(key, oechem.OEWriteMolToBytes('.oeb', False, prepared), smiles=smiles)
+
+    return prepared
+
+
+def get_charged_conformers(molecule_smiles, n_conformations=10, cache=None):
+    """
+    Return a charged multi-conformer molecule from SMILES with openmoltools, or load it from the cache.
+
+    Parameters
+    ----------
+    molecule_smiles : str
+        The SMILES string of the molecule.
+    n_conformations : int, optional, default=10
+        The number of conformations to keep.
+    cache : LigandCache or False, optional
+        The cache of prepared molecules. Defaults to the shared cache; False disables caching.
+
+    Returns
+    -------
+    molecule_oemol : openeye.oechem.OEMol
+
+    """
+    from openeye import oechem
+    import openmoltools as moltools
+    from kinomodel.instrumentation import stage
+
+    if cache is None:
+        cache = get_ligand_cache()
+    molecule_oemol = moltools.openeye.smiles_to_oemol(molecule_smiles)
+    key = None
+    if cache is not False:
+        smiles = oechem.OECreateIsoSmiString(molecule_oemol)
+        key = ligand_cache_key(smiles, {'method': 'openmoltools.get_charges', 'keep_confs': n_conformations,
+                                        'openmoltools': getattr(moltools, '__version__', None),
+                                        'oechem': oechem.OEChemGetVersion()})
+        record = cache.get(key)
+        if record is not None:
+            prepared = oechem.OEMol()
+            if oechem.OEReadMolFromBytes(prepared, '.oeb', False, record):
+                return prepared
+
+    # openmoltools generates the conformers and charges them in one call
+    with stage('charges', molecule=molecule_smiles, method='openmoltools'):
+        molecule_oemol = moltools.openeye.get_charges(molecule_oemol, keep_confs=n_conformations)
+    if key is not None:
+        cache.put(key, oechem.OEWriteMolToBytes('.oeb', False, molecule_oemol), smiles=smiles)
+
+    return molecule_oemol
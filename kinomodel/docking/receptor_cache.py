@@ -0,0 +1,174 @@
+"""
+receptor_cache.py
+An on-disk cache of prepared docking receptors.
+
+Building a receptor with OEMakeReceptor takes much longer than docking a single molecule, and the same
+receptors are built again and again in screening campaigns against a kinase. Prepared receptors are
+stored in OEB format under a key derived from the contents of the input structure, the reference ligand
+or box that defines the binding site, and the toolkit versions.
+
+"""
+
+import hashlib
+import json
+import os
+
+
+def receptor_cache_key(structure, site, versions):
+    """
+    Return the cache key of a prepared receptor.
+
+    Parameters
+    ----------
+    structure : bytes
+        The contents of the input structure file.
+    site : bytes or list of float
+        The contents of the reference ligand file, or the box of the binding site.
+    versions : dict
+        The versions of the toolkits used to build the receptor.
+
+    Returns
+    -------
+    key : str
+        A SHA-256 hex digest.
+
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(structure).digest())
+    if isinstance(site, bytes):
+        digest.update(b'ligand' + hashlib.sha256(site).digest())
+    else:
+        digest.update(b'box' + json.dumps([float(value) for value in site]).encode())
+    digest.update(json.dumps(versions, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+class ReceptorCache(object):
+
+    def __init__(self, root=None):
+        """A cache of prepared receptors, one OEB file per key.
+
+        Parameters
+        ----------
+        root: str, optional
+            The cache directory. Defaults to the 'receptors' directory under KINOMODEL_CACHE_DIR
+            (~/.cache/kinomodel by default).
+
+        """
+        from kinomodel.utils import get_cache_dir
+
+        self.root = root if root else get_cache_dir('receptors')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        """Return the path of the file a receptor is stored in."""
+        return os.path.join(self.root, '{}.oeb'.format(key))
+
+    def get(self, key):
+        """Return the receptor stored under a key, or None on a miss.
+
+        Parameters
+        ----------
+        key: str
+            The key, as returned by receptor_cache_key.
+
+        Returns
+        -------
+        record: bytes or None
+            The receptor in OEB format.
+
+        """
+        try:
+            with open(self.path(key), 'rb') as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, record):
+        """Store a receptor under a key; concurrent readers never see a partially written file.
+
+        Parameters
+        ----------
+        key: str
+            The key, as returned by receptor_cache_key.
+        record: bytes
+            The receptor in OEB format.
+
+        """
+        from kinomodel.utils import atomic_write
+
+        atomic_write(self.path(key), record)
+
+
+_receptor_cache = None
+
+
+def get_receptor_cache():
+    """Return the receptor cache used by default."""
+    global _receptor_cache
+    if _receptor_cache is None:
+        _receptor_cache = ReceptorCache()
+
+    return _receptor_cache
+
+
+def set_receptor_cache(cache):
+    """Replace the receptor cache used by default.
+
+    Parameters
+    ----------
+    cache: ReceptorCache
+        The new default cache.
+
+    """
+    global _receptor_cache
+    _receptor_cache = cache
+
+
+def cached_receptor(structure_path, site, build, cache=None):
+    """
+    Return a receptor from the cache, or build it and store it.
+
+    Parameters
+    ----------
+    structure_path : str
+        Path to the input structure file.
+    site : str or 1x6 array of float
+        Path to the reference ligand file, or the box of the binding site.
+    build : callable
+        Function returning the receptor (an openeye.oechem.OEGraphMol), called on a miss.
+    cache : ReceptorCache or False, optional
+        The cache of prepared receptors. Defaults to the shared cache; False disables caching.
+
+    Returns
+    -------
+    receptor : openeye.oechem.OEGraphMol
+        The receptor.
+
+    """
+    from openeye import oechem, oedocking
+
+    if cache is None:
+        cache = get_receptor_cache()
+    if cache is False:
+        return build()
+
+    with open(structure_path, 'rb') as infile:
+        structure = infile.read()
+    if isinstance(site, str):
+        with open(site, 'rb') as infile:
+            site = infile.read()
+    key = receptor_cache_key(structure, site, {'oechem': oechem.OEChemGetVersion(),
+                                               'oedocking': oedocking.OEDockingGetVersion()})
+
+    record = cache.get(key)
+    if record is not None:
+        receptor = oechem.OEGraphMol()
+        if oechem.OEReadMolFromBytes(receptor, '.oeb', False, record) and oedocking.OEIsReceptor(receptor):
+            return receptor
+
+    receptor = build()
+    cache.put(key, oechem.OEWriteMolToBytes('.oeb', False, receptor))
+
+    return receptor
@@ -0,0 +1,278 @@
+"""
+atom_index.py
+A persisted map from KLIFS pocket numbering to the atom indices used by the features.
+
+Resolving the atoms of the 8 dihedrals, 5 distances and 85 pocket CAs of a chain means parsing the
+topology and scanning its atoms. The resolved indices only depend on the topology, the chain and the
+KLIFS structure (its pocket numbering), so they are stored as a small npz file per (topology hash,
+chain, KLIFS structure_ID, ligand) and loaded on later calls. The topology hash is the SHA-256 of the
+topology file, so a hit does not require parsing the topology, and trajectories with a separate topology
+file are then read without parsing it at all (see trajectory.iterload). Entries are stored under a
+version derived from the feature definitions, so changing them invalidates the stored indices.
+
+"""
+
+import os
+
+# files whose topology is hashed from their contents (trajectory files may be too large to hash)
+TOPOLOGY_EXTENSIONS = ('.pdb', '.pdb.gz', '.cif', '.gro', '.mol2', '.psf', '.prmtop', '.parm7')
+
+# version of the stored indices; bump it when the way atoms are resolved changes
+INDEX_VERSION = 2
+
+
+def index_version():
+    """Return the version of the stored atom indices: INDEX_VERSION and a digest of the feature atoms."""
+    import hashlib
+    import json
+    from .protein import DIHEDRAL_ATOMS, DISTANCE_ATOMS
+
+    definitions = json.dumps([DIHEDRAL_ATOMS, DISTANCE_ATOMS]).encode()
+    return 'v{}-{}'.format(INDEX_VERSION, hashlib.sha256(definitions).hexdigest()[:12])
+
+
+def topology_source(coords, top=None):
+    """
+    Return the path of the file the topology of a structure or trajectory is read from.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+
+    Returns
+    -------
+    path : str or None
+        The topology file, or None if the topology is in memory or embedded in a trajectory file.
+
+    """
+    if top is not None:
+        return top if isinstance(top, str) else None
+    if isinstance(coords, str) and coords.lower().endswith(TOPOLOGY_EXTENSIONS):
+        return coords
+
+    return None
+
+
+def topology_hash(path):
+    """Return the SHA-256 hex digest of the contents of a topology file."""
+    from kinomodel.structures import file_hash
+
+    return file_hash(path)
+
+
+def resolve_atom_index(topology, chainid, numbering, ligand_name=None):
+    """
+    Resolve the atom indices of the features of a kinase chain.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology of the structure or trajectory to featurize.
+    chainid : str
+        The chain index of the inquiry kinase.
+    numbering : list of int
+        The residue indices of the 85 pocket residues specific to the structure (0 for gaps).
+    ligand_name : str, optional
+        The ligand of the complex, whose heavy atoms are also resolved.
+
+    Returns
+    -------
+    index : dict of str: np.ndarray
+        'dih', 'dis', 'dih_missing' and 'dis_missing' as returned by protein.resolve_protein_feature_atoms,
+        and 'pocket_atoms' and 'pocket_missing', the CA of each pocket residue (0 if missing) and whether it
+        is missing, as returned by interactions.resolve_interaction_atoms; with ligand_name, 'ligand_atoms',
+        the ligand heavy atoms.
+
+    """
+    from .interactions import resolve_interaction_atoms
+    from .protein import resolve_protein_feature_atoms
+
+    dih, dis, dih_missing, dis_missing = resolve_protein_feature_atoms(topology, chainid, numbering)
+    ligand_atoms, pocket_atoms, pocket_missing = resolve_interaction_atoms(
+        topology, chainid, ligand_name if ligand_name is not None else '', numbering)
+
+    index = {'dih': dih, 'dis': dis, 'dih_missing': dih_missing, 'dis_missing': dis_missing,
+             'pocket_atoms': pocket_atoms, 'pocket_missing': pocket_missing}
+    if ligand_name is not None:
+        index['ligand_atoms'] = ligand_atoms
+
+    return index
+
+
+class AtomIndexCache(object):
+
+    def __init__(self, root=None, max_size=256 * 1024**2):
+        """A directory of resolved atom indices, one npz file per (topology hash, chain, KLIFS structure, ligand).
+
+        Parameters
+        ----------
+        root: str, optional
+            The cache directory. Defaults to the 'atom_indices' directory under KINOMODEL_CACHE_DIR
+            (~/.cache/kinomodel by default).
+        max_size: int or None, optional, default=256 MiB
+            Maximum total size of the cached files in bytes; least recently used files, including those of
+            previous index versions, are evicted beyond it. None disables eviction.
+
+        """
+        from kinomodel.utils import get_cache_dir
+
+        self.root = root if root else get_cache_dir('atom_indices')
+        self.max_size = max_size
+
+    def path(self, topology_hash, chainid, structure_id, ligand_name=None):
+        """Return the file the atom indices of a chain of a topology are stored in."""
+        name = '{}-{}'.format(chainid, structure_id)
+        if ligand_name is not None:
+            name += '-ligand-{}'.format(ligand_name)
+        return os.path.join(self.root, index_version(), topology_hash[:2], topology_hash, name + '.npz')
+
+    def get(self, topology_hash, chainid, structure_id, ligand_name=None):
+        """Return the stored atom indices, or None on a miss.
+
+        Parameters
+        ----------
+        topology_hash: str
+            The hash of the topology file, as returned by topology_hash.
+        chainid: str
+            The chain index of the kinase.
+        structure_id: int or str
+            The KLIFS structure_ID the pocket numbering comes from.
+        ligand_name: str, optional
+            The ligand whose atoms are part of the entry.
+
+        Returns
+        -------
+        index: dict of str: np.ndarray or None
+            The atom indices, as returned by resolve_atom_index.
+
+        """
+        import numpy as np
+
+        path = self.path(topology_hash, chainid, structure_id, ligand_name)
+        try:
+            with np.load(path) as arrays:
+                index = {name: arrays[name] for name in arrays.files}
+            # mark the file as recently used
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            # missing or unreadable files are misses
+            return None
+
+        return index
+
+    def put(self, topology_hash, chainid, structure_id, index, ligand_name=None):
+        """Store the atom indices of a chain of a topology.
+
+        Parameters
+        ----------
+        topology_hash: str
+            The hash of the topology file, as returned by topology_hash.
+        chainid: str
+            The chain index of the kinase.
+        structure_id: int or str
+            The KLIFS structure_ID the pocket numbering comes from.
+        index: dict of str: np.ndarray
+            The atom indices, as returned by resolve_atom_index.
+        ligand_name: str, optional
+            The ligand whose atoms are part of the entry.
+
+        """
+        import io
+        import numpy as np
+        from kinomodel.utils import atomic_write
+
+        contents = io.BytesIO()
+        np.savez(contents, **index)
+        atomic_write(self.path(topology_hash, chainid, structure_id, ligand_name), contents.getvalue())
+        self.evict()
+
+    def size(self):
+        """Return the total size of the cached files in bytes."""
+        from kinomodel.utils import cached_files
+
+        return sum(size for _, size, _ in cached_files(self.root))
+
+    def evict(self):
+        """Remove least recently used files until the cache fits in max_size."""
+        from kinomodel.utils import evict_least_recently_used
+
+        evict_least_recently_used(self.root, self.max_size)
+
+
+_atom_index_cache = None
+
+
+def get_atom_index_cache():
+    """Return the atom index cache used by default."""
+    global _atom_index_cache
+    if _atom_index_cache is None:
+        _atom_index_cache = AtomIndexCache()
+
+    return _atom_index_cache
+
+
+def set_atom_index_cache(cache):
+    """Replace the atom index cache used by default.
+
+    Parameters
+    ----------
+    cache: AtomIndexCache
+        The new default cache.
+
+    """
+    global _atom_index_cache
+    _atom_index_cache = cache
+
+
+def load_atom_index(coords, chainid, numbering, top=None, structure_id=None, cache=None, ligand_name=None):
+    """
+    Return the atom indices of the features of a kinase chain, from the cache when possible.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    chainid : str
+        The chain index of the inquiry kinase.
+    numbering : list of int
+        The residue indices of the 85 pocket residues specific to the structure (0 for gaps).
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+    structure_id : int, optional
+        The KLIFS structure_ID the numbering comes from. Without it, the numbering itself identifies the entry.
+    cache : AtomIndexCache or False, optional
+        The cache of atom indices. Defaults to the shared cache; False disables caching.
+        Topologies held in memory or embedded in trajectory files are never cached.
+    ligand_name : str, optional
+        The ligand of the complex, whose heavy atoms are also returned.
+
+    Returns
+    -------
+    index : dict of str: np.ndarray
+        The atom indices, as returned by resolve_atom_index.
+
+    """
+    import hashlib
+    import json
+    from .trajectory import load_topology
+
+    source = topology_source(coords, top) if cache is not False else None
+    if source is None:
+        return resolve_atom_index(load_topology(coords, top), chainid, numbering, ligand_name)
+
+    if cache is None:
+        cache = get_atom_index_cache()
+    if structure_id is None:
+        structure_id = 'numbering-' + hashlib.sha256(json.dumps([int(resid) for resid in numbering])
+                                                     .encode()).hexdigest()[:16]
+    key = (topology_hash(source), str(chainid), structure_id)
+    ligand_name = str(ligand_name) if ligand_name is not None else None
+    index = cache.get(*key, ligand_name=ligand_name)
+    if index is None:
+        index = resolve_atom_index(load_topology(coords, top), chainid, numbering, ligand_name)
+        cache.put(*key, index, ligand_name=ligand_name)
+
+    return index
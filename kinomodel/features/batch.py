@@ -0,0 +1,288 @@
+"""
+batch.py
+Featurize many kinase structures in parallel.
+
+Jobs are (pdb, chain, coord) triples read from a CSV/TSV file or given as a list. KLIFS metadata
+and structure files of all jobs are retrieved up front into the shared persistent caches, then the
+jobs are distributed over a pool of worker processes. Results are appended to a JSON-lines file as
+soon as each job finishes, and a job that fails is recorded with its error instead of aborting the run.
+
+"""
+
+import json
+
+# the columns of a job file; coord is optional and defaults to 'pdb'
+JOB_COLUMNS = ['pdb', 'chain', 'coord']
+
+
+def read_jobs(jobs):
+    """
+    Read a list of featurization jobs.
+
+    Parameters
+    ----------
+    jobs : str or list
+        The path to a CSV or TSV file (tab separated if the name ends with .tsv or .tab) with columns
+        pdb, chain and, optionally, coord, or a list of (pdb, chain[, coord]) tuples or dicts with these keys.
+        A header line is optional in files; lines starting with '#' are ignored.
+
+    Returns
+    -------
+    jobs : list of dict
+        One dict per job with keys 'pdb', 'chain' and 'coord'.
+
+    """
+    import csv
+
+    if isinstance(jobs, str):
+        delimiter = '\t' if jobs.lower().endswith(('.tsv', '.tab')) else ','
+        with open(jobs, newline='') as infile:
+            rows = [[value.strip() for value in row] for row in csv.reader(infile, delimiter=delimiter)
+                    if row and not row[0].strip().startswith('#')]
+        if rows and [value.lower() for value in rows[0][:2]] == JOB_COLUMNS[:2]:
+            header = [value.lower() for value in rows.pop(0)]
+            rows = [dict(zip(header, row)) for row in rows]
+        jobs = rows
+
+    parsed = []
+    for job in jobs:
+        if not isinstance(job, dict):
+            job = dict(zip(JOB_COLUMNS, job))
+        if not job.get('pdb') or not job.get('chain'):
+            raise ValueError("Invalid featurization job '{}': pdb and chain are required".format(job))
+        parsed.append({'pdb': str(job['pdb']).upper(), 'chain': str(job['chain']),
+                       'coord': str(job.get('coord') or 'pdb')})
+
+    return parsed
+
+
+def featurize_job(job, feature='conf'):
+    """
+    Featurize a single structure, capturing any error.
+
+    Parameters
+    ----------
+    job : dict
+        The job, with keys 'pdb', 'chain' and 'coord'.
+    feature : str, optional, default='conf'
+        The features to compute: 'conf' (protein conformation), 'interact' (protein-ligand interaction) or 'both'.
+
+    Returns
+    -------
+    result : dict
+        The job with 'status' ('ok' or 'failed'), the KLIFS metadata and, for successful jobs,
+        key_res, dihedrals and distances ('conf') and/or mean_dist ('interact'), or 'error' for failed jobs.
+
+    """
+    import traceback
+    import numpy as np
+    from . import query_klifs
+    from . import protein as pf
+    from . import interactions as inf
+
+    result = dict(job)
+    try:
+        if feature not in ('conf', 'interact', 'both'):
+            raise ValueError("Unknown feature '{}'".format(feature))
+        klifs = query_klifs.query_klifs_database(job['pdb'], job['chain'])
+        result.update(structure_id=klifs.struct_id, kinase_id=klifs.kinase_id, kinase=klifs.name, ligand=klifs.ligand)
+        if feature in ('conf', 'both'):
+            dihedrals, distances = pf.compute_simple_protein_features(job['pdb'], job['chain'], job['coord'],
+                                                                      klifs.numbering, structure_id=klifs.struct_id)
+            result['key_res'] = [int(resid) for resid in pf.key_klifs_residues(klifs.numbering)]
+            result['dihedrals'] = np.asarray(dihedrals).tolist()
+            result['distances'] = np.asarray(distances).tolist()
+        if feature in ('interact', 'both'):
+            mean_dist = inf.compute_simple_interaction_features(job['pdb'], job['chain'], job['coord'],
+                                                                klifs.ligand, klifs.numbering,
+                                                                structure_id=klifs.struct_id)
+            result['mean_dist'] = np.asarray(mean_dist).tolist()
+        result['status'] = 'ok'
+    except Exception as error:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+        result['traceback'] = traceback.format_exc()
+
+    return result
+
+
+def _initialize_worker(klifs_cache, structure_cache):
+    """Use the caches filled by the parent process as the default caches of a worker process."""
+    from .klifs_cache import set_klifs_cache
+    from kinomodel.structures import set_structure_cache
+
+    set_klifs_cache(klifs_cache)
+    set_structure_cache(structure_cache)
+
+
+def prefetch(jobs, n_threads=8):
+    """
+    Retrieve the KLIFS metadata and PDB files of all jobs into the shared persistent caches.
+
+    Errors are ignored here: jobs whose data could not be retrieved fail individually later on.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        The jobs, as returned by read_jobs.
+    n_threads : int, optional, default=8
+        The number of concurrent downloads.
+
+    """
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    from .query_klifs import prefetch_klifs
+    from kinomodel.structures import fetch_structure
+
+    try:
+        prefetch_klifs([job['pdb'] for job in jobs], n_threads=n_threads)
+    except Exception as error:
+        logging.warning('Prefetching KLIFS metadata failed: {}'.format(error))
+
+    def fetch(pdbid):
+        try:
+            fetch_structure(pdbid)
+        except Exception as error:
+            logging.warning('Prefetching {} failed: {}'.format(pdbid, error))
+
+    pdb_ids = sorted(set(job['pdb'] for job in jobs if job['coord'] == 'pdb'))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(fetch, pdb_ids))
+
+
+def read_results(output):
+    """
+    Read the results of a batch run.
+
+    Parameters
+    ----------
+    output : str
+        The JSON-lines file written by batch_featurize.
+
+    Returns
+    -------
+    results : list of dict
+        The latest result of every job, in the order jobs first appear in the file.
+
+    """
+    import os
+
+    results = {}
+    if os.path.exists(output):
+        with open(output) as infile:
+            for line in infile:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # a line left incomplete by an interrupted run
+                    continue
+                results[(result['pdb'], result['chain'], result['coord'])] = result
+
+    return list(results.values())
+
+
+def batch_featurize(jobs, output, feature='conf', n_workers=None, resume=True, prefetch_data=True, store=None):
+    """
+    Featurize many structures in parallel, writing results as they are completed.
+
+    Parameters
+    ----------
+    jobs : str or list
+        The jobs, as accepted by read_jobs.
+    output : str
+        The JSON-lines file results are appended to, one line per job (see featurize_job).
+    feature : str, optional, default='conf'
+        The features to compute: 'conf', 'interact' or 'both'.
+    n_workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs.
+    resume : bool, optional, default=True
+        If True, jobs with a successful result in output are skipped.
+    prefetch_data : bool, optional, default=True
+        If True, the KLIFS metadata and PDB files of all jobs are retrieved before featurization starts.
+    store : str, optional
+        If given, the features of successful jobs are also appended to the feature store in this directory
+        (see store.FeatureStore).
+
+    Returns
+    -------
+    summary : dict
+        The number of jobs 'done', 'failed' and 'skipped'.
+
+    """
+    import logging
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from .klifs_cache import get_klifs_cache
+    from .store import FeatureStore
+    from kinomodel.structures import get_structure_cache
+
+    if feature not in ('conf', 'interact', 'both'):
+        raise ValueError("Unknown feature '{}'".format(feature))
+    jobs = read_jobs(jobs)
+    summary = {'done': 0, 'failed': 0, 'skipped': 0}
+    if resume:
+        completed = set((result['pdb'], result['chain'], result['coord']) for result in read_results(output)
+                        if result['status'] == 'ok')
+        pending = [job for job in jobs if (job['pdb'], job['chain'], job['coord']) not in completed]
+        summary['skipped'] = len(jobs) - len(pending)
+        jobs = pending
+    if not jobs:
+        return summary
+    if prefetch_data:
+        prefetch(jobs)
+
+    initargs = (get_klifs_cache(), get_structure_cache())
+    feature_store = FeatureStore(store) if store else None
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_initialize_worker,
+                                 initargs=initargs) as executor, open(output, 'a') as outfile:
+            futures = {executor.submit(featurize_job, job, feature): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    # the worker process itself died (e.g. killed by the kernel when out of memory)
+                    result = dict(futures[future], status='failed',
+                                  error='{}: {}'.format(type(error).__name__, error))
+                outfile.write(json.dumps(result) + '\n')
+                outfile.flush()
+                if result['status'] == 'ok':
+                    if feature_store is not None:
+                        feature_store.append(result['pdb'], result['chain'], dihedrals=result.get('dihedrals'),
+                                             distances=result.get('distances'), mean_dist=result.get('mean_dist'),
+                                             kinase_id=result['kinase_id'], kinase=result['kinase'],
+                                             structure_id=result['structure_id'], ligand=result['ligand'])
+                    summary['done'] += 1
+                else:
+                    summary['failed'] += 1
+                    logging.warning('Featurization of {} chain {} failed: {}'.format(result['pdb'], result['chain'],
+                                                                                     result['error']))
+    finally:
+        # the features appended so far become visible even if the run is interrupted
+        if feature_store is not None:
+            feature_store.close()
+
+    return summary
+
+
+def main():
+    """Command-line entry point of the batch featurization driver."""
+    import argparse
+    from kinomodel.instrumentation import instrument_run
+    from kinomodel.utils import configure_logging
+
+    parser = argparse.ArgumentParser(prog='kinomodel-batch', description='Featurize many kinase structures')
+    parser.add_argument('jobs', help='a CSV or TSV file with columns pdb, chain and (optionally) coord')
+    parser.add_argument('--output', required=True, help='the JSON-lines file results are appended to')
+    parser.add_argument('--feature', default='conf', choices=['conf', 'interact', 'both'],
+                        help='compute collective variables related to protein conformation, '
+                             'protein-ligand interaction, or both')
+    parser.add_argument('--store', default=None, help='a feature store directory the features are also appended to')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes')
+    parser.add_argument('--no-resume', action='store_true', help='featurize jobs already completed in output again')
+    args = parser.parse_args()
+    configure_logging()
+
+    with instrument_run('kinomodel-batch'):
+        summary = batch_featurize(args.jobs, args.output, feature=args.feature, n_workers=args.workers,
+                                  resume=not args.no_resume, store=args.store)
+    print('{done} done, {failed} failed, {skipped} skipped'.format(**summary))
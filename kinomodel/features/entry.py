@@ -0,0 +1,80 @@
+"""
+entry.py
+Featurization of every kinase chain of a PDB entry at once.
+
+The entry is fetched and parsed once, the atoms of all chains are resolved from that single parse,
+and the features of all chains are returned stacked along a leading chain axis.
+
+"""
+
+
+def featurize_entry(pdb, feature='conf', coord='pdb', top=None, chains=None, store=None, cache=None, chunk=1000):
+    """
+    Compute structural and/or interaction features for all kinase chains of a PDB entry.
+
+    Parameters
+    ----------
+    pdb : str
+        The PDB code of the entry.
+    feature : str, optional, default='conf'
+        The features to compute: 'conf' (protein conformation), 'interact' (protein-ligand interaction) or 'both'.
+    coord : str or mdtraj.Trajectory, optional, default='pdb'
+        The coordinates, as in protein.compute_simple_protein_features.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file given as coord.
+    chains : list of str, optional
+        Only featurize these chains. All chains of the entry in KLIFS by default.
+    store : str, optional
+        A feature store directory the features of every chain are appended to.
+    cache : kinomodel.features.klifs_cache.KlifsCache, optional
+        The cache of KLIFS metadata to use. Defaults to the shared persistent cache.
+    chunk : int, optional, default=1000
+        Number of frames read and featurized at a time.
+
+    Returns
+    -------
+    features : dict
+        'klifs' (list of Klifs, one per chain) and, depending on feature, 'key_res' (list of lists of int),
+        'dihedrals' (n_chains, n_frames, 8), 'distances' (n_chains, n_frames, 5) and/or
+        'mean_dist' (n_chains, n_frames) arrays.
+
+    """
+    from . import query_klifs
+    from . import protein as pf
+    from . import interactions as inf
+
+    if feature not in ('conf', 'interact', 'both'):
+        raise ValueError("Unknown feature '{}'".format(feature))
+
+    klifs = query_klifs.query_klifs_entry(pdb, cache=cache)
+    if chains is not None:
+        klifs = [info for info in klifs if info.chain in chains]
+        missing = sorted(set(chains) - set(info.chain for info in klifs))
+        if missing:
+            raise ValueError("No data found for chainid(s) {} of pdbid '{}'.".format(', '.join(missing), pdb))
+    if coord == 'pdb':
+        from kinomodel.structures import fetch_structure
+        # the entry is fetched once for all chains
+        coord = fetch_structure(pdb)
+
+    features = {'klifs': klifs}
+    if feature in ('conf', 'both'):
+        features['key_res'] = [pf.key_klifs_residues(info.numbering) for info in klifs]
+        features['dihedrals'], features['distances'] = pf.compute_entry_protein_features(
+            pdb, [(info.chain, info.numbering) for info in klifs], coord, top=top, chunk=chunk)
+    if feature in ('interact', 'both'):
+        features['mean_dist'] = inf.compute_entry_interaction_features(
+            pdb, [(info.chain, info.ligand, info.numbering) for info in klifs], coord, top=top, chunk=chunk)
+
+    if store:
+        from .store import FeatureStore
+        # persist one row per chain and frame with the KLIFS metadata of each chain
+        with FeatureStore(store) as feature_store:
+            for i, info in enumerate(klifs):
+                feature_store.append(pdb, info.chain, dihedrals=features.get('dihedrals', [None] * len(klifs))[i],
+                                     distances=features.get('distances', [None] * len(klifs))[i],
+                                     mean_dist=features.get('mean_dist', [None] * len(klifs))[i],
+                                     kinase_id=info.kinase_id, kinase=info.name, structure_id=info.struct_id,
+                                     ligand=info.ligand)
+
+    return features
@@ -12,6 +12,7 @@ def _parse_arguments(**kwargs):
     -----
     This method requires the pdb, chain, feature and coord args to be either
     all present in the kwargs dictionary, or given on the command line.
+    The store arg is optional.
 
     Parameters
     ----------
@@ -72,6 +73,12 @@ def _parse_arguments(**kwargs):
             help='the coordinates (a pdb file) or trajectories (e.g. a dcd file with associated topology info) to '
                  'featurize. Default is the pdb coordinates under the given PDB code.'
         )
+        parser.add_argument(
+            '--store',
+            required=False,
+            action='store',
+            type=str,
+            help='a feature store directory the computed features are appended to (one row per frame)')
 
         arguments = parser.parse_args()
 
@@ -87,6 +94,8 @@ def _parse_arguments(**kwargs):
         assert 'coord' in kwargs
 
         arguments = argparse.Namespace(**kwargs)
+        if 'store' not in kwargs:
+            arguments.store = None
 
     return arguments
 
@@ -100,6 +109,8 @@ def featurize(**kwargs):
     args: a Namespace object from argparse
         Information from parsing the command line
         e.g. Namespace(chain='A', coord='pdb', feature='conf', pdb='3PP0')
+        If store is given (e.g. store='features/'), the features are also appended to
+        the feature store in that directory.
 
     Returns
     -------
@@ -115,6 +126,9 @@ def featurize(**kwargs):
             A float (one frame) or a list of floats (multiple frames), which is the mean pairwise distance
             between ligand heavy atoms and the CAs of the 85 pocket residues.
 
+    Run as 'kinomodel serve', this starts a featurization service instead; features.service.ServiceClient
+    then computes the same features with warm caches.
+
     .. todo ::
 
        Refactor this into a featurization driver driven by documented kwargs.
@@ -122,6 +136,20 @@ def featurize(**kwargs):
 
     """
 
+    if not kwargs:
+        import sys
+        if sys.argv[1:2] == ['serve']:
+            # kinomodel serve: run the featurization service (see features.service)
+            from kinomodel.features.service import main
+            return main(sys.argv[2:])
+
+        # run from the command line; KINOMODEL_INSTRUMENT and KINOMODEL_PROFILE record the stages of the run
+        from kinomodel.instrumentation import instrument_run
+        from kinomodel.utils import configure_logging
+        configure_logging()
+        with instrument_run('kinomodel'):
+            return featurize(**vars(_parse_arguments()))
+
     # absolute import (with kinomodel installed)
     #from kinomodel.features import query_klifs
     #from kinomodel.features import protein as pf
@@ -131,28 +159,34 @@ def featurize(**kwargs):
     from features import query_klifs
     from features import protein as pf
     from features import interactions as inf
+    from kinomodel.features import store
 
     args = _parse_arguments(**kwargs)
 
     my_kinase = None
 
-    if args.feature == "conf":
-        klifs = query_klifs.query_klifs_database(args.pdb, args.chain)
+    if args.feature not in ("conf", "interact", "both"):
+        raise Exception("Unknown feature '{}'".format(args.feature))
+
+    klifs = query_klifs.query_klifs_database(args.pdb, args.chain)
+    dihedrals, distances, mean_dist = None, None, None
+    if args.feature in ("conf", "both"):
         key_res = pf.key_klifs_residues(klifs.numbering)
         (dihedrals, distances) = pf.compute_simple_protein_features(args.pdb, args.chain, args.coord, klifs.numbering)
-        return key_res, dihedrals, distances
+    if args.feature in ("interact", "both"):
+        mean_dist = inf.compute_simple_interaction_features(args.pdb, args.chain, args.coord, klifs.ligand,
+                                                            klifs.numbering)
 
+    if args.store:
+        # persist one row per frame with the KLIFS metadata of the structure
+        with store.FeatureStore(args.store) as feature_store:
+            feature_store.append(args.pdb, args.chain, dihedrals=dihedrals, distances=distances, mean_dist=mean_dist,
+                                 kinase_id=klifs.kinase_id, kinase=klifs.name, structure_id=klifs.struct_id,
+                                 ligand=klifs.ligand)
+
+    if args.feature == "conf":
+        return key_res, dihedrals, distances
     elif args.feature == "interact":
-        klifs = query_klifs.query_klifs_database(args.pdb, args.chain)
-        mean_dist = inf.compute_simple_interaction_features(args.pdb, args.chain, args.coord, klifs.ligand, klifs.numbering)
         return mean_dist
-
-    elif args.feature == "both":
-        klifs = query_klifs.query_klifs_database(args.pdb, args.chain)
-        key_res = pf.key_klifs_residues(klifs.numbering)
-        (dihedrals, distances) = pf.compute_simple_protein_features(args.pdb, args.chain, args.coord, klifs.numbering)
-        mean_dist = inf.features(args.pdb, args.chain, args.coord, klifs.ligand, klifs.numbering)
-        return key_res, dihedrals, distances, mean_dist
     else:
-        raise Exception("Unknown feature '{}'".format(args.feature))
-        return
+        return key_res, dihedrals, distances, mean_dist
@@ -3,15 +3,233 @@ Utilities for featurizing kinase-ligand interactions
 
 """
 
-# Setup general logging (guarantee output/error message in case of interruption)
-# TODO: Can we log to the terminal instead?
+# Log messages are sent to the terminal by the command-line tools (see utils.configure_logging),
+# not configured at import time
 import logging
 logger = logging.getLogger(__name__)
-logging.root.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO, format="%(message)s")
-logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-def compute_simple_interaction_features(pdbid, chainid, coordfile, ligand_name, resids):
+from kinomodel.instrumentation import instrumented
+
+def resolve_interaction_atoms(topology, chainid, ligand_name, resids):
+    """
+    Find the ligand heavy atoms and the CAs of the pocket residues used in interaction features.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology of the complex.
+    chainid: str
+        The chain index of the query kinase.
+    ligand_name: str
+        Specifies the ligand name of the complex.
+    resids: list of int
+        Protein residue indices to use in computing simple interaction features (0 for gaps).
+
+    Returns
+    -------
+    ligand_atoms : np.ndarray of int, shape (n_ligand_atoms,)
+        Indices of the ligand heavy atoms.
+    pocket_atoms : np.ndarray of int, shape (len(resids),)
+        Indices of the CA of each pocket residue; 0 for missing residues.
+    pocket_missing : np.ndarray of bool, shape (len(resids),)
+        True for each pocket residue that is a gap or has no CA in the topology.
+
+    """
+    return resolve_entry_interaction_atoms(topology, [(chainid, ligand_name, resids)])[0]
+
+@instrumented('index.resolve')
+def resolve_entry_interaction_atoms(topology, chains):
+    """
+    Find the ligand heavy atoms and pocket CAs of several kinase chains of a complex from one atom table.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology of the complex.
+    chains : list of (str, str, list of int)
+        The chain index, the ligand name and the pocket residue indices (0 for gaps) of each kinase chain.
+
+    Returns
+    -------
+    atoms : list of (np.ndarray, np.ndarray, np.ndarray)
+        The ligand atoms, pocket atoms and pocket missing mask of each chain, as returned by
+        resolve_interaction_atoms.
+
+    """
+    import numpy as np
+    from kinomodel.structures import atom_table
+
+    table = atom_table(topology)
+    chains_column = table['chainID']
+    names = table['name']
+    resnames = table['resName']
+    resseqs = table['resSeq']
+    rows = np.arange(len(names))
+    is_heavy = np.char.find(names, 'H') < 0
+    # chain that follows the last non-ligand atom before each atom, for each ligand name
+    previous_chains = {}
+
+    atoms = []
+    for chainid, ligand_name, resids in chains:
+        # translate a letter chain id into a number index (A->0, B->1 etc)
+        # TODO: This may not be robust, since chains aren't always in sequence from A to Z
+        chain_index = ord(str(chainid).lower()) - 97
+
+        # CA of the pocket residues in the specified protein chain
+        is_ca = (chains_column == chain_index) & (names == 'CA')
+        ca_index = dict(zip(resseqs[is_ca], rows[is_ca]))
+        pocket_atoms = np.array([ca_index.get(resid, -1) if resid else -1 for resid in resids], dtype=int)
+        pocket_missing = pocket_atoms < 0
+        pocket_atoms[pocket_missing] = 0
+
+        # ligand heavy atoms in the chain that follows the last non-ligand atom before them
+        is_ligand = resnames == str(ligand_name)
+        if str(ligand_name) not in previous_chains:
+            last_other = np.maximum.accumulate(np.where(is_ligand, -1, rows))
+            previous_chains[str(ligand_name)] = np.where(last_other >= 0, chains_column[np.maximum(last_other, 0)], 0)
+        is_ligand &= (chains_column == previous_chains[str(ligand_name)] + 1) & is_heavy
+        ligand_atoms = rows[is_ligand]
+
+        atoms.append((ligand_atoms, pocket_atoms, pocket_missing))
+
+    return atoms
+
+def pocket_distance_kernel(xyz, ligand_atoms, pocket_atoms, pocket_missing=None, unitcell_lengths=None,
+                           statistics=('mean',), contact_cutoff=0.4, block=32, unitcell_vectors=None):
+    """
+    Compute statistics of the distances between ligand atoms and pocket atoms for a set of frames.
+
+    Distances are computed by broadcasting pocket against ligand coordinates, without building a list of
+    atom pairs, and are reduced block by block so that the temporary arrays stay small.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape (n_frames, n_atoms, 3)
+        Coordinates (in nm).
+    ligand_atoms : np.ndarray of int, shape (n_ligand_atoms,)
+        Indices of the ligand atoms in xyz.
+    pocket_atoms : np.ndarray of int, shape (n_pocket,)
+        Indices of the pocket atoms (e.g. one CA per pocket residue) in xyz.
+    pocket_missing : np.ndarray of bool, shape (n_pocket,), optional
+        True for pocket atoms that are missing and must be ignored.
+    unitcell_lengths : np.ndarray, shape (n_frames, 3), optional
+        Lengths of an orthorhombic periodic box; if given, the minimum image convention is applied.
+    statistics : list of str, optional, default=('mean',)
+        Any of:
+
+        * 'mean': mean distance over all ligand atoms and resolved pocket atoms, shape (n_frames,)
+        * 'min': minimum distance, shape (n_frames,)
+        * 'per_residue': mean distance of each pocket atom to the ligand atoms (nan if missing),
+          shape (n_frames, n_pocket)
+        * 'contacts': number of ligand-pocket atom pairs closer than contact_cutoff, shape (n_frames,)
+
+    contact_cutoff : float, optional, default=0.4
+        Distance (in nm) below which a pair counts as a contact.
+    block : int, optional, default=32
+        Number of frames whose distances are computed at once.
+    unitcell_vectors : np.ndarray, shape (n_frames, 3, 3), optional
+        Vectors of a triclinic periodic box (instead of unitcell_lengths); the minimum image is searched
+        among the neighbouring images, as in mdtraj.compute_distances.
+
+    Returns
+    -------
+    features : dict of str: np.ndarray
+        The requested statistics.
+
+    """
+    import numpy as np
+
+    for statistic in statistics:
+        if statistic not in ('mean', 'min', 'per_residue', 'contacts'):
+            raise ValueError("Unknown statistic '{}'".format(statistic))
+
+    pocket_atoms = np.asarray(pocket_atoms)
+    valid = np.ones(len(pocket_atoms), dtype=bool) if pocket_missing is None else ~np.asarray(pocket_missing)
+    n_frames, n_ligand, n_valid = len(xyz), len(ligand_atoms), int(valid.sum())
+
+    features = {'mean': np.full(n_frames, np.nan), 'min': np.full(n_frames, np.nan),
+                'per_residue': np.full((n_frames, len(pocket_atoms)), np.nan),
+                'contacts': np.zeros(n_frames, dtype=int)}
+    if n_ligand and n_valid:
+        # coordinates as (n_frames, 3, n_atoms), so that each axis of a frame is contiguous
+        ligand_xyz = np.ascontiguousarray(xyz[:, ligand_atoms].transpose(0, 2, 1))
+        pocket_xyz = np.ascontiguousarray(xyz[:, pocket_atoms[valid]].transpose(0, 2, 1))
+        if unitcell_lengths is not None:
+            unitcell_lengths = np.asarray(unitcell_lengths, dtype=xyz.dtype)
+        for start in range(0, n_frames, block):
+            frames = slice(start, start + block)
+            if unitcell_vectors is not None:
+                distances = _triclinic_distances(pocket_xyz[frames], ligand_xyz[frames],
+                                                 np.asarray(unitcell_vectors[frames], dtype=xyz.dtype))
+            else:
+                # (frames, n_valid_pocket_atoms, n_ligand_atoms) distances, accumulated one axis at a time
+                distances = np.zeros((len(ligand_xyz[frames]), n_valid, n_ligand), dtype=xyz.dtype)
+                for axis in range(3):
+                    diff = np.subtract(pocket_xyz[frames, axis, :, np.newaxis],
+                                       ligand_xyz[frames, axis, np.newaxis, :])
+                    if unitcell_lengths is not None:
+                        box = unitcell_lengths[frames, axis, np.newaxis, np.newaxis]
+                        diff -= box * np.round(diff / box)
+                    diff *= diff
+                    distances += diff
+                np.sqrt(distances, out=distances)
+
+            per_residue = distances.sum(axis=2) / n_ligand
+            features['per_residue'][frames, valid] = per_residue
+            features['mean'][frames] = per_residue.sum(axis=1) / n_valid
+            if 'min' in statistics:
+                features['min'][frames] = distances.reshape(len(distances), -1).min(axis=1)
+            if 'contacts' in statistics:
+                features['contacts'][frames] = (distances < contact_cutoff).reshape(len(distances), -1).sum(axis=1)
+
+    return {statistic: features[statistic] for statistic in statistics}
+
+def _triclinic_distances(pocket_xyz, ligand_xyz, box):
+    """Minimum image distances, shape (n_frames, n_pocket, n_ligand), in triclinic boxes of vectors box."""
+    import itertools
+    import numpy as np
+
+    # (frames, n_pocket, n_ligand, 3) differences, wrapped into the box in fractional coordinates
+    diff = pocket_xyz.transpose(0, 2, 1)[:, :, np.newaxis, :] - ligand_xyz.transpose(0, 2, 1)[:, np.newaxis, :, :]
+    fractional = diff @ np.linalg.inv(box)[:, np.newaxis]
+    fractional -= np.round(fractional)
+    diff = fractional @ box[:, np.newaxis]
+    # the nearest image of a skewed box may be in a neighbouring cell
+    squared = (diff ** 2).sum(axis=3)
+    for shift in itertools.product((-1, 0, 1), repeat=3):
+        if any(shift):
+            image = (np.array(shift, dtype=box.dtype) @ box)[:, np.newaxis, np.newaxis, :]
+            np.minimum(squared, ((diff + image) ** 2).sum(axis=3), out=squared)
+
+    return np.sqrt(squared)
+
+def periodic_box(frames):
+    """
+    Return the box of a trajectory as the unitcell_lengths and unitcell_vectors of pocket_distance_kernel.
+
+    Parameters
+    ----------
+    frames : mdtraj.Trajectory
+        The frames.
+
+    Returns
+    -------
+    unitcell_lengths : np.ndarray or None
+        The box lengths, if the box is rectangular.
+    unitcell_vectors : np.ndarray or None
+        The box vectors, if the box is triclinic.
+
+    """
+    import numpy as np
+
+    if frames.unitcell_lengths is None:
+        return None, None
+    if np.allclose(frames.unitcell_angles, 90):
+        return frames.unitcell_lengths, None
+    return None, frames.unitcell_vectors
+
+def compute_simple_interaction_features(pdbid, chainid, coordfile, ligand_name, resids, top=None, chunk=1000,
+                                        structure_id=None):
     """
     This function takes the PDB code, chain id, certain coordinates, ligand name and the numbering of
     pocket residues of a kinase from a command line and returns its structural features.
@@ -22,12 +240,19 @@ def compute_simple_interaction_features(pdbid, chainid, coordfile, ligand_name,
         The PDB code of the query kinase.
     chainid: str
         The chain index of the query kinase.
-    coordfile: str
-        Specifies the source of coordinates ('pdb' or 'dcd')
+    coordfile: str or mdtraj.Trajectory
+        Specifies the source of coordinates: 'pdb' (the PDB entry), 'dcd' ({pdbid}.dcd with
+        {pdbid}_fixed_solvated.pdb as topology), an in-memory trajectory or the path to a trajectory file.
     ligand_name: str
         Specifies the ligand name of the complex.
     resids: list of int
         Protein residue indices to use in computing simple interaction features.
+    top: str or mdtraj.Topology, optional
+        The topology of a trajectory file given as coordfile (e.g. a pdb file for a dcd trajectory).
+    chunk: int, optional, default=1000
+        Number of frames read and featurized at a time.
+    structure_id: int, optional
+        The KLIFS structure_ID the numbering comes from, used to key the persisted atom indices.
 
     Returns
     -------
@@ -35,115 +260,85 @@ def compute_simple_interaction_features(pdbid, chainid, coordfile, ligand_name,
             A float (one frame) or a list of floats (multiple frames), which is the mean pairwise distance
             between ligand heavy atoms and the CAs of the 85 pocket residues.
 
-    .. todo :: Instead of a PDB file or a trj/dcd/h5, accept an MDTraj.Trajectory---this will be much more flexible.
-
     .. todo :: Use kwargs with sensible defaults instead of relying only on positional arguments.
 
     """
-    import tempfile
-    import os
-    import mdtraj as md
     import numpy as np
+    from .trajectory import iter_interaction_features
 
-    pdb_file = None
-
-    # A safer way to download files as wget may not exist on systems such MacOS
-    # TODO: Since we retrieve the PDB file in multiple pieces of code, let's refactor this into one utility function
-    # to avoid code duplication.
-    import urllib
-    with urllib.request.urlopen('http://www.pdb.org/pdb/files/{}.pdb'.format(pdbid)) as response:
-        pdb_file = response.read()
-
-    with tempfile.TemporaryDirectory() as pdb_directory:
-        pdb = os.path.join(pdb_directory,'{}.pdb'.format(pdbid))
-        with open(pdb, 'w') as file:
-            file.write(pdb_file.decode())
-            # load traj before the temp pdb file was removed
-            if coordfile == 'pdb':
-                traj = md.load(pdb)
-            # get topology info from the structure
-            topology = md.load(pdb).topology
-
-    table, bonds = topology.to_dataframe()
-    atoms = table.values
-    # translate a letter chain id into a number index (A->0, B->1 etc)
-    # TODO: This may not be robust, since chains aren't always in sequence from A to Z
-    chain_index = ord(str(chainid).lower()) - 97
-
-    #np.set_printoptions(threshold=np.nan)
-    #print (atoms)
-    # get the array of atom indices for the calculation of:
-    #       * mean of pairwise distances between each ligand atom and CA of 85 binding pocket
-    #residues (an (85*n*2) array where n = # of ligand heavy atoms (usually <= 100)
-    #and each row contains indices of the two atoms for each distance)
-    dis = np.zeros(shape=(8500, 2), dtype=int, order='C')
-
-    # parse the topology info
-    pocket_atm = []
-    chain_num = 0
-    atm_count = 0
-    count = 0
-    for line in atoms:
-        # find the key binding pocket atoms in the protein
-        # for CA of the pocket residues in the specified protein chain
-        if (line[5] == chain_index) and (line[3] in resids) and (line[1] == 'CA'):
-            pocket_atm.append(int(line[0]))
-        # start of ligand
-        if line[4] == ligand_name:
-            # check whether the pocket_atm list is complete
-            if (len(pocket_atm) < 85) and (0 in resids):
-                pocket_atm.insert(resids.index(0), 0)
-            # for the specified chain and ligand heavy atoms
-            if line[5] == int(chain_num + 1) and 'H' not in line[1]:
-                for i in range(85):
-                    dis[count * 85 + i][0] = atm_count
-                    dis[count * 85 + i][1] = pocket_atm[i]
-                count += 1
-        else:
-            chain_num = line[5]
-        atm_count += 1
-
-    # clean array and remove empty lines
-    import sys
-    np.set_printoptions(threshold=sys.maxsize)
-    dis = dis[~np.all(dis == 0, axis=1)]
-    # check if there is any missing coordinates;
-    # if so, skip distance calculation for those residues
-    del_lst = []
-    # find out lines with 0 at the protein residue position
-    for i in range(len(dis)):
-        if dis[i][1] == 0:
-            dis[i][0] = 0
-    for i in range(len(dis)):
-        if dis[i][0] and dis[i][1]:
-        # the atom indices fed to mdtraj should be 0-based
-            dis[i] -= 1
-    #if check_dis == 0:
-        #logging.info(
-        #    "There is no missing coordinates.  All distances will be computed."
-        #)
-    #else:
-        #logging.info(
-        #    "Some of the pairwise distances will not be calculated due to missing coordinates."
-        #)
+    if coordfile == 'pdb':
+        from kinomodel.structures import fetch_structure
+        # the PDB file is downloaded once and shared by all featurization code through the local structure cache
+        coordfile = fetch_structure(pdbid)
+    elif coordfile == 'dcd':
+        coordfile, top = str(pdbid) + '.dcd', str(pdbid) + '_fixed_solvated.pdb'
 
     # calculate the distances for the user-specifed structure (a static structure or an MD trajectory)
-    if coordfile == 'dcd':
-        traj = md.load(str(pdbid) + '.dcd',top = str(pdbid) + '_fixed_solvated.pdb')
     mean_dist = []
-    for frame in md.compute_distances(traj, dis):
-        mean_dist.append(np.mean(frame))
+    for features in iter_interaction_features(coordfile, chainid, ligand_name, resids, top=top, chunk=chunk,
+                                              statistics=['per_residue'], structure_id=structure_id):
+        # as originally defined, missing pocket residues contribute zero distances to the mean
+        mean_dist.extend(np.nansum(features['per_residue'], axis=1) / len(resids))
 
     #logging.info(
     #    "The mean distance between ligand heavy atoms and CAs of the 85 binding pocket residues for PDB# "
     #    + str(pdbid) + ", chain " + str(chainid) + " is: " +
     #    str(mean_dist))
 
-    # clean up
-    # TODO: This is dangerous! Instead, rely on using the "with tempfile.TemporaryDirectory" context manager idiom to create and clean up temporary directories
-    #rm_file = 'rm ./' + str(pdb) + '.pdb*'
-    #import subprocess
-    #subprocess.call(rm_file, shell=True)
-    del traj, dis
-
     return mean_dist
+
+def compute_entry_interaction_features(pdbid, chains, coordfile='pdb', top=None, chunk=1000):
+    """
+    Compute the mean ligand-pocket distance of every kinase chain of a PDB entry from a single parse.
+
+    Parameters
+    ----------
+    pdbid: str
+        The PDB code of the entry.
+    chains: list of (str, str, list of int)
+        The chain index, the ligand name (None for apo chains) and the numbering of the 85 pocket residues
+        of each kinase chain.
+    coordfile: str or mdtraj.Trajectory, optional, default='pdb'
+        The coordinates, as in compute_simple_interaction_features.
+    top: str or mdtraj.Topology, optional
+        The topology of a trajectory file given as coordfile.
+    chunk: int, optional, default=1000
+        Number of frames read and featurized at a time.
+
+    Returns
+    -------
+    mean_dist: np.ndarray, shape (n_chains, n_frames)
+        mean_dist[i] is the mean distance of chains[i], as returned by compute_simple_interaction_features;
+        nan for chains without a ligand.
+
+    """
+    import numpy as np
+    from .trajectory import load_topology, iterload
+
+    if coordfile == 'pdb':
+        from kinomodel.structures import fetch_structure
+        coordfile = fetch_structure(pdbid)
+    elif coordfile == 'dcd':
+        coordfile, top = str(pdbid) + '.dcd', str(pdbid) + '_fixed_solvated.pdb'
+
+    holo = [i for i, (_, ligand_name, _) in enumerate(chains) if ligand_name is not None]
+    chain_atoms = resolve_entry_interaction_atoms(load_topology(coordfile, top), [chains[i] for i in holo])
+    # only read the atoms involved in the features of any chain
+    atoms = np.unique(np.concatenate([np.zeros(0, dtype=int)] + [np.concatenate([ligand_atoms, pocket_atoms])
+                                                                   for ligand_atoms, pocket_atoms, _ in chain_atoms]))
+
+    mean_dist = []
+    for frames in iterload(coordfile, top=top, chunk=chunk, atom_indices=atoms if len(atoms) else None,
+                           coordinates_only=True):
+        chunk_mean_dist = np.full((len(chains), frames.n_frames), np.nan)
+        # minimum image convention, as in mdtraj.compute_distances
+        unitcell_lengths, unitcell_vectors = periodic_box(frames)
+        for i, (ligand_atoms, pocket_atoms, pocket_missing) in zip(holo, chain_atoms):
+            features = pocket_distance_kernel(frames.xyz, np.searchsorted(atoms, ligand_atoms),
+                                              np.searchsorted(atoms, pocket_atoms), pocket_missing, unitcell_lengths,
+                                              statistics=['per_residue'], unitcell_vectors=unitcell_vectors)
+            # as originally defined, missing pocket residues contribute zero distances to the mean
+            chunk_mean_dist[i] = np.nansum(features['per_residue'], axis=1) / len(chains[i][2])
+        mean_dist.append(chunk_mean_dist)
+
+    return np.concatenate(mean_dist, axis=1)
@@ -0,0 +1,290 @@
+"""
+klifs_cache.py
+A persistent cache of KLIFS metadata
+
+KLIFS structure records (keyed by PDB code and structure_ID) and pocket residue numberings
+are stored in a SQLite database, and re-queried from KLIFS once they are older than a TTL.
+
+"""
+
+import json
+import time
+
+KLIFS_URL = 'http://klifs.vu-compmedchem.nl'
+
+
+class KlifsCache(object):
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, base_url=KLIFS_URL, timeout=60):
+        """A SQLite-backed cache of KLIFS structure records and pocket numberings.
+
+        Parameters
+        ----------
+        path: str, optional
+            The SQLite database file. Defaults to klifs.sqlite in the 'klifs' directory under
+            KINOMODEL_CACHE_DIR (~/.cache/kinomodel by default).
+        ttl: float or None, optional, default=7 days
+            Time in seconds after which cached entries are queried again. None keeps entries forever.
+        base_url: str, optional
+            The KLIFS server.
+        timeout: float, optional, default=60
+            Timeout of each request in seconds.
+
+        """
+        import os
+        import threading
+        from kinomodel.utils import get_cache_dir
+
+        self.path = path if path else os.path.join(get_cache_dir('klifs'), 'klifs.sqlite')
+        self.ttl = ttl
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._pid = None
+        self._connection = None
+        with self._lock, self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (pdb TEXT PRIMARY KEY, fetched REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS structures '
+                       '(structure_id INTEGER PRIMARY KEY, pdb TEXT, chain TEXT, record TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS structures_pdb ON structures (pdb)')
+            db.execute('CREATE TABLE IF NOT EXISTS numberings '
+                       '(structure_id INTEGER PRIMARY KEY, numbering TEXT, fetched REAL)')
+
+    def __getstate__(self):
+        # the lock and the database connection are recreated in the receiving process
+        state = dict(self.__dict__)
+        del state['_lock'], state['_connection']
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        import threading
+
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._connection = None
+
+    def _db(self):
+        """Return the database connection of the current process (connections must not cross a fork)."""
+        import os
+        import sqlite3
+
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def _fresh(self, fetched):
+        return fetched is not None and (self.ttl is None or time.time() - fetched < self.ttl)
+
+    def _get(self, url):
+        import requests
+        from kinomodel.instrumentation import stage
+
+        with stage('network.fetch', url=url) as fetch:
+            response = requests.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            fetch.add_bytes(len(response.content))
+        return response.text
+
+    def structures(self, pdbid):
+        """Return the KLIFS structure records (one per chain and alternate model) of a PDB entry.
+
+        Parameters
+        ----------
+        pdbid: str
+            The PDB code of the structure.
+
+        Returns
+        -------
+        records: list of dict
+            The records returned by the KLIFS structures_pdb_list API (empty if the entry is not in KLIFS).
+
+        """
+        with self._lock:
+            row = self._db().execute('SELECT fetched FROM entries WHERE pdb = ?', (pdbid.upper(),)).fetchone()
+        if not self._fresh(row[0] if row else None):
+            self.fetch_structures([pdbid])
+        with self._lock:
+            rows = self._db().execute('SELECT record FROM structures WHERE pdb = ? ORDER BY structure_id',
+                                      (pdbid.upper(),)).fetchall()
+
+        return [json.loads(record) for record, in rows]
+
+    def structure(self, structure_id):
+        """Return the cached KLIFS record of a structure, or None if it has not been retrieved yet.
+
+        Parameters
+        ----------
+        structure_id: int
+            The KLIFS structure_ID.
+
+        Returns
+        -------
+        record: dict or None
+
+        """
+        with self._lock:
+            row = self._db().execute('SELECT record FROM structures WHERE structure_id = ?',
+                                     (int(structure_id),)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def fetch_structures(self, pdb_ids):
+        """Query KLIFS for the structure records of several PDB entries in a single request.
+
+        Parameters
+        ----------
+        pdb_ids: list of str
+            The PDB codes of the structures.
+
+        """
+        pdb_ids = sorted(set(pdbid.upper() for pdbid in pdb_ids))
+        text = self._get('{}/api/structures_pdb_list?pdb-codes={}'.format(self.base_url, ','.join(pdb_ids)))
+        records = json.loads(text) if text.strip() else []
+        # KLIFS answers with an error message instead of a list when none of the entries are found
+        if not isinstance(records, list):
+            records = []
+        now = time.time()
+        with self._lock, self._db() as db:
+            db.executemany('DELETE FROM structures WHERE pdb = ?', [(pdbid,) for pdbid in pdb_ids])
+            db.executemany('INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?)',
+                           [(int(record['structure_ID']), str(record['pdb']).upper(), str(record['chain']),
+                             json.dumps(record)) for record in records])
+            db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?)', [(pdbid, now) for pdbid in pdb_ids])
+
+    def list_structures(self, kinase_ids=None, batch_size=50):
+        """Query KLIFS for the current records of all structures of a set of kinases.
+
+        The records are always requested from KLIFS, and replace those cached for the PDB entries found.
+
+        Parameters
+        ----------
+        kinase_ids: list of int, optional
+            The KLIFS kinase_IDs. All kinases in KLIFS by default.
+        batch_size: int, optional, default=50
+            The number of kinase_IDs per structures_list request.
+
+        Returns
+        -------
+        records: list of dict
+            The records returned by the KLIFS structures_list API, sorted by structure_ID.
+
+        """
+        if kinase_ids is None:
+            kinases = json.loads(self._get('{}/api/kinase_names'.format(self.base_url)))
+            kinase_ids = [kinase['kinase_ID'] for kinase in kinases]
+        kinase_ids = sorted(set(int(kinase_id) for kinase_id in kinase_ids))
+
+        records = []
+        for start in range(0, len(kinase_ids), batch_size):
+            text = self._get('{}/api/structures_list?kinase_ID={}'.format(
+                self.base_url, ','.join(str(kinase_id) for kinase_id in kinase_ids[start:start + batch_size])))
+            batch = json.loads(text) if text.strip() else []
+            # KLIFS answers with an error message instead of a list when none of the kinases have structures
+            if isinstance(batch, list):
+                records.extend(batch)
+
+        now = time.time()
+        pdb_ids = sorted(set(str(record['pdb']).upper() for record in records))
+        with self._lock, self._db() as db:
+            db.executemany('DELETE FROM structures WHERE pdb = ?', [(pdbid,) for pdbid in pdb_ids])
+            db.executemany('INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?)',
+                           [(int(record['structure_ID']), str(record['pdb']).upper(), str(record['chain']),
+                             json.dumps(record)) for record in records])
+            db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?)', [(pdbid, now) for pdbid in pdb_ids])
+
+        return sorted(records, key=lambda record: int(record['structure_ID']))
+
+    def numbering(self, structure_id):
+        """Return the residue numbering of the 85 pocket residues of a KLIFS structure.
+
+        Parameters
+        ----------
+        structure_id: int
+            The KLIFS structure_ID.
+
+        Returns
+        -------
+        numbering: list of int
+            The residue numbers of the 85 pocket residues, with -1 for gaps.
+
+        """
+        import ast
+
+        with self._lock:
+            row = self._db().execute('SELECT numbering, fetched FROM numberings WHERE structure_id = ?',
+                                     (int(structure_id),)).fetchone()
+        if row and self._fresh(row[1]):
+            return json.loads(row[0])
+
+        numbering = None
+        page = self._get('{}/details.php?structure_id={}'.format(self.base_url, structure_id))
+        for line in page.splitlines():
+            if 'pocketResidues=[' in line:
+                numbering = ast.literal_eval((line[line.find('=') + 1:line.find(';')]))
+        if numbering is None:
+            raise ValueError("No pocket residues found in KLIFS for structure_id '{}'.".format(structure_id))
+        with self._lock, self._db() as db:
+            db.execute('INSERT OR REPLACE INTO numberings VALUES (?, ?, ?)',
+                       (int(structure_id), json.dumps(numbering), time.time()))
+
+        return numbering
+
+    def prefetch(self, pdb_ids, batch_size=100, numbering=True, n_threads=8):
+        """Retrieve the KLIFS records of many PDB entries with as few requests as possible.
+
+        Entries already in the cache are skipped. Structure records are requested in batches
+        of PDB codes, and pocket numberings (one request per structure) are retrieved concurrently.
+
+        Parameters
+        ----------
+        pdb_ids: list of str
+            The PDB codes of the structures.
+        batch_size: int, optional, default=100
+            The number of PDB codes per structures_pdb_list request.
+        numbering: bool, optional, default=True
+            If True, also retrieve the pocket numbering of every structure found.
+        n_threads: int, optional, default=8
+            The number of concurrent requests for pocket numberings.
+
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        pdb_ids = sorted(set(pdbid.upper() for pdbid in pdb_ids))
+        with self._lock:
+            fetched = dict(self._db().execute('SELECT pdb, fetched FROM entries').fetchall())
+        missing = [pdbid for pdbid in pdb_ids if not self._fresh(fetched.get(pdbid))]
+        for start in range(0, len(missing), batch_size):
+            self.fetch_structures(missing[start:start + batch_size])
+
+        if numbering:
+            structure_ids = [record['structure_ID'] for pdbid in pdb_ids for record in self.structures(pdbid)]
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                list(executor.map(self.numbering, structure_ids))
+
+
+_klifs_cache = None
+
+
+def get_klifs_cache():
+    """Return the KLIFS cache used by default."""
+    global _klifs_cache
+    if _klifs_cache is None:
+        _klifs_cache = KlifsCache()
+
+    return _klifs_cache
+
+
+def set_klifs_cache(cache):
+    """Replace the KLIFS cache used by default.
+
+    Parameters
+    ----------
+    cache: KlifsCache
+        The new default cache.
+
+    """
+    global _klifs_cache
+    _klifs_cache = cache
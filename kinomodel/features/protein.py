@@ -4,13 +4,36 @@ This is a tool to featurize kinase conformational changes through the entire Kin
 
 """
 
-# Setup general logging (guarantee output/error message in case of interruption)
-# TODO: Can we log to the terminal instead?
+# Log messages are sent to the terminal by the command-line tools (see utils.configure_logging),
+# not configured at import time
 import logging
 logger = logging.getLogger(__name__)
-logging.root.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO, format="%(message)s")
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+from kinomodel.instrumentation import instrumented
+
+# name list of the dihedrals and distances
+dih_names = ['aC_rot', 'xDFG_phi', 'xDFG_psi', 'dFG_phi', 'dFG_psi', 'DfG_phi', 'DfG_psi', 'DfG_chi']
+dis_names = ['K_E1', 'K_E2', 'DFG_conf1', 'DFG_conf2', 'fret']
+
+# Atoms defining each feature, as (KLIFS index, residue number offset, atom name).
+# The offset is added to the residue number mapped from the KLIFS index.
+DIHEDRAL_ATOMS = [
+    [(20, 0, 'CA'), (28, 0, 'CA'), (60, 0, 'CA'), (62, 0, 'CA')],  # between aC and aE helices
+    [(78, 0, 'C'), (79, 0, 'N'), (79, 0, 'CA'), (79, 0, 'C')],  # X-DFG Phi
+    [(79, 0, 'N'), (79, 0, 'CA'), (79, 0, 'C'), (80, 0, 'N')],  # X-DFG Psi
+    [(79, 0, 'C'), (80, 0, 'N'), (80, 0, 'CA'), (80, 0, 'C')],  # DFG-Asp Phi
+    [(80, 0, 'N'), (80, 0, 'CA'), (80, 0, 'C'), (81, 0, 'N')],  # DFG-Asp Psi
+    [(80, 0, 'C'), (81, 0, 'N'), (81, 0, 'CA'), (81, 0, 'C')],  # DFG-Phe Phi
+    [(81, 0, 'N'), (81, 0, 'CA'), (81, 0, 'C'), (82, 0, 'N')],  # DFG-Phe Psi
+    [(81, 0, 'N'), (81, 0, 'CA'), (81, 0, 'CB'), (81, 0, 'CG')],  # DFG-Phe Chi
+]
+DISTANCE_ATOMS = [
+    [(16, 0, 'NZ'), (23, 0, 'OE1')],  # K-E salt bridge
+    [(16, 0, 'NZ'), (23, 0, 'OE2')],  # K-E salt bridge
+    [(27, 0, 'CA'), (81, 0, 'CZ')],  # DFG conformation
+    [(16, 0, 'CA'), (81, 0, 'CZ')],  # DFG conformation
+    [(80, 10, 'CA'), (80, -20, 'CA')],  # FRET distance
+]
 
 
 def key_klifs_residues(numbering):
@@ -65,7 +88,98 @@ def key_klifs_residues(numbering):
 
     return key_res
 
-def compute_simple_protein_features(pdbid, chainid, coordfile, numbering):
+def resolve_protein_feature_atoms(topology, chainid, numbering):
+    """
+    Find the atom indices of all dihedrals and distances relevant to kinase conformation in one pass.
+
+    All key atoms are looked up in a (resSeq, atom name) index built in a single pass over the atoms of
+    the specified chain, instead of comparing every atom of the topology against every feature atom.
+    When an atom occurs more than once, the last occurrence is used.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology of the structure or trajectory to featurize.
+    chainid : str
+        The chain index of the inquiry kinase.
+    numbering : list of int
+        The residue indices of the 85 pocket residues specific to the structure (0 for gaps).
+
+    Returns
+    -------
+    dih : np.ndarray of int, shape (8, 4)
+        Indices of the four atoms of each dihedral; all zeros for dihedrals with missing atoms.
+    dis : np.ndarray of int, shape (5, 2)
+        Indices of the two atoms of each distance; all zeros for distances with missing atoms.
+    dih_missing : np.ndarray of bool, shape (8, 4)
+        True for each dihedral atom that could not be found in the topology.
+    dis_missing : np.ndarray of bool, shape (5, 2)
+        True for each distance atom that could not be found in the topology.
+
+    """
+    return tuple(array[0] for array in resolve_entry_feature_atoms(topology, [(chainid, numbering)]))
+
+@instrumented('index.resolve')
+def resolve_entry_feature_atoms(topology, chains):
+    """
+    Find the atom indices of the dihedrals and distances of several kinase chains of a structure in one pass.
+
+    Atoms of all requested chains are keyed on (chain, resSeq, atom name) in a single pass over the atoms
+    of these chains, so a multi-chain entry is parsed and traversed once whatever the number of chains.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology of the structure or trajectory to featurize.
+    chains : list of (str, list of int)
+        The chain index and the numbering of the 85 pocket residues (0 for gaps) of each kinase chain.
+
+    Returns
+    -------
+    dih : np.ndarray of int, shape (n_chains, 8, 4)
+        Indices of the four atoms of each dihedral; all zeros for dihedrals with missing atoms.
+    dis : np.ndarray of int, shape (n_chains, 5, 2)
+        Indices of the two atoms of each distance; all zeros for distances with missing atoms.
+    dih_missing : np.ndarray of bool, shape (n_chains, 8, 4)
+        True for each dihedral atom that could not be found in the topology.
+    dis_missing : np.ndarray of bool, shape (n_chains, 5, 2)
+        True for each distance atom that could not be found in the topology.
+
+    """
+    import numpy as np
+    from kinomodel.structures import atom_table
+
+    # translate a letter chain id into a number index (A->0, B->1 etc)
+    # TODO: This may not be robust, since chains aren't always in sequence from A to Z
+    chain_indices = [ord(str(chainid).lower()) - 97 for chainid, _ in chains]
+
+    # key every atom of the requested chains on (chain, resSeq, atom name); atom indices are row numbers
+    table = atom_table(topology)
+    rows = np.flatnonzero(np.isin(table['chainID'], chain_indices))
+    atom_index = dict(zip(zip(table['chainID'][rows].tolist(), table['resSeq'][rows].tolist(),
+                              table['name'][rows].tolist()), rows.tolist()))
+
+    # residue number, offset and name of every feature atom, with gaps (numbering 0) never matching
+    spec = [atom for feature in DIHEDRAL_ATOMS + DISTANCE_ATOMS for atom in feature]
+    found = np.array([[atom_index.get((chain_index, numbering[klifs_index] + offset, name), -1)
+                       if numbering[klifs_index] else -1 for klifs_index, offset, name in spec]
+                      for chain_index, (_, numbering) in zip(chain_indices, chains)], dtype=int)
+    found = found.reshape(len(chains), -1)
+    indices = np.where(found >= 0, found, 0)
+    missing = found < 0
+
+    n_dih = 4 * len(DIHEDRAL_ATOMS)
+    dih = indices[:, :n_dih].reshape(len(chains), -1, 4)
+    dis = indices[:, n_dih:].reshape(len(chains), -1, 2)
+    dih_missing = missing[:, :n_dih].reshape(len(chains), -1, 4)
+    dis_missing = missing[:, n_dih:].reshape(len(chains), -1, 2)
+    # skip the calculation of features with missing coordinates
+    dih[dih_missing.any(axis=2)] = 0
+    dis[dis_missing.any(axis=2)] = 0
+
+    return dih, dis, dih_missing, dis_missing
+
+def compute_simple_protein_features(pdbid, chainid, coordfile, numbering, top=None, chunk=1000, structure_id=None):
     """
     This function takes the PDB code, chain id and certain coordinates of a kinase from
     a command line and returns its structural features.
@@ -76,10 +190,19 @@ def compute_simple_protein_features(pdbid, chainid, coordfile, numbering):
         The PDB code of the inquiry kinase.
     chainid : str
         The chain index of the inquiry kinase.
-    coordfile : str
-        Specifies the file constaining the kinase coordinates (either a pdb file or a trajectory, i.e. trj, dcd, h5)
+    coordfile : str or mdtraj.Trajectory
+        Specifies the kinase coordinates: 'pdb' (the PDB entry), 'dcd' ({pdbid}.dcd with
+        {pdbid}_fixed_solvated.pdb as topology), an in-memory trajectory or the path to a trajectory file
+        (e.g. trj, dcd, h5).
     numbering : list of int
         The residue indices of the 85 pocket residues specific to the structure.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file given as coordfile (e.g. a pdb file for a dcd trajectory).
+    chunk : int, optional, default=1000
+        Number of frames read and featurized at a time.
+    structure_id : int, optional
+        The KLIFS structure_ID the numbering comes from; the atom indices resolved from a topology file
+        are persisted per (topology, chain, structure_ID) and reused by later calls.
 
     Returns
     -------
@@ -93,181 +216,25 @@ def compute_simple_protein_features(pdbid, chainid, coordfile, numbering):
        Instead of featurizing on dihedrals (which are discontinuous), it's often better to use sin() and cos()
        of the dihedrals or some other non-discontinuous representation.
 
-    .. todo :: Instead of a PDB file or a trj/dcd/h5, accept an MDTraj.Trajectory---this will be much more flexible.
-
     .. todo :: Use kwargs with sensible defaults instead of relying only on positional arguments.
 
 
     """
-    import tempfile
-    import os
-    import mdtraj as md
     import numpy as np
+    from .trajectory import iter_protein_features
+
+    if coordfile == 'pdb':
+        from kinomodel.structures import fetch_structure
+        # the PDB file is downloaded once and shared by all featurization code through the local structure cache
+        coordfile = fetch_structure(pdbid)
+    elif coordfile == 'dcd':
+        coordfile, top = str(pdbid) + '.dcd', str(pdbid) + '_fixed_solvated.pdb'
 
-    pdb_file = None
-
-    # A safer way to download files as wget may not exist on systems such MacOS
-    # TODO: Since we retrieve the PDB file in multiple pieces of code, let's refactor this into one utility function
-    # to avoid code duplication.
-    import urllib
-    with urllib.request.urlopen('http://www.pdb.org/pdb/files/{}.pdb'.format(pdbid)) as response:
-        pdb_file = response.read()
-
-    with tempfile.TemporaryDirectory() as pdb_directory:
-        pdb = os.path.join(pdb_directory,'{}.pdb'.format(pdbid))
-        with open(pdb, 'w') as file:
-            file.write(pdb_file.decode())
-            # load traj before the temp pdb file was removed
-            if coordfile == 'pdb':
-                traj = md.load(pdb)
-            # get topology info from the structure
-            topology = md.load(pdb).topology
-
-    table, bonds = topology.to_dataframe()
-    atoms = table.values
-    # translate a letter chain id into a number index (A->0, B->1 etc)
-    # TODO: This may not be robust, since chains aren't always in sequence from A to Z
-    chain_index = ord(str(chainid).lower()) - 97
-
-    # get the array of atom indices for the calculation of:
-    #       * eight dihedrals (a 8*4 array where each row contains indices of the four atoms for each dihedral)
-    #       * five ditances (a 5*2 array where each row contains indices of the two atoms for each dihedral)
-    dih = np.zeros(shape=(8, 4), dtype=int, order='C')
-    dis = np.zeros(shape=(5, 2), dtype=int, order='C')
-
-    # name list of the dihedrals and distances
-    dih_names = [
-        'aC_rot', 'xDFG_phi', 'xDFG_psi', 'dFG_phi', 'dFG_psi', 'DfG_phi',
-        'DfG_psi', 'DfG_chi'
-    ]
-    dis_names = ['K_E1', 'K_E2', 'DFG_conf1', 'DFG_conf2', 'fret']
-
-    # parse the topology info
-    '''
-    The coordinates are located by row number (usually is atom index minus one, which is also why it's zero-based)
-    by mdtraj but when the atom indices are not continuous there is a problem so a safer way to locate the coordinates
-    is through row number (as a fake atom index) in case the atom indices are not continuous.
-    '''
-    count = 0  # keep track of row indices as "atom indices"
-    for line in atoms:
-        # for the specified chain
-        if line[5] == chain_index:
-            # TODO: Use MDTraj DSL instead of this cumbersome comparison scheme.
-            # http://mdtraj.org/latest/atom_selection.html
-
-            # dihedral 1: between aC and aE helices
-            dih[0][0] = count if line[3] == numbering[20] and line[
-                1] == 'CA' else dih[0][0]
-            dih[0][1] = count if line[3] == numbering[28] and line[
-                1] == 'CA' else dih[0][1]
-            dih[0][2] = count if line[3] == numbering[60] and line[
-                1] == 'CA' else dih[0][2]
-            dih[0][3] = count if line[3] == numbering[62] and line[
-                1] == 'CA' else dih[0][3]
-            # dihedral 2 & 3: X-DFG Phi & Psi
-            dih[1][0] = count if line[3] == numbering[78] and line[
-                1] == 'C' else dih[1][0]
-            dih[1][1] = count if line[3] == numbering[79] and line[
-                1] == 'N' else dih[1][1]
-            dih[1][2] = count if line[3] == numbering[79] and line[
-                1] == 'CA' else dih[1][2]
-            dih[1][3] = count if line[3] == numbering[79] and line[
-                1] == 'C' else dih[1][3]
-            dih[2][0] = dih[1][1]
-            dih[2][1] = dih[1][2]
-            dih[2][2] = dih[1][3]
-            dih[2][3] = count if line[3] == numbering[80] and line[
-                1] == 'N' else dih[2][3]
-
-            # dihedral 4 & 5: DFG-Asp Phi & Psi
-            dih[3][0] = dih[1][3]
-            dih[3][1] = dih[2][3]
-            dih[3][2] = count if line[3] == numbering[80] and line[
-                1] == 'CA' else dih[3][2]
-            dih[3][3] = count if line[3] == numbering[80] and line[
-                1] == 'C' else dih[3][3]
-            dih[4][0] = dih[3][1]
-            dih[4][1] = dih[3][2]
-            dih[4][2] = dih[3][3]
-            dih[4][3] = count if line[3] == numbering[81] and line[
-                1] == 'N' else dih[4][3]
-
-            # dihedral 6 & 7: DFG-Phe Phi & Psi
-            dih[5][0] = dih[3][3]
-            dih[5][1] = dih[4][3]
-            dih[5][2] = count if line[3] == numbering[81] and line[
-                1] == 'CA' else dih[5][2]
-            dih[5][3] = count if line[3] == numbering[81] and line[
-                1] == 'C' else dih[5][3]
-            dih[6][0] = dih[5][1]
-            dih[6][1] = dih[5][2]
-            dih[6][2] = dih[5][3]
-            dih[6][3] = count if line[3] == numbering[82] and line[
-                1] == 'N' else dih[6][3]
-
-            # dihedral 8: DFG-Phe Chi
-            dih[7][0] = dih[5][1]
-            dih[7][1] = dih[5][2]
-            dih[7][2] = count if line[3] == numbering[81] and line[
-                1] == 'CB' else dih[7][2]
-            dih[7][3] = count if line[3] == numbering[81] and line[
-                1] == 'CG' else dih[7][3]
-
-            # distance 1 & 2: K-E salt bridge
-            dis[0][0] = count if line[3] == numbering[16] and line[
-                1] == 'NZ' else dis[0][0]
-            dis[0][1] = count if line[3] == numbering[23] and line[
-                1] == 'OE1' else dis[0][1]
-            dis[1][0] = count if line[3] == numbering[16] and line[
-                1] == 'NZ' else dis[1][0]
-            dis[1][1] = count if line[3] == numbering[23] and line[
-                1] == 'OE2' else dis[1][1]
-
-            # distance 3 & 4: DFG conformation-related distances
-            dis[2][0] = count if line[3] == numbering[27] and line[
-                1] == 'CA' else dis[2][0]
-            dis[2][1] = count if line[3] == numbering[81] and line[
-                1] == 'CZ' else dis[2][1]
-            dis[3][0] = count if line[3] == numbering[16] and line[
-                1] == 'CA' else dis[3][0]
-            dis[3][1] = dis[2][1]
-
-            # distance 5: FRET distance
-            dis[4][0] = count if line[3] == int(
-                numbering[80] + 10) and line[1] == 'CA' else dis[4][0]
-            dis[4][1] = count if line[3] == int(
-                numbering[80] - 20) and line[1] == 'CA' else dis[4][1]
-
-        if line[5] > chain_index:
-            break
-
-        count += 1
-    # check if there is any missing coordinates; if so, skip dihedral/distance calculation for those residues
-    check_flag = 1
-    for i in range(len(dih)):
-        if 0 in dih[i]:
-            dih[i] = [0,0,0,0]
-            #logging.info(
-            #    'The "' + str(dih_names[i]) +
-            #    '" dihedral will not be computed due to missing coordinates.')
-            check_flag = 0
-    for i in range(len(dis)):
-        if 0 in dis[i]:
-            dis[i] = [0,0]
-            #logging.info(
-            #    'The "' + str(dis_names[i]) +
-            #    '" distance will not be calculated due to missing coordinates.'
-            #)
-            check_flag = 0
-    #if check_flag:
-        #logging.info(
-        #    "There is no missing coordinates.  All dihedrals and distances will be computed."
-        #)
     # calculate the dihedrals and distances for the user-specifed structure (a static structure or an MD trajectory)
-    if coordfile == 'dcd':
-        traj = md.load(str(pdbid) + '.dcd',top = str(pdbid) + '_fixed_solvated.pdb')
-    dihedrals = md.compute_dihedrals(traj, dih)
-    distances = md.compute_distances(traj, dis)
+    chunks = list(iter_protein_features(coordfile, chainid, numbering, top=top, chunk=chunk,
+                                        structure_id=structure_id))
+    dihedrals = np.concatenate([chunk_dihedrals for chunk_dihedrals, _ in chunks])
+    distances = np.concatenate([chunk_distances for _, chunk_distances in chunks])
 
     # option to log the results
     '''
@@ -280,13 +247,45 @@ def compute_simple_protein_features(pdbid, chainid, coordfile, numbering):
     logging.info(distances)
     '''
 
-    # clean up
-    # TODO: This is dangerous! Instead, rely on using the "with tempfile.TemporaryDirectory" context manager idiom to create and clean up temporary directories
-    #import subprocess
-    #rm_file = 'rm ./' + str(pdb) + '.pdb*'
-    #rm_file = 'rm ./' + str(pdb) + '.pdb*'
-    #subprocess.call(rm_file, shell=True)
+    return dihedrals, distances
+
+def compute_entry_protein_features(pdbid, chains, coordfile='pdb', top=None, chunk=1000):
+    """
+    Compute the dihedrals and distances of every kinase chain of a PDB entry from a single parse.
+
+    Parameters
+    ----------
+    pdbid : str
+        The PDB code of the entry.
+    chains : list of (str, list of int)
+        The chain index and the numbering of the 85 pocket residues of each kinase chain,
+        e.g. [(klifs.chain, klifs.numbering) for klifs in query_klifs.query_klifs_entry(pdbid)].
+    coordfile : str or mdtraj.Trajectory, optional, default='pdb'
+        The coordinates, as in compute_simple_protein_features.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file given as coordfile.
+    chunk : int, optional, default=1000
+        Number of frames read and featurized at a time.
+
+    Returns
+    -------
+    dihedrals : np.ndarray, shape (n_chains, n_frames, 8)
+        dihedrals[i] are the dihedrals of chains[i], as returned by compute_simple_protein_features.
+    distances : np.ndarray, shape (n_chains, n_frames, 5)
+        distances[i] are the distances of chains[i], as returned by compute_simple_protein_features.
+
+    """
+    import numpy as np
+    from .trajectory import iter_entry_protein_features
+
+    if coordfile == 'pdb':
+        from kinomodel.structures import fetch_structure
+        coordfile = fetch_structure(pdbid)
+    elif coordfile == 'dcd':
+        coordfile, top = str(pdbid) + '.dcd', str(pdbid) + '_fixed_solvated.pdb'
 
-    del traj, dih, dis
+    chunks = list(iter_entry_protein_features(coordfile, chains, top=top, chunk=chunk))
+    dihedrals = np.concatenate([chunk_dihedrals for chunk_dihedrals, _ in chunks], axis=1)
+    distances = np.concatenate([chunk_distances for _, chunk_distances in chunks], axis=1)
 
     return dihedrals, distances
@@ -5,15 +5,15 @@ http://klifs.vu-compmedchem.nl/
 
 """
 
-# Setup general logging (guarantee output/error message in case of interruption)
-# TODO: Can we log to the terminal instead?
+# Log messages are sent to the terminal by the command-line tools (see utils.configure_logging),
+# not configured at import time
 import logging
 logger = logging.getLogger(__name__)
-logging.root.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO, format="%(message)s")
-logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-def query_klifs_database(pdbid, chainid):
+from kinomodel.instrumentation import instrumented
+
+@instrumented('klifs.parse')
+def query_klifs_database(pdbid, chainid, cache=None):
     """
     Retrieve KLIFS information from the KLIFTS database.
 
@@ -23,6 +23,9 @@ def query_klifs_database(pdbid, chainid):
         The PDB code of the inquiry kinase.
     chainid: str
         The chain index of the inquiry kinase.
+    cache: kinomodel.features.klifs_cache.KlifsCache, optional
+        The cache of KLIFS metadata to use. Defaults to the shared persistent cache,
+        so each structure is only queried from KLIFS once.
 
     Returns
     -------
@@ -31,28 +34,25 @@ def query_klifs_database(pdbid, chainid):
         ligand name, the 85 pocket residues and their numbering) for the desired pdbid and chain.
 
     """
-    import urllib, requests
-    # absolute import (with kinomodel installed)
-    #from kinomodel.models import klifs
-    # JG (temperary)
-    from features import klifs
+    # relative imports work both with kinomodel installed and from within the package directory
+    from . import klifs
+    from .klifs_cache import get_klifs_cache
+
+    if cache is None:
+        cache = get_klifs_cache()
 
     # get information of the query kinase from the KLIFS database and gives values
     # of kinase_id, name and pocket_seq (numbering)
-    url = "http://klifs.vu-compmedchem.nl/api/structures_pdb_list?pdb-codes=" + str(pdbid)
+    structures = cache.structures(str(pdbid))
 
     # check to make to sure the search returns valid info
     # if return is empty
-    if len(requests.get(url).text) == 0:
+    if len(structures) == 0:
         raise ValueError("No data found in KLIFS for pdbid '{}'.".format(pdbid))
-    else:
-        # clean up the info from KLIFS
-        clean = requests.get(url).text.replace('true', 'True').replace('false', 'False')
 
     # each pdb code corresponds to multiple structures
     chain_found = False
-    import ast
-    for structure in ast.literal_eval(clean):
+    for structure in structures:
         # find the specific chain
         if structure['chain'] == str(chainid):
             kinase_id = int(structure['kinase_ID'])
@@ -69,14 +69,7 @@ def query_klifs_database(pdbid, chainid):
                          "Please make sure you provide a capital letter (A, B, C, ...) as a chain ID.".format(chainid))
 
     # Get the numbering of the 85 pocket residues
-    cmd = "http://klifs.vu-compmedchem.nl/details.php?structure_id=" + str(struct_id)
-    preload = urllib.request.urlopen(cmd)
-    info = urllib.request.urlopen(cmd)
-    for line_number, line in enumerate(info):
-        line = line.decode()
-        if 'pocketResidues=[' in line:
-            numbering = ast.literal_eval(
-                (line[line.find('=') + 1:line.find(';')]))
+    numbering = list(cache.numbering(struct_id))
     # check if there is gaps/missing residues among the pocket residues.
     # If so, enforce their indices as 0 and avoid using them to compute collective variables.
     for i in range(len(numbering)):
@@ -103,3 +96,56 @@ def query_klifs_database(pdbid, chainid):
         pocket_seq, numbering)
 
     return klifs_info
+
+def query_klifs_entry(pdbid, cache=None):
+    """
+    Retrieve KLIFS information for every kinase chain of a PDB entry.
+
+    Parameters
+    ----------
+    pdbid: str
+        The PDB code of the entry.
+    cache: kinomodel.features.klifs_cache.KlifsCache, optional
+        The cache of KLIFS metadata to use. Defaults to the shared persistent cache.
+
+    Returns
+    -------
+    klifs_infos: list of kinomodel.models.Klifs
+        The KLIFS information of each chain of the entry, in chain order.
+
+    """
+    from .klifs_cache import get_klifs_cache
+
+    if cache is None:
+        cache = get_klifs_cache()
+
+    structures = cache.structures(str(pdbid))
+    if len(structures) == 0:
+        raise ValueError("No data found in KLIFS for pdbid '{}'.".format(pdbid))
+
+    chains = sorted(set(str(structure['chain']) for structure in structures))
+    return [query_klifs_database(pdbid, chain, cache=cache) for chain in chains]
+
+def prefetch_klifs(pdb_ids, cache=None, **kwargs):
+    """
+    Retrieve the KLIFS information of many structures ahead of featurization.
+
+    Structure records are requested in batches of PDB codes (structures_pdb_list?pdb-codes=a,b,c)
+    and stored with the pocket numberings in the persistent cache, so subsequent calls to
+    query_klifs_database for these structures do not query KLIFS again.
+
+    Parameters
+    ----------
+    pdb_ids: list of str
+        The PDB codes of the structures.
+    cache: kinomodel.features.klifs_cache.KlifsCache, optional
+        The cache of KLIFS metadata to fill. Defaults to the shared persistent cache.
+    kwargs: optional
+        Passed to KlifsCache.prefetch (batch_size, numbering, n_threads).
+
+    """
+    from .klifs_cache import get_klifs_cache
+
+    if cache is None:
+        cache = get_klifs_cache()
+    cache.prefetch(pdb_ids, **kwargs)
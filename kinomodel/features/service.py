@@ -0,0 +1,447 @@
+"""
+service.py
+A long-lived featurization service with warm in-memory caches.
+
+Every featurize call in a new process imports mdtraj, reads KLIFS metadata, parses the structure and
+resolves the atoms of the features. The service does this once per structure and keeps the KLIFS
+records, parsed structures (or topologies of trajectories) and resolved atom indices in memory, each
+in an LRU cache of bounded size, so repeated requests only compute the features.
+
+Requests are JSON documents POSTed over HTTP, either on a local Unix socket (the default) or on a
+TCP port. ServiceClient.featurize mirrors featurize(**kwargs).
+
+    kinomodel serve [--address /path/to/kinomodel.sock | http://127.0.0.1:8765]
+
+"""
+
+import json
+import os
+
+
+def default_address():
+    """Return the address of the service: KINOMODEL_SERVICE, or a Unix socket under KINOMODEL_CACHE_DIR."""
+    from kinomodel.utils import get_cache_dir
+
+    return os.environ.get('KINOMODEL_SERVICE') or os.path.join(get_cache_dir('service'), 'kinomodel.sock')
+
+
+def _encode(value):
+    """Return a JSON-serializable copy of a featurization result."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {name: _encode(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+
+    return value
+
+
+class FeaturizationService(object):
+
+    def __init__(self, max_structures=64, max_klifs=4096, max_indices=4096, klifs_cache=None):
+        """Featurization with in-memory caches of KLIFS records, structures and atom indices.
+
+        Parameters
+        ----------
+        max_structures: int, optional, default=64
+            The number of parsed structures and trajectory topologies kept in memory.
+        max_klifs: int, optional, default=4096
+            The number of KLIFS records (one per PDB entry and chain) kept in memory.
+        max_indices: int, optional, default=4096
+            The number of resolved atom index maps (one per structure, chain and feature) kept in memory.
+        klifs_cache: kinomodel.features.klifs_cache.KlifsCache, optional
+            The persistent cache KLIFS records are read from. Defaults to the shared cache.
+
+        """
+        from kinomodel.utils import LRUCache
+
+        self.klifs_cache = klifs_cache
+        self.structures = LRUCache(max_structures)
+        self.klifs = LRUCache(max_klifs)
+        self.indices = LRUCache(max_indices)
+
+    def _klifs(self, pdb, chain):
+        from .query_klifs import query_klifs_database
+
+        key = (str(pdb).upper(), str(chain))
+        klifs = self.klifs.get(key)
+        if klifs is None:
+            klifs = query_klifs_database(pdb, chain, cache=self.klifs_cache)
+            self.klifs.put(key, klifs)
+
+        return klifs
+
+    def _coordinates(self, pdb, coord, top):
+        """Return the coordinates (a parsed structure or a trajectory file), their topology and its cache key.
+
+        Structures and topologies are keyed by the SHA-256 of the file, so the same file is parsed once
+        whatever its path, and a file changed in place is parsed again.
+        """
+        import mdtraj as md
+        from kinomodel.instrumentation import stage
+        from kinomodel.structures import is_structure_file, load_structure
+        from .atom_index import TOPOLOGY_EXTENSIONS, topology_hash
+
+        if coord == 'pdb':
+            from kinomodel.structures import fetch_structure
+            coord = fetch_structure(pdb)
+        elif coord == 'dcd':
+            coord, top = str(pdb) + '.dcd', str(pdb) + '_fixed_solvated.pdb'
+
+        if top is None and is_structure_file(coord):
+            structure = load_structure(coord, cache=self.structures)
+            return structure.trajectory, None, structure.key
+
+        source = top if top is not None else coord
+        if is_structure_file(source):
+            structure = load_structure(source, cache=self.structures)
+            return coord, structure.topology, structure.key
+        if source.lower().endswith(TOPOLOGY_EXTENSIONS):
+            key = topology_hash(source)
+        else:
+            # trajectory files with an embedded topology may be too large to hash
+            stat = os.stat(source)
+            key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+        topology = self.structures.get(key)
+        if topology is None:
+            with stage('topology.parse', path=source):
+                topology = md.load_topology(source)
+            self.structures.put(key, topology)
+        return coord, topology, key
+
+    def _index(self, key, resolve):
+        index = self.indices.get(key)
+        if index is None:
+            index = resolve()
+            self.indices.put(key, index)
+
+        return index
+
+    def featurize(self, pdb, chain, feature, coord='pdb', top=None, store=None, chunk=1000):
+        """Compute structural and/or interaction features, as featurize does.
+
+        Parameters
+        ----------
+        pdb: str
+            The PDB code of the structure.
+        chain: str
+            The chain index of the structure.
+        feature: str
+            'conf' (protein conformation), 'interact' (protein-ligand interaction) or 'both'.
+        coord: str, optional, default='pdb'
+            'pdb' (the PDB entry), 'dcd' ({pdb}.dcd with {pdb}_fixed_solvated.pdb as topology, relative to
+            the working directory of the service), or the path to a structure or trajectory file.
+        top: str, optional
+            The topology of a trajectory file given as coord.
+        store: str, optional
+            A feature store directory the features are appended to.
+        chunk: int, optional, default=1000
+            Number of frames read and featurized at a time.
+
+        Returns
+        -------
+        features: dict
+            'key_res', 'dihedrals' and 'distances' and/or 'mean_dist', as returned by featurize.
+
+        """
+        import numpy as np
+        from . import protein as pf
+        from .atom_index import resolve_atom_index
+        from .interactions import resolve_interaction_atoms
+        from .trajectory import load_topology, _iter_features, _iter_interactions
+
+        if feature not in ('conf', 'interact', 'both'):
+            raise ValueError("Unknown feature '{}'".format(feature))
+
+        klifs = self._klifs(pdb, chain)
+        coords, topology, key = self._coordinates(pdb, coord, top)
+        topology = load_topology(coords, topology)
+
+        features = {}
+        dihedrals, distances, mean_dist = None, None, None
+        if feature in ('conf', 'both'):
+            index = self._index((key, str(chain), klifs.struct_id, 'conf'),
+                                lambda: resolve_atom_index(topology, chain, klifs.numbering))
+            chunks = list(_iter_features(coords, index['dih'], index['dis'], topology, chunk, None))
+            dihedrals = np.concatenate([chunk_dihedrals for chunk_dihedrals, _ in chunks])
+            distances = np.concatenate([chunk_distances for _, chunk_distances in chunks])
+            features.update(key_res=pf.key_klifs_residues(klifs.numbering), dihedrals=dihedrals, distances=distances)
+        if feature in ('interact', 'both'):
+            atoms = self._index((key, str(chain), klifs.struct_id, 'interact'),
+                                lambda: resolve_interaction_atoms(topology, chain, klifs.ligand, klifs.numbering))
+            mean_dist = []
+            for chunk_features in _iter_interactions(coords, *atoms, topology, chunk, None, ['per_residue'], 0.4):
+                # as in compute_simple_interaction_features
+                mean_dist.extend(np.nansum(chunk_features['per_residue'], axis=1) / len(klifs.numbering))
+            features['mean_dist'] = mean_dist
+
+        if store:
+            from .store import FeatureStore
+            with FeatureStore(store) as feature_store:
+                feature_store.append(pdb, chain, dihedrals=dihedrals, distances=distances, mean_dist=mean_dist,
+                                     kinase_id=klifs.kinase_id, kinase=klifs.name, structure_id=klifs.struct_id,
+                                     ligand=klifs.ligand)
+
+        return features
+
+    def stats(self):
+        """Return the size, hits and misses of every cache."""
+        return {'structures': self.structures.stats(), 'klifs': self.klifs.stats(), 'indices': self.indices.stats()}
+
+    def handle(self, request):
+        """Answer a request.
+
+        Parameters
+        ----------
+        request: dict
+            {'method': 'featurize', 'kwargs': {...}}, {'method': 'stats'} or {'method': 'ping'}.
+
+        Returns
+        -------
+        response: dict
+            {'result': ...}, or {'error': message, 'type': exception name} if the request failed.
+
+        """
+        try:
+            method = request.get('method')
+            if method == 'featurize':
+                result = self.featurize(**request.get('kwargs', {}))
+            elif method == 'stats':
+                result = self.stats()
+            elif method == 'ping':
+                result = 'pong'
+            else:
+                raise ValueError("Unknown method '{}'".format(method))
+        except Exception as error:
+            return {'error': str(error), 'type': type(error).__name__}
+
+        return {'result': _encode(result)}
+
+
+def _handler(service):
+    """Return an HTTP request handler class answering JSON requests with a service."""
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as error:
+                response = {'error': 'Invalid request: {}'.format(error), 'type': 'ValueError'}
+            else:
+                response = service.handle(request)
+            body = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            # Unix socket clients have no address
+            return str(self.client_address[0]) if self.client_address else 'unix'
+
+        def log_message(self, format, *args):
+            import logging
+            logging.getLogger(__name__).debug(format, *args)
+
+    return Handler
+
+
+def create_server(address=None, service=None):
+    """
+    Create the HTTP server of a featurization service.
+
+    Parameters
+    ----------
+    address : str, optional
+        'http://host:port' to listen on a TCP port, or the path of a Unix socket (optionally as
+        'unix://path'). See default_address.
+    service : FeaturizationService, optional
+        The service answering requests. A new service with default cache sizes by default.
+
+    Returns
+    -------
+    server : socketserver.BaseServer
+        The server, answering requests in threads; call serve_forever() to run it.
+
+    """
+    import socketserver
+    from http.server import ThreadingHTTPServer
+    from urllib.parse import urlparse
+
+    address = address or default_address()
+    handler = _handler(service if service is not None else FeaturizationService())
+    if address.startswith('http://'):
+        url = urlparse(address)
+        return ThreadingHTTPServer((url.hostname, url.port or 80), handler)
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    path = address[len('unix://'):] if address.startswith('unix://') else address
+    if os.path.exists(path):
+        # a socket left behind by a service that did not shut down cleanly
+        os.remove(path)
+
+    return UnixHTTPServer(path, handler)
+
+
+def serve(address=None, service=None):
+    """
+    Run a featurization service until interrupted.
+
+    Parameters
+    ----------
+    address : str, optional
+        See create_server.
+    service : FeaturizationService, optional
+        See create_server.
+
+    """
+    import logging
+
+    server = create_server(address, service)
+    logging.info('kinomodel service listening on {}'.format(address or default_address()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+
+
+class ServiceClient(object):
+
+    def __init__(self, address=None, timeout=None):
+        """A client of a featurization service.
+
+        Parameters
+        ----------
+        address: str, optional
+            The address of the service, see create_server. Defaults to default_address().
+        timeout: float, optional
+            The time (in s) to wait for a response. No limit by default.
+
+        """
+        self.address = address or default_address()
+        self.timeout = timeout
+
+    def _connection(self):
+        import http.client
+        import socket
+        from urllib.parse import urlparse
+
+        if self.address.startswith('http://'):
+            url = urlparse(self.address)
+            return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+        path = self.address[len('unix://'):] if self.address.startswith('unix://') else self.address
+        timeout = self.timeout
+
+        class UnixHTTPConnection(http.client.HTTPConnection):
+
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(path)
+
+        return UnixHTTPConnection('localhost', timeout=timeout)
+
+    def request(self, method, **kwargs):
+        """Send a request to the service and return its result.
+
+        Parameters
+        ----------
+        method: str
+            'featurize', 'stats' or 'ping'.
+        kwargs: optional
+            The arguments of the method.
+
+        Returns
+        -------
+        result
+            The result of the method, decoded from JSON.
+
+        """
+        connection = self._connection()
+        try:
+            body = json.dumps({'method': method, 'kwargs': kwargs})
+            connection.request('POST', '/', body=body, headers={'Content-Type': 'application/json'})
+            response = json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+        if 'error' in response:
+            if response.get('type') in ('ValueError', 'KeyError', 'FileNotFoundError'):
+                raise ValueError(response['error'])
+            raise RuntimeError('{}: {}'.format(response.get('type'), response['error']))
+
+        return response['result']
+
+    def featurize(self, **kwargs):
+        """Compute structural and/or interaction features in the service, with the arguments of featurize.
+
+        Parameters
+        ----------
+        kwargs: dict
+            pdb, chain, feature and coord, and optionally store, as for featurize; top and chunk as for
+            FeaturizationService.featurize. Relative paths are resolved in the working directory of the client.
+
+        Returns
+        -------
+        The features, as returned by featurize: (key_res, dihedrals, distances) for 'conf', mean_dist for
+        'interact', and (key_res, dihedrals, distances, mean_dist) for 'both'.
+
+        """
+        import numpy as np
+
+        for name in ('pdb', 'chain', 'feature', 'coord'):
+            if name not in kwargs:
+                raise ValueError("Missing argument '{}'".format(name))
+        if kwargs['coord'] == 'dcd':
+            # the trajectory of the structure in the working directory of the client
+            pdb = kwargs['pdb']
+            kwargs = dict(kwargs, coord=str(pdb) + '.dcd', top=str(pdb) + '_fixed_solvated.pdb')
+        for name in ('coord', 'top', 'store'):
+            if kwargs.get(name) and kwargs[name] != 'pdb':
+                kwargs[name] = os.path.abspath(kwargs[name])
+
+        features = self.request('featurize', **kwargs)
+        conf = (features.get('key_res'), np.array(features.get('dihedrals')), np.array(features.get('distances')))
+        if kwargs['feature'] == 'conf':
+            return conf
+        elif kwargs['feature'] == 'interact':
+            return features['mean_dist']
+        else:
+            return conf + (features['mean_dist'],)
+
+    def stats(self):
+        """Return the size, hits and misses of the caches of the service."""
+        return self.request('stats')
+
+
+def main(argv=None):
+    """Command-line entry point of the featurization service (kinomodel serve)."""
+    import argparse
+    from kinomodel.instrumentation import instrument_run
+    from kinomodel.utils import configure_logging
+
+    parser = argparse.ArgumentParser(prog='kinomodel serve',
+                                     description='Featurize kinase structures in a long-lived service')
+    parser.add_argument('--address', default=None,
+                        help='a Unix socket path or http://host:port (default: $KINOMODEL_SERVICE or a socket '
+                             'in the kinomodel cache directory)')
+    parser.add_argument('--max-structures', type=int, default=64, help='the number of structures kept in memory')
+    parser.add_argument('--max-klifs', type=int, default=4096, help='the number of KLIFS records kept in memory')
+    parser.add_argument('--max-indices', type=int, default=4096,
+                        help='the number of resolved atom index maps kept in memory')
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    with instrument_run('kinomodel-serve'):
+        serve(args.address, FeaturizationService(max_structures=args.max_structures, max_klifs=args.max_klifs,
+                                                 max_indices=args.max_indices))
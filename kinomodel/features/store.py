@@ -0,0 +1,238 @@
+"""
+store.py
+A columnar store of kinase features.
+
+Features are stored in Parquet files with one row per (pdb, chain, frame): the KLIFS metadata of the
+structure, one column per dihedral (protein.dih_names) and distance (protein.dis_names), and the mean
+ligand-pocket distance. A store is a directory of compressed Parquet files; every writing session adds
+one file, made of one row group per appended chunk, which becomes visible once the session is closed.
+Selected columns are read back through memory-mapped files, without recomputing or unpickling anything.
+
+"""
+
+import os
+
+# KLIFS metadata columns and their types, followed by the feature columns (float)
+METADATA_COLUMNS = [('pdb', 'string'), ('chain', 'string'), ('frame', 'int64'), ('kinase_id', 'int64'),
+                    ('kinase', 'string'), ('structure_id', 'int64'), ('ligand', 'string')]
+
+
+def feature_columns():
+    """Return the names of the feature columns of a store, in order."""
+    from .protein import dih_names, dis_names
+
+    return dih_names + dis_names + ['mean_dist']
+
+
+def feature_schema():
+    """Return the Arrow schema of a feature store."""
+    import pyarrow as pa
+
+    fields = [pa.field(name, getattr(pa, kind)()) for name, kind in METADATA_COLUMNS]
+    fields += [pa.field(name, pa.float32()) for name in feature_columns()]
+
+    return pa.schema(fields)
+
+
+class FeatureStore(object):
+
+    def __init__(self, path, compression='zstd'):
+        """A directory of Parquet files holding kinase features, one row per (pdb, chain, frame).
+
+        Parameters
+        ----------
+        path: str
+            The directory of the store; it is created if needed.
+        compression: str, optional, default='zstd'
+            The compression of the Parquet files written (e.g. 'zstd', 'snappy', 'gzip' or 'none').
+
+        """
+        self.path = path
+        self.compression = compression
+        self._writer = None
+        self._part = None
+
+    def append(self, pdb, chain, dihedrals=None, distances=None, mean_dist=None, kinase_id=None, kinase=None,
+               structure_id=None, ligand=None, first_frame=0):
+        """Append the features of a chunk of frames of a structure.
+
+        Parameters
+        ----------
+        pdb: str
+            The PDB code of the structure.
+        chain: str
+            The chain index of the structure.
+        dihedrals: array of float, shape (n_frames, 8), optional
+            The dihedrals, as returned by compute_simple_protein_features.
+        distances: array of float, shape (n_frames, 5), optional
+            The distances, as returned by compute_simple_protein_features.
+        mean_dist: array of float, shape (n_frames,), optional
+            The mean ligand-pocket distances, as returned by compute_simple_interaction_features.
+        kinase_id, kinase, structure_id, ligand: optional
+            The KLIFS kinase_ID, kinase name, structure_ID and ligand name of the structure.
+        first_frame: int, optional, default=0
+            The index of the first frame of the chunk in the trajectory.
+
+        """
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from kinomodel.instrumentation import stage
+        from .protein import dih_names, dis_names
+
+        features = {}
+        for names, values in ((dih_names, dihedrals), (dis_names, distances), (['mean_dist'], mean_dist)):
+            if values is not None:
+                values = np.asarray(values, dtype=np.float32).reshape(-1, len(names))
+                features.update((name, values[:, i]) for i, name in enumerate(names))
+        if not features:
+            raise ValueError('No features to append for {} chain {}'.format(pdb, chain))
+        n_frames = len(next(iter(features.values())))
+        if any(len(values) != n_frames for values in features.values()):
+            raise ValueError('Features of {} chain {} have different numbers of frames'.format(pdb, chain))
+
+        metadata = {'pdb': str(pdb).upper(), 'chain': str(chain), 'kinase_id': kinase_id, 'kinase': kinase,
+                    'structure_id': structure_id, 'ligand': ligand}
+        schema = feature_schema()
+        columns = []
+        for field in schema:
+            if field.name == 'frame':
+                columns.append(pa.array(np.arange(first_frame, first_frame + n_frames), type=field.type))
+            elif field.name in metadata:
+                columns.append(pa.array([metadata[field.name]] * n_frames, type=field.type))
+            elif field.name in features:
+                columns.append(pa.array(features[field.name], type=field.type))
+            else:
+                columns.append(pa.nulls(n_frames, type=field.type))
+
+        if self._writer is None:
+            import time
+            os.makedirs(self.path, exist_ok=True)
+            # files starting with a dot are ignored by readers until they are renamed in close()
+            self._part = 'part-{:.0f}-{}.parquet'.format(time.time() * 1e6, os.getpid())
+            self._writer = pq.ParquetWriter(os.path.join(self.path, '.' + self._part), schema,
+                                            compression=self.compression)
+        # every chunk becomes a row group
+        table = pa.Table.from_arrays(columns, schema=schema)
+        with stage('file.write', table.nbytes, path=self.path):
+            self._writer.write_table(table)
+
+    @property
+    def part(self):
+        """The name of the file written by this session (None until something is appended)."""
+        return self._part
+
+    def close(self):
+        """Finish the file written by this session and make it visible to readers."""
+        if self._writer is not None:
+            self._writer.close()
+            os.replace(os.path.join(self.path, '.' + self._part), os.path.join(self.path, self._part))
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, columns=None, filters=None):
+        """Read the features of the store.
+
+        Parameters
+        ----------
+        columns: list of str, optional
+            The columns to read (see METADATA_COLUMNS and feature_columns()). All columns by default.
+        filters: list of tuple, optional
+            Row filters, e.g. [('pdb', '=', '3PP0'), ('chain', '=', 'A')]; row groups that cannot
+            match are skipped.
+
+        Returns
+        -------
+        features: pandas.DataFrame
+            One row per (pdb, chain, frame); features that were not computed are NaN.
+
+        """
+        return read_features(self.path, columns=columns, filters=filters)
+
+
+def read_features(path, columns=None, filters=None):
+    """
+    Read the features of a store.
+
+    Only the requested columns are read, through memory-mapped files.
+
+    Parameters
+    ----------
+    path: str
+        The directory of the store.
+    columns: list of str, optional
+        The columns to read. All columns by default.
+    filters: list of tuple, optional
+        Row filters, e.g. [('pdb', '=', '3PP0'), ('chain', '=', 'A')].
+
+    Returns
+    -------
+    features: pandas.DataFrame
+        One row per (pdb, chain, frame), in the order they were written.
+
+    """
+    import pyarrow.parquet as pq
+
+    parts = sorted(name for name in os.listdir(path) if name.startswith('part-') and name.endswith('.parquet'))
+    if not parts:
+        return feature_schema().empty_table().select(columns or feature_schema().names).to_pandas()
+    table = pq.read_table([os.path.join(path, part) for part in parts], columns=columns, filters=filters,
+                          memory_map=True, schema=feature_schema())
+
+    return table.to_pandas()
+
+
+def iter_trajectories(path, columns=None, batch_size=65536):
+    """
+    Iterate over the features of a store in chunks of consecutive frames of one trajectory.
+
+    Files are read one record batch at a time, so memory use does not depend on the size of the store.
+    A trajectory is a run of rows with the same pdb and chain and consecutive frames.
+
+    Parameters
+    ----------
+    path: str
+        The directory of the store.
+    columns: list of str, optional
+        The feature columns to read. All feature columns by default.
+    batch_size: int, optional, default=65536
+        The maximum number of rows read at a time.
+
+    Yields
+    ------
+    start: bool
+        True if the chunk starts a new trajectory, False if it continues the previous chunk.
+    features: pandas.DataFrame
+        The pdb, chain and frame columns and the requested feature columns of the chunk.
+
+    """
+    import numpy as np
+    import pyarrow.parquet as pq
+
+    columns = ['pdb', 'chain', 'frame'] + [name for name in (columns or feature_columns())
+                                           if name not in ('pdb', 'chain', 'frame')]
+    previous = None
+    for part in sorted(name for name in os.listdir(path) if name.startswith('part-') and name.endswith('.parquet')):
+        parquet_file = pq.ParquetFile(os.path.join(path, part), memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            chunk = batch.to_pandas()
+            keys = list(zip(chunk['pdb'], chunk['chain']))
+            frames = chunk['frame'].values
+            # rows that do not continue the trajectory of the row before them
+            breaks = np.ones(len(chunk), dtype=bool)
+            breaks[1:] = [keys[i] != keys[i - 1] for i in range(1, len(keys))] | (frames[1:] != frames[:-1] + 1)
+            if len(chunk) and previous is not None:
+                breaks[0] = (keys[0], frames[0]) != (previous[0], previous[1] + 1)
+            bounds = list(np.flatnonzero(breaks)) + [len(chunk)]
+            if not bounds or bounds[0] != 0:
+                bounds.insert(0, 0)
+            for begin, end in zip(bounds[:-1], bounds[1:]):
+                if end > begin:
+                    yield bool(breaks[begin]), chunk.iloc[begin:end].reset_index(drop=True)
+            if len(chunk):
+                previous = (keys[-1], frames[-1])
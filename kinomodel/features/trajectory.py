@@ -0,0 +1,276 @@
+"""
+trajectory.py
+Featurization of kinase structures and trajectories, streamed in chunks of frames.
+
+Atom indices are resolved once from the topology, and only the atoms involved in the features
+are read from trajectory files, so memory use does not grow with the length of the trajectory.
+Structure files (and the topology files of trajectories) are parsed once per process by
+structures.load_structure, and shared by all features computed from them. When the atom indices
+of a trajectory are known (see atom_index.load_atom_index), its topology file is not parsed at all.
+
+"""
+
+
+def load_topology(coords, top=None):
+    """
+    Return the topology of an in-memory trajectory or a structure/trajectory file.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information (e.g. a pdb file for a dcd trajectory).
+
+    Returns
+    -------
+    topology : mdtraj.Topology
+
+    """
+    import mdtraj as md
+    from kinomodel.instrumentation import stage
+    from kinomodel.structures import is_structure_file, load_structure
+
+    if isinstance(coords, md.Trajectory):
+        return coords.topology
+    if isinstance(top, md.Topology):
+        return top
+
+    source = top if top is not None else coords
+    if is_structure_file(source):
+        # parsed once per process and shared with iterload and the other featurization code
+        return load_structure(source).topology
+    with stage('topology.parse', path=str(source)):
+        return md.load_topology(source)
+
+
+# trajectory files whose coordinates can be read without their topology
+COORDINATE_EXTENSIONS = ('.dcd', '.xtc', '.trr', '.nc', '.ncdf', '.netcdf')
+
+
+def _placeholder_topology(n_atoms):
+    """Return a topology of n_atoms unnamed atoms, for frames whose topology is not needed."""
+    import mdtraj as md
+
+    topology = md.Topology()
+    residue = topology.add_residue('UNK', topology.add_chain())
+    for _ in range(n_atoms):
+        topology.add_atom('X', md.element.virtual, residue)
+
+    return topology
+
+
+def iterload(coords, top=None, chunk=1000, stride=None, atom_indices=None, coordinates_only=False):
+    """
+    Iterate over chunks of frames of an in-memory trajectory or a trajectory file.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+    chunk : int, optional, default=1000
+        Number of frames per chunk.
+    stride : int, optional
+        Only read every stride-th frame.
+    atom_indices : array of int, optional
+        Only read these atoms; atoms are renumbered from 0 in the order given.
+    coordinates_only : bool, optional, default=False
+        If True, only coordinates and unit cells are used, so a trajectory file with a separate topology
+        file (see COORDINATE_EXTENSIONS) is read without parsing the topology; its frames then have a
+        placeholder topology.
+
+    Yields
+    ------
+    frames : mdtraj.Trajectory
+        Up to chunk consecutive frames.
+
+    """
+    import mdtraj as md
+    from kinomodel.structures import is_structure_file, load_structure
+
+    if top is None and is_structure_file(coords):
+        # structure files are parsed once per process (see structures.load_structure)
+        coords = load_structure(coords).trajectory
+    if isinstance(coords, md.Trajectory):
+        traj = coords if atom_indices is None else coords.atom_slice(atom_indices)
+        if stride:
+            traj = traj[::stride]
+        for start in range(0, traj.n_frames, chunk):
+            yield traj[start:start + chunk]
+    elif (coordinates_only and top is not None and atom_indices is not None and len(atom_indices)
+          and str(coords).lower().endswith(COORDINATE_EXTENSIONS)):
+        placeholder = _placeholder_topology(int(max(atom_indices)) + 1)
+        with md.open(coords) as trajectory_file:
+            while True:
+                frames = trajectory_file.read_as_traj(placeholder, n_frames=chunk, stride=stride,
+                                                      atom_indices=atom_indices)
+                if frames.n_frames == 0:
+                    break
+                yield frames
+    else:
+        kwargs = dict(chunk=chunk, stride=stride, atom_indices=atom_indices)
+        if top is not None:
+            kwargs['top'] = load_structure(top).topology if is_structure_file(top) else top
+        for frames in md.iterload(coords, **kwargs):
+            yield frames
+
+
+def iter_protein_features(coords, chainid, numbering, top=None, chunk=1000, stride=None, structure_id=None,
+                          index_cache=None):
+    """
+    Compute the dihedrals and distances relevant to kinase conformation, one chunk of frames at a time.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    chainid : str
+        The chain index of the inquiry kinase.
+    numbering : list of int
+        The residue indices of the 85 pocket residues specific to the structure.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+    chunk : int, optional, default=1000
+        Number of frames per chunk.
+    stride : int, optional
+        Only featurize every stride-th frame.
+    structure_id : int, optional
+        The KLIFS structure_ID the numbering comes from, used to key the persisted atom indices.
+    index_cache : kinomodel.features.atom_index.AtomIndexCache or False, optional
+        The cache of atom indices resolved from topology files. Defaults to the shared cache;
+        False disables caching.
+
+    Yields
+    ------
+    dihedrals : np.ndarray, shape (n_frames, 8)
+        Dihedrals (in radians) of the frames of the chunk, named as in protein.dih_names.
+    distances : np.ndarray, shape (n_frames, 5)
+        Distances (in nm) of the frames of the chunk, named as in protein.dis_names.
+
+    """
+    from .atom_index import load_atom_index
+
+    index = load_atom_index(coords, chainid, numbering, top=top, structure_id=structure_id, cache=index_cache)
+    for dihedrals, distances in _iter_features(coords, index['dih'], index['dis'], top, chunk, stride):
+        yield dihedrals, distances
+
+
+def iter_entry_protein_features(coords, chains, top=None, chunk=1000, stride=None):
+    """
+    Compute the dihedrals and distances of several kinase chains of a structure, one chunk of frames at a time.
+
+    The topology is parsed and the atoms of all chains are resolved once, and the features of all chains
+    are computed together from a single read of the coordinates.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    chains : list of (str, list of int)
+        The chain index and the numbering of the 85 pocket residues of each kinase chain.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+    chunk : int, optional, default=1000
+        Number of frames per chunk.
+    stride : int, optional
+        Only featurize every stride-th frame.
+
+    Yields
+    ------
+    dihedrals : np.ndarray, shape (n_chains, n_frames, 8)
+        Dihedrals (in radians) of each chain for the frames of the chunk.
+    distances : np.ndarray, shape (n_chains, n_frames, 5)
+        Distances (in nm) of each chain for the frames of the chunk.
+
+    """
+    from .protein import resolve_entry_feature_atoms
+
+    dih, dis, dih_missing, dis_missing = resolve_entry_feature_atoms(load_topology(coords, top), chains)
+    n_chains = len(chains)
+    for dihedrals, distances in _iter_features(coords, dih.reshape(-1, 4), dis.reshape(-1, 2), top, chunk, stride):
+        yield (dihedrals.reshape(len(dihedrals), n_chains, -1).transpose(1, 0, 2),
+               distances.reshape(len(distances), n_chains, -1).transpose(1, 0, 2))
+
+
+def _iter_features(coords, dih, dis, top, chunk, stride):
+    """Compute dihedrals and distances of resolved atoms, reading only these atoms, one chunk of frames at a time."""
+    import mdtraj as md
+    import numpy as np
+    from kinomodel.instrumentation import stage
+
+    # only read the atoms involved in the features
+    atoms = np.unique(np.concatenate([dih.ravel(), dis.ravel()]))
+    dih, dis = np.searchsorted(atoms, dih), np.searchsorted(atoms, dis)
+    for frames in iterload(coords, top=top, chunk=chunk, stride=stride, atom_indices=atoms, coordinates_only=True):
+        with stage('features.compute', frames=frames.n_frames):
+            dihedrals, distances = md.compute_dihedrals(frames, dih), md.compute_distances(frames, dis)
+        yield dihedrals, distances
+
+
+def iter_interaction_features(coords, chainid, ligand_name, resids, top=None, chunk=1000, stride=None,
+                              statistics=('mean',), contact_cutoff=0.4, structure_id=None, index_cache=None):
+    """
+    Compute distances between ligand heavy atoms and the pocket CAs, one chunk of frames at a time.
+
+    Parameters
+    ----------
+    coords : mdtraj.Trajectory or str
+        An in-memory trajectory or the path to a structure or trajectory file.
+    chainid : str
+        The chain index of the query kinase.
+    ligand_name : str
+        Specifies the ligand name of the complex.
+    resids : list of int
+        Protein residue indices to use in computing simple interaction features.
+    top : str or mdtraj.Topology, optional
+        The topology of a trajectory file without topology information.
+    chunk : int, optional, default=1000
+        Number of frames per chunk.
+    stride : int, optional
+        Only featurize every stride-th frame.
+    statistics : list of str, optional, default=('mean',)
+        The statistics to compute ('mean', 'min', 'per_residue' and/or 'contacts'),
+        see interactions.pocket_distance_kernel.
+    contact_cutoff : float, optional, default=0.4
+        Distance (in nm) below which a ligand-pocket pair counts as a contact.
+    structure_id : int, optional
+        The KLIFS structure_ID the numbering comes from, used to key the persisted atom indices.
+    index_cache : kinomodel.features.atom_index.AtomIndexCache or False, optional
+        The cache of atom indices resolved from topology files. Defaults to the shared cache;
+        False disables caching.
+
+    Yields
+    ------
+    features : dict of str: np.ndarray
+        The requested statistics (distances in nm) for the frames of the chunk.
+
+    """
+    from .atom_index import load_atom_index
+
+    index = load_atom_index(coords, chainid, resids, top=top, structure_id=structure_id, cache=index_cache,
+                            ligand_name=ligand_name)
+    for features in _iter_interactions(coords, index['ligand_atoms'], index['pocket_atoms'], index['pocket_missing'],
+                                       top, chunk, stride, statistics, contact_cutoff):
+        yield features
+
+
+def _iter_interactions(coords, ligand_atoms, pocket_atoms, pocket_missing, top, chunk, stride, statistics,
+                       contact_cutoff):
+    """Compute ligand-pocket distance statistics of resolved atoms, reading only these atoms, one chunk at a time."""
+    import numpy as np
+    from kinomodel.instrumentation import stage
+    from .interactions import periodic_box, pocket_distance_kernel
+
+    # only read the atoms involved in the features
+    atoms = np.unique(np.concatenate([ligand_atoms, pocket_atoms]))
+    ligand_atoms, pocket_atoms = np.searchsorted(atoms, ligand_atoms), np.searchsorted(atoms, pocket_atoms)
+    for frames in iterload(coords, top=top, chunk=chunk, stride=stride, atom_indices=atoms, coordinates_only=True):
+        # minimum image convention, as in mdtraj.compute_distances
+        unitcell_lengths, unitcell_vectors = periodic_box(frames)
+        with stage('interactions.compute', frames=frames.n_frames):
+            features = pocket_distance_kernel(frames.xyz, ligand_atoms, pocket_atoms, pocket_missing,
+                                              unitcell_lengths, statistics=statistics, contact_cutoff=contact_cutoff,
+                                              unitcell_vectors=unitcell_vectors)
+        yield features
@@ -0,0 +1,422 @@
+"""
+update.py
+Incremental updates of a kinome-wide feature database.
+
+A feature database is a feature store (see store.FeatureStore) together with a catalog of the KLIFS
+structures it holds. An update requests the current list of KLIFS structures, compares it with the
+catalog, and only featurizes structures that were added, or whose KLIFS record changed, since the last
+update (or whose featurization failed, or that lack some of the requested features). Structures no
+longer in KLIFS are marked as removed. Features of changed and removed structures stay in the store
+files, but readers only see the current version of each structure.
+
+"""
+
+import json
+import os
+
+# fields of a KLIFS structure record that the features depend on; a structure is featurized again
+# when any of them changes
+FINGERPRINT_FIELDS = ['pdb', 'chain', 'alt', 'kinase_ID', 'pocket', 'ligand', 'allosteric_ligand']
+
+# the kinds of features computed for each choice of features
+FEATURE_SETS = {'conf': {'conf'}, 'interact': {'interact'}, 'both': {'conf', 'interact'}}
+
+
+def record_fingerprint(record):
+    """
+    Return the fingerprint of a KLIFS structure record.
+
+    Parameters
+    ----------
+    record : dict
+        A record returned by the KLIFS structures_list API.
+
+    Returns
+    -------
+    fingerprint : str
+        A SHA-256 hex digest of the fields listed in FINGERPRINT_FIELDS.
+
+    """
+    import hashlib
+
+    fields = [record.get(field) for field in FINGERPRINT_FIELDS]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def featurize_structures(pdb, structures, feature='both'):
+    """
+    Featurize several KLIFS structures of a PDB entry from a single parse, capturing any error.
+
+    Parameters
+    ----------
+    pdb : str
+        The PDB code of the entry.
+    structures : list of dict
+        The structures, with keys 'structure_id', 'chain', 'ligand' (None for apo structures) and
+        'numbering' (the residue numbers of the 85 pocket residues, 0 for gaps).
+    feature : str, optional, default='both'
+        The features to compute: 'conf', 'interact' or 'both'.
+
+    Returns
+    -------
+    results : list of dict
+        One result per structure, with 'structure_id', 'status' ('ok' or 'failed') and, for successful
+        structures, 'dihedrals', 'distances' and/or 'mean_dist', or 'error' for failed structures.
+
+    """
+    import numpy as np
+    from . import protein as pf
+    from . import interactions as inf
+
+    results = [{'structure_id': structure['structure_id']} for structure in structures]
+    try:
+        from kinomodel.structures import fetch_structure
+        coordfile = fetch_structure(pdb)
+        if feature in ('conf', 'both'):
+            dihedrals, distances = pf.compute_entry_protein_features(
+                pdb, [(structure['chain'], structure['numbering']) for structure in structures], coordfile)
+            for result, chain_dihedrals, chain_distances in zip(results, dihedrals, distances):
+                result.update(dihedrals=chain_dihedrals.tolist(), distances=chain_distances.tolist())
+        if feature in ('interact', 'both'):
+            mean_dist = inf.compute_entry_interaction_features(
+                pdb, [(structure['chain'], structure['ligand'], structure['numbering']) for structure in structures],
+                coordfile)
+            for result, structure, chain_mean_dist in zip(results, structures, mean_dist):
+                if structure['ligand'] is not None:
+                    result['mean_dist'] = np.asarray(chain_mean_dist).tolist()
+        for result in results:
+            result['status'] = 'ok'
+    except Exception as error:
+        for result in results:
+            result.update(status='failed', error='{}: {}'.format(type(error).__name__, error))
+
+    return results
+
+
+def _covers(stored, feature):
+    """Whether structures featurized with the stored choice of features have the requested ones."""
+    return FEATURE_SETS[feature] <= FEATURE_SETS.get(stored, set())
+
+
+def _feature_union(*features):
+    """The choice of features computing all of the given ones, None being ignored."""
+    names = set().union(*(FEATURE_SETS[feature] for feature in features if feature is not None))
+    return 'both' if len(names) > 1 else names.pop()
+
+
+def _ligand(record):
+    """The ligand name of a KLIFS structure record, or None for apo structures (KLIFS uses 0)."""
+    return str(record['ligand']) if record.get('ligand') not in (None, 0, '0', '') else None
+
+
+def _initialize_worker(structure_cache):
+    """Use the structure cache of the parent process as the default cache of a worker process."""
+    from kinomodel.structures import set_structure_cache
+
+    set_structure_cache(structure_cache)
+
+
+class FeatureDatabase(object):
+
+    def __init__(self, path):
+        """A feature store with a catalog of the KLIFS structures it holds, updated incrementally.
+
+        Parameters
+        ----------
+        path: str
+            The directory of the database; it is created if needed. The catalog is kept in
+            catalog.sqlite, next to the Parquet files of the store.
+
+        """
+        import sqlite3
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        with sqlite3.connect(os.path.join(path, 'catalog.sqlite')) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS structures (structure_id INTEGER PRIMARY KEY, pdb TEXT, '
+                       'chain TEXT, fingerprint TEXT, status TEXT, part TEXT, updated REAL, error TEXT, '
+                       'kinase_id INTEGER, feature TEXT)')
+            # catalogs written before the kinase and the choice of features were recorded
+            columns = [row[1] for row in db.execute('PRAGMA table_info(structures)')]
+            for column, column_type in [('kinase_id', 'INTEGER'), ('feature', 'TEXT')]:
+                if column not in columns:
+                    db.execute('ALTER TABLE structures ADD COLUMN {} {}'.format(column, column_type))
+
+    def catalog(self):
+        """Return the catalog of the database.
+
+        Returns
+        -------
+        catalog: dict of int: dict
+            For every structure_ID ever featurized: 'pdb', 'chain', 'fingerprint', 'status' ('ok', 'failed'
+            or 'removed'), 'part' (the store file holding its current features), 'updated' (a time stamp),
+            'error', 'kinase_id' (the KLIFS kinase_ID) and 'feature' (the features computed: 'conf', 'interact'
+            or 'both'; None for structures featurized before it was recorded).
+
+        """
+        import sqlite3
+
+        columns = ['structure_id', 'pdb', 'chain', 'fingerprint', 'status', 'part', 'updated', 'error', 'kinase_id',
+                   'feature']
+        with sqlite3.connect(os.path.join(self.path, 'catalog.sqlite')) as db:
+            rows = db.execute('SELECT {} FROM structures'.format(', '.join(columns))).fetchall()
+
+        return {row[0]: dict(zip(columns[1:], row[1:])) for row in rows}
+
+    def _write_catalog(self, entries):
+        import sqlite3
+
+        with sqlite3.connect(os.path.join(self.path, 'catalog.sqlite')) as db:
+            db.executemany('INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', entries)
+
+    def diff(self, records, kinase_ids=None, feature=None):
+        """Compare a list of KLIFS structure records with the catalog.
+
+        Parameters
+        ----------
+        records: list of dict
+            The current KLIFS structure records (see klifs_cache.KlifsCache.list_structures).
+        kinase_ids: list of int, optional
+            The KLIFS kinase_IDs the records are limited to. Only catalog entries of these kinases can then be
+            'removed'.
+        feature: str, optional
+            The features requested: 'conf', 'interact' or 'both'. Structures featurized without some of them are
+            then 'incomplete'.
+
+        Returns
+        -------
+        diff: dict of str: list of int
+            The structure_IDs 'added' to KLIFS (or added back), 'changed' since they were featurized,
+            whose featurization 'failed' before, 'incomplete', 'removed' from KLIFS and 'unchanged'.
+
+        """
+        catalog = self.catalog()
+        current = {int(record['structure_ID']): record_fingerprint(record) for record in records}
+        diff = {'added': [], 'changed': [], 'failed': [], 'incomplete': [], 'removed': [], 'unchanged': []}
+        for structure_id, fingerprint in sorted(current.items()):
+            entry = catalog.get(structure_id)
+            if entry is None or entry['status'] == 'removed':
+                diff['added'].append(structure_id)
+            elif entry['fingerprint'] != fingerprint:
+                diff['changed'].append(structure_id)
+            elif entry['status'] == 'failed':
+                diff['failed'].append(structure_id)
+            elif feature is not None and not _covers(entry['feature'], feature):
+                diff['incomplete'].append(structure_id)
+            else:
+                diff['unchanged'].append(structure_id)
+        kinase_ids = None if kinase_ids is None else set(int(kinase_id) for kinase_id in kinase_ids)
+        diff['removed'] = sorted(structure_id for structure_id, entry in catalog.items()
+                                 if structure_id not in current and entry['status'] != 'removed'
+                                 and (kinase_ids is None or entry['kinase_id'] in kinase_ids))
+
+        return diff
+
+    def update(self, records=None, feature='both', kinase_ids=None, n_workers=None, n_threads=8, cache=None):
+        """Featurize the structures added or changed in KLIFS since the last update, and mark removed ones.
+
+        Parameters
+        ----------
+        records: list of dict, optional
+            The current KLIFS structure records. By default they are requested from KLIFS.
+        feature: str, optional, default='both'
+            The features to compute: 'conf', 'interact' or 'both'. Structures featurized before without some of
+            them are featurized again, keeping the features they had.
+        kinase_ids: list of int, optional
+            Only request the structures of these KLIFS kinase_IDs. All kinases by default.
+            Structures of other kinases in the catalog are then left as they are.
+        n_workers: int, optional
+            The number of worker processes. Defaults to the number of CPUs.
+        n_threads: int, optional, default=8
+            The number of concurrent requests for pocket numberings and PDB files.
+        cache: kinomodel.features.klifs_cache.KlifsCache, optional
+            The cache of KLIFS metadata to use. Defaults to the shared persistent cache.
+
+        Returns
+        -------
+        summary: dict of str: int
+            The number of structures 'added', 'changed', 'incomplete', 'removed' and 'unchanged', of structures
+            whose failed featurization was 'retried', and of structures that 'failed' in this update.
+
+        """
+        import logging
+        import time
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+        from .klifs_cache import get_klifs_cache
+        from .store import FeatureStore
+        from kinomodel.structures import get_structure_cache, fetch_structure
+
+        if feature not in ('conf', 'interact', 'both'):
+            raise ValueError("Unknown feature '{}'".format(feature))
+        if cache is None:
+            cache = get_klifs_cache()
+        if records is None:
+            records = cache.list_structures(kinase_ids)
+        records = {int(record['structure_ID']): record for record in records}
+        diff = self.diff(records.values(), kinase_ids, feature)
+        summary = {name: len(diff[name]) for name in ('added', 'changed', 'incomplete', 'removed', 'unchanged')}
+        summary.update(retried=len(diff['failed']), failed=0)
+
+        now = time.time()
+        catalog = self.catalog()
+        self._write_catalog([(structure_id, catalog[structure_id]['pdb'], catalog[structure_id]['chain'],
+                              catalog[structure_id]['fingerprint'], 'removed', None, now, None,
+                              catalog[structure_id]['kinase_id'], catalog[structure_id]['feature'])
+                             for structure_id in diff['removed']])
+
+        pending = [records[structure_id]
+                   for structure_id in diff['added'] + diff['changed'] + diff['failed'] + diff['incomplete']]
+        if not pending:
+            return summary
+        # the features of a structure are replaced as a whole, so those computed before are computed again
+        features = {}
+        for record in pending:
+            entry = catalog.get(int(record['structure_ID']))
+            stored = entry['feature'] if entry is not None and entry['status'] != 'removed' else None
+            features[int(record['structure_ID'])] = _feature_union(stored, feature)
+
+        # retrieve the pocket numberings and PDB files concurrently before featurization starts
+        def fetch(record):
+            try:
+                numbering = [resid if resid > 0 else 0 for resid in cache.numbering(record['structure_ID'])]
+                fetch_structure(str(record['pdb']).upper())
+                return numbering
+            except Exception as error:
+                logging.warning('Retrieving structure {} failed: {}'.format(record['structure_ID'], error))
+                return None
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            numberings = list(executor.map(fetch, pending))
+
+        # structures of the same entry are featurized together, from a single parse of the PDB file
+        entries = {}
+        failed = []
+        for record, numbering in zip(pending, numberings):
+            structure = {'structure_id': int(record['structure_ID']), 'chain': str(record['chain']),
+                         'ligand': _ligand(record),
+                         'numbering': numbering}
+            if numbering is None:
+                failed.append((structure, 'Could not retrieve the KLIFS numbering or the PDB file'))
+            else:
+                key = (str(record['pdb']).upper(), features[structure['structure_id']])
+                entries.setdefault(key, []).append(structure)
+
+        results = []
+        feature_store = FeatureStore(self.path)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_initialize_worker,
+                                     initargs=(get_structure_cache(),)) as executor:
+                futures = {executor.submit(featurize_structures, pdb, structures, entry_feature): structures
+                           for (pdb, entry_feature), structures in entries.items()}
+                for future in as_completed(futures):
+                    try:
+                        entry_results = future.result()
+                    except Exception as error:
+                        # the worker process itself died
+                        entry_results = [{'structure_id': structure['structure_id'], 'status': 'failed',
+                                          'error': '{}: {}'.format(type(error).__name__, error)}
+                                         for structure in futures[future]]
+                    for result in entry_results:
+                        record = records[result['structure_id']]
+                        if result['status'] == 'ok':
+                            feature_store.append(str(record['pdb']).upper(), str(record['chain']),
+                                                 dihedrals=result.get('dihedrals'), distances=result.get('distances'),
+                                                 mean_dist=result.get('mean_dist'),
+                                                 kinase_id=int(record['kinase_ID']), kinase=str(record['kinase']),
+                                                 structure_id=result['structure_id'],
+                                                 ligand=_ligand(record))
+                        results.append(result)
+        finally:
+            # features become visible, and the catalog points to them, once the store file is complete
+            part = feature_store.part
+            feature_store.close()
+            now = time.time()
+            results += [{'structure_id': structure['structure_id'], 'status': 'failed', 'error': error}
+                        for structure, error in failed]
+            entries = []
+            for result in results:
+                record = records[result['structure_id']]
+                if result['status'] != 'ok':
+                    summary['failed'] += 1
+                    logging.warning('Featurization of structure {} failed: {}'.format(result['structure_id'],
+                                                                                     result['error']))
+                entries.append((result['structure_id'], str(record['pdb']).upper(), str(record['chain']),
+                                record_fingerprint(record), result['status'],
+                                part if result['status'] == 'ok' else None, now, result.get('error'),
+                                int(record['kinase_ID']), features[result['structure_id']]))
+            self._write_catalog(entries)
+
+        return summary
+
+    def read(self, columns=None, filters=None):
+        """Read the current features of every structure in the database.
+
+        Parameters
+        ----------
+        columns: list of str, optional
+            The columns to read (see store.METADATA_COLUMNS and store.feature_columns()). All columns by default.
+        filters: list of tuple, optional
+            Row filters, e.g. [('kinase', '=', 'ABL1')].
+
+        Returns
+        -------
+        features: pandas.DataFrame
+            One row per (structure, frame) for structures currently in KLIFS, sorted by structure_ID and frame.
+
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from .store import feature_schema
+
+        parts = {}
+        for structure_id, entry in self.catalog().items():
+            if entry['status'] == 'ok':
+                parts.setdefault(entry['part'], []).append(structure_id)
+
+        schema = feature_schema()
+        tables = []
+        for part, structure_ids in sorted(parts.items()):
+            # only the rows of the structures whose current features are in this file
+            part_filters = [('structure_id', 'in', structure_ids)] + list(filters or [])
+            read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ['structure_id', 'frame']))
+            tables.append(pq.read_table(os.path.join(self.path, part), columns=read_columns, filters=part_filters,
+                                        memory_map=True, schema=schema))
+        if not tables:
+            return schema.empty_table().select(columns or schema.names).to_pandas()
+
+        table = pa.concat_tables(tables).sort_by([('structure_id', 'ascending'), ('frame', 'ascending')])
+        return table.select(columns or schema.names).to_pandas()
+
+
+def main():
+    """Command-line entry point of the incremental feature database update."""
+    import argparse
+    from kinomodel.instrumentation import instrument_run
+    from kinomodel.utils import configure_logging
+    from .klifs_cache import get_klifs_cache
+
+    parser = argparse.ArgumentParser(prog='kinomodel-update',
+                                     description='Featurize the KLIFS structures added or changed since the last '
+                                                 'update')
+    parser.add_argument('database', help='the feature database directory')
+    parser.add_argument('--feature', default='both', choices=['conf', 'interact', 'both'],
+                        help='compute collective variables related to protein conformation, '
+                             'protein-ligand interaction, or both')
+    parser.add_argument('--kinase-ids', type=int, nargs='+', default=None,
+                        help='only update the structures of these KLIFS kinase_IDs')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be updated')
+    args = parser.parse_args()
+    configure_logging()
+
+    database = FeatureDatabase(args.database)
+    if args.dry_run:
+        diff = database.diff(get_klifs_cache().list_structures(args.kinase_ids), args.kinase_ids, args.feature)
+        print(', '.join('{} {}'.format(len(diff[name]), name) for name in diff))
+        return
+
+    with instrument_run('kinomodel-update'):
+        summary = database.update(feature=args.feature, kinase_ids=args.kinase_ids, n_workers=args.workers)
+    print('{added} added, {changed} changed, {incomplete} incomplete, {removed} removed, {unchanged} unchanged, '
+          '{retried} retried, {failed} failed'.format(
+        **summary))
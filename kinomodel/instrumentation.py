@@ -0,0 +1,308 @@
+"""
+instrumentation.py
+Opt-in timing and profiling of the stages of kinomodel runs.
+
+Expensive steps are wrapped in named stages: network.fetch, klifs.parse, topology.parse, index.resolve,
+features.compute, interactions.compute, omega, charges, docking and file.write. Stages are only recorded
+while a Recorder is active; otherwise entering a stage costs a global lookup. A recorded stage gives its
+wall time, the number of bytes it transferred and its attributes (e.g. the URL of a fetch). Stages may
+nest, in which case the time of the inner stage is also part of the time of the outer one.
+
+    from kinomodel.instrumentation import recording
+    with recording('stages.jsonl') as recorder:
+        featurize(pdb='3PP0', chain='A', feature='conf', coord='pdb')
+    recorder.summary()
+
+Command-line tools are instrumented without changing code through environment variables:
+
+    KINOMODEL_INSTRUMENT=stages.jsonl       append every stage of the run to stages.jsonl (JSON lines)
+    KINOMODEL_PROFILE=cprofile,tracemalloc  also profile the run with cProfile and/or tracemalloc
+    KINOMODEL_PROFILE_DIR=profiles          where profiles are written (the working directory by default)
+
+"""
+
+import contextlib
+import os
+import time
+
+STAGES = ['network.fetch', 'klifs.parse', 'topology.parse', 'index.resolve', 'features.compute',
+          'interactions.compute', 'omega', 'charges', 'docking', 'file.write']
+
+_recorder = None
+
+
+class _Stage(object):
+    """A stage being recorded; code inside the stage can add the bytes it transferred."""
+
+    def __init__(self, nbytes=0):
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        self.nbytes += int(nbytes)
+
+
+class _NullStage(object):
+    """A stage that is not recorded."""
+
+    def add_bytes(self, nbytes):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Recorder(object):
+
+    def __init__(self, path=None):
+        """The stages recorded during a run.
+
+        Parameters
+        ----------
+        path: str, optional
+            A JSON-lines file every stage is appended to as soon as it ends. Processes forked from this one
+            (e.g. batch featurization workers) append to the same file.
+
+        """
+        import threading
+
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, wall, nbytes=0, **attributes):
+        """Record a stage.
+
+        Parameters
+        ----------
+        name: str
+            The name of the stage (see STAGES).
+        start: float
+            The time the stage started (in s since the epoch).
+        wall: float
+            The wall time of the stage (in s).
+        nbytes: int, optional, default=0
+            The number of bytes transferred.
+        attributes: optional
+            JSON-serializable details of the stage.
+
+        """
+        import json
+
+        event = dict(attributes, stage=name, start=start, wall=wall, bytes=nbytes, pid=os.getpid())
+        with self._lock:
+            self.events.append(event)
+            if self.path is not None:
+                # one write per line, so lines of several processes are not interleaved
+                with open(self.path, 'a') as outfile:
+                    outfile.write(json.dumps(event, default=str) + '\n')
+
+    def summary(self):
+        """Return the call count, total and maximum wall time and bytes of every stage, see summarize."""
+        return summarize(self.events)
+
+    def export(self, path):
+        """Append the recorded stages to a JSON-lines file.
+
+        Parameters
+        ----------
+        path: str
+            The file, with one JSON record per stage.
+
+        """
+        import json
+
+        with open(path, 'a') as outfile:
+            for event in self.events:
+                outfile.write(json.dumps(event, default=str) + '\n')
+
+
+def summarize(events):
+    """
+    Aggregate recorded stages.
+
+    Parameters
+    ----------
+    events : iterable of dict
+        Stages, as recorded by a Recorder or read by read_events.
+
+    Returns
+    -------
+    summary : dict of str: dict
+        For every stage: 'count', 'wall' (total, in s), 'max_wall' (in s) and 'bytes'.
+
+    """
+    summary = {}
+    for event in events:
+        stats = summary.setdefault(event['stage'], {'count': 0, 'wall': 0.0, 'max_wall': 0.0, 'bytes': 0})
+        stats['count'] += 1
+        stats['wall'] += event['wall']
+        stats['max_wall'] = max(stats['max_wall'], event['wall'])
+        stats['bytes'] += event.get('bytes', 0)
+
+    return summary
+
+
+def read_events(path):
+    """Return the stages of a JSON-lines file written by a Recorder."""
+    import json
+
+    with open(path) as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def get_recorder():
+    """Return the active Recorder, or None if stages are not recorded."""
+    return _recorder
+
+
+@contextlib.contextmanager
+def recording(path=None):
+    """
+    Record the stages run inside the context.
+
+    Parameters
+    ----------
+    path : str, optional
+        A JSON-lines file the stages are appended to as they end.
+
+    Yields
+    ------
+    recorder : Recorder
+        The recorder, whose summary() gives the statistics of every stage.
+
+    """
+    global _recorder
+    previous, _recorder = _recorder, Recorder(path)
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+
+@contextlib.contextmanager
+def stage(name, nbytes=0, **attributes):
+    """
+    Time a stage, if stages are being recorded.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage (see STAGES).
+    nbytes : int, optional, default=0
+        The number of bytes transferred, if known in advance.
+    attributes : optional
+        JSON-serializable details of the stage.
+
+    Yields
+    ------
+    stage
+        An object whose add_bytes(n) adds to the bytes transferred by the stage.
+
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield _NULL_STAGE
+        return
+
+    current = _Stage(nbytes)
+    start, begin = time.time(), time.perf_counter()
+    try:
+        yield current
+    finally:
+        recorder.add(name, start, time.perf_counter() - begin, current.nbytes, **attributes)
+
+
+def instrumented(name):
+    """Decorate a function so that its calls are recorded as a stage."""
+    import functools
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, function=function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def profiling(directory=None, cprofile=True, memory=False, name='kinomodel', top=50):
+    """
+    Profile the code run inside the context.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where the profiles are written. The working directory by default.
+    cprofile : bool, optional, default=True
+        Write cProfile statistics to {name}-{pid}.prof (readable with pstats or snakeviz).
+    memory : bool, optional, default=False
+        Trace allocations with tracemalloc and write the lines allocating most memory to
+        {name}-{pid}.memory.jsonl.
+    name : str, optional, default='kinomodel'
+        The prefix of the profile files.
+    top : int, optional, default=50
+        The number of allocation sites written.
+
+    """
+    import json
+
+    directory = directory or os.getcwd()
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, '{}-{}'.format(name, os.getpid()))
+    profiler = None
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    if cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(prefix + '.prof')
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(prefix + '.memory.jsonl', 'w') as outfile:
+                outfile.write(json.dumps({'peak_bytes': peak}) + '\n')
+                for statistic in snapshot.statistics('lineno')[:top]:
+                    frame = statistic.traceback[0]
+                    outfile.write(json.dumps({'file': frame.filename, 'line': frame.lineno, 'bytes': statistic.size,
+                                              'count': statistic.count}) + '\n')
+
+
+@contextlib.contextmanager
+def instrument_run(name='kinomodel'):
+    """
+    Record and/or profile a command-line run, as requested by environment variables.
+
+    KINOMODEL_INSTRUMENT gives the JSON-lines file stages are appended to; KINOMODEL_PROFILE lists the
+    profilers to run ('cprofile' and/or 'tracemalloc', comma-separated), writing to KINOMODEL_PROFILE_DIR.
+    Without these variables, nothing is recorded.
+
+    Parameters
+    ----------
+    name : str, optional, default='kinomodel'
+        The name of the run, used as the prefix of the profile files.
+
+    """
+    path = os.environ.get('KINOMODEL_INSTRUMENT')
+    profilers = [profiler.strip().lower() for profiler in os.environ.get('KINOMODEL_PROFILE', '').split(',')
+                 if profiler.strip()]
+    unknown = set(profilers) - {'cprofile', 'tracemalloc'}
+    if unknown:
+        raise ValueError('Unknown profilers in KINOMODEL_PROFILE: {}'.format(', '.join(sorted(unknown))))
+
+    with contextlib.ExitStack() as stack:
+        if path:
+            stack.enter_context(recording(path))
+        if profilers:
+            stack.enter_context(profiling(os.environ.get('KINOMODEL_PROFILE_DIR'), cprofile='cprofile' in profilers,
+                                          memory='tracemalloc' in profilers, name=name))
+        yield
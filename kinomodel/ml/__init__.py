@@ -1 +1,6 @@
-#
+"""
+ml
+Machine learning on featurized kinase structures and trajectories.
+"""
+
+from .streaming import encode_features, encoded_feature_names, iter_store_features, StreamingPCA, StreamingTICA
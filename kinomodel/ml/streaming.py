@@ -0,0 +1,364 @@
+"""
+streaming.py
+Out-of-core dimensionality reduction of kinase features.
+
+PCA and TICA only need the mean and the (time-lagged) covariance matrices of the features, which are
+accumulated chunk by chunk; the frames themselves are never held in memory together. Projections are
+computed chunk by chunk as well, so memory use does not depend on the total number of frames.
+
+Dihedrals are encoded by their sine and cosine, which are continuous where the angles wrap around.
+
+"""
+
+
+def encode_features(dihedrals=None, distances=None):
+    """
+    Encode dihedrals by their sine and cosine, followed by the distances.
+
+    Parameters
+    ----------
+    dihedrals : np.ndarray, shape (n_frames, n_dihedrals), optional
+        Dihedrals (in radians), e.g. as returned by compute_simple_protein_features.
+    distances : np.ndarray, shape (n_frames, n_distances), optional
+        Distances (in nm), e.g. as returned by compute_simple_protein_features.
+
+    Returns
+    -------
+    X : np.ndarray, shape (n_frames, 2 * n_dihedrals + n_distances)
+        sin of every dihedral, cos of every dihedral, then the distances.
+
+    """
+    import numpy as np
+
+    blocks = []
+    if dihedrals is not None:
+        dihedrals = np.asarray(dihedrals, dtype=np.float64)
+        blocks += [np.sin(dihedrals), np.cos(dihedrals)]
+    if distances is not None:
+        blocks.append(np.asarray(distances, dtype=np.float64))
+    if not blocks:
+        raise ValueError('No features to encode')
+
+    return np.concatenate(blocks, axis=1)
+
+
+def encoded_feature_names(dihedral_names, distance_names=()):
+    """Return the names of the columns of encode_features, e.g. sin(aC_rot), ..., cos(aC_rot), ..., K_E1."""
+    return (['sin({})'.format(name) for name in dihedral_names] + ['cos({})'.format(name) for name in dihedral_names]
+            + list(distance_names))
+
+
+def iter_store_features(path, dihedral_names=None, distance_names=None, batch_size=65536):
+    """
+    Iterate over the encoded features of a feature store, one chunk of a trajectory at a time.
+
+    Parameters
+    ----------
+    path : str
+        The directory of a feature store (see features.store.FeatureStore).
+    dihedral_names : list of str, optional
+        The dihedrals to use. All of features.protein.dih_names by default.
+    distance_names : list of str, optional
+        The distances to use. All of features.protein.dis_names by default.
+    batch_size : int, optional, default=65536
+        The maximum number of frames per chunk.
+
+    Yields
+    ------
+    start : bool
+        True if the chunk starts a new trajectory.
+    X : np.ndarray, shape (n_frames, n_features)
+        The encoded features of the chunk (see encode_features).
+
+    """
+    from kinomodel.features.protein import dih_names, dis_names
+    from kinomodel.features.store import iter_trajectories
+
+    dihedral_names = dih_names if dihedral_names is None else list(dihedral_names)
+    distance_names = dis_names if distance_names is None else list(distance_names)
+    for start, chunk in iter_trajectories(path, columns=dihedral_names + distance_names, batch_size=batch_size):
+        yield start, encode_features(chunk[dihedral_names].values if dihedral_names else None,
+                                     chunk[distance_names].values if distance_names else None)
+
+
+class _StreamingEstimator(object):
+
+    def __init__(self, n_components=None):
+        self.n_components = n_components
+        self.n_samples_ = 0
+        self.n_skipped_ = 0
+        self.mean_ = None
+        self.eigenvalues_ = None
+        self.components_ = None
+
+    def _valid(self, X):
+        """Return the rows of X without missing values, counting the rows skipped."""
+        import numpy as np
+
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2:
+            raise ValueError('Features must be a 2D array (n_frames, n_features)')
+        valid = np.isfinite(X).all(axis=1)
+        self.n_skipped_ += int((~valid).sum())
+        return X, valid
+
+    def _check_fitted(self):
+        if self.components_ is None:
+            raise ValueError('The estimator must be fitted (partial_fit and finalize) before projecting data')
+
+    def transform(self, X):
+        """Project features onto the components.
+
+        Parameters
+        ----------
+        X : np.ndarray, shape (n_frames, n_features)
+            Encoded features.
+
+        Returns
+        -------
+        Y : np.ndarray, shape (n_frames, n_components)
+            The projections; rows with missing features are NaN.
+
+        """
+        import numpy as np
+
+        self._check_fitted()
+        X = np.asarray(X, dtype=np.float64)
+        return (X - self.mean_).dot(self.components_)
+
+    def iter_transform(self, chunks):
+        """Project chunks of features onto the components, one chunk at a time.
+
+        Parameters
+        ----------
+        chunks : iterable of np.ndarray or of (bool, np.ndarray)
+            Encoded features, e.g. from iter_store_features.
+
+        Yields
+        ------
+        Y : np.ndarray, shape (n_frames, n_components)
+            The projections of each chunk.
+
+        """
+        for chunk in chunks:
+            yield self.transform(chunk[1] if isinstance(chunk, tuple) else chunk)
+
+
+class StreamingPCA(_StreamingEstimator):
+
+    def __init__(self, n_components=None):
+        """Principal component analysis estimated from chunks of frames.
+
+        Parameters
+        ----------
+        n_components : int, optional
+            The number of components kept. All components by default.
+
+        """
+        super(StreamingPCA, self).__init__(n_components)
+        self._shift = None
+        self._sum = None
+        self._sum2 = None
+
+    def partial_fit(self, X):
+        """Accumulate the statistics of a chunk of frames; rows with missing values are skipped.
+
+        Parameters
+        ----------
+        X : np.ndarray, shape (n_frames, n_features)
+            Encoded features.
+
+        Returns
+        -------
+        self : StreamingPCA
+
+        """
+        X, valid = self._valid(X)
+        X = X[valid]
+        if not len(X):
+            return self
+        if self._shift is None:
+            # statistics are accumulated around the first frames seen, for numerical stability
+            self._shift = X.mean(axis=0)
+            self._sum = self._shift * 0
+            self._sum2 = self._sum[:, None] * self._sum[None, :]
+        X = X - self._shift
+        self._sum += X.sum(axis=0)
+        self._sum2 += X.T.dot(X)
+        self.n_samples_ += len(X)
+        return self
+
+    def finalize(self):
+        """Compute the components from the statistics accumulated so far.
+
+        Returns
+        -------
+        self : StreamingPCA
+
+        """
+        import numpy as np
+
+        if self.n_samples_ < 2:
+            raise ValueError('At least two frames are needed to estimate components')
+        mean = self._sum / self.n_samples_
+        self.mean_ = self._shift + mean
+        self.covariance_ = (self._sum2 - self.n_samples_ * np.outer(mean, mean)) / (self.n_samples_ - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(self.covariance_)
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+        self.eigenvalues_ = eigenvalues[order]
+        self.components_ = eigenvectors[:, order]
+        return self
+
+    def fit(self, chunks):
+        """Estimate the components from chunks of frames.
+
+        Parameters
+        ----------
+        chunks : iterable of np.ndarray or of (bool, np.ndarray)
+            Encoded features, e.g. from iter_store_features.
+
+        Returns
+        -------
+        self : StreamingPCA
+
+        """
+        for chunk in chunks:
+            self.partial_fit(chunk[1] if isinstance(chunk, tuple) else chunk)
+        return self.finalize()
+
+
+class StreamingTICA(_StreamingEstimator):
+
+    def __init__(self, lag, n_components=None, epsilon=1e-6):
+        """Time-lagged independent component analysis estimated from chunks of trajectories.
+
+        The instantaneous and time-lagged covariance matrices are accumulated over all pairs of frames
+        (t, t + lag) of every trajectory, and symmetrized (reversible estimate).
+
+        Parameters
+        ----------
+        lag : int
+            The lag time, in frames.
+        n_components : int, optional
+            The number of components kept. All components by default.
+        epsilon : float, optional, default=1e-6
+            Directions of the features whose variance is below epsilon are discarded.
+
+        """
+        super(StreamingTICA, self).__init__(n_components)
+        if lag < 1:
+            raise ValueError('The lag time must be at least one frame')
+        self.lag = lag
+        self.epsilon = epsilon
+        self._tail = None
+        self._shift = None
+        self._sums = None
+
+    def partial_fit(self, X, start=True):
+        """Accumulate the statistics of a chunk of a trajectory.
+
+        Pairs of frames with missing values are skipped.
+
+        Parameters
+        ----------
+        X : np.ndarray, shape (n_frames, n_features)
+            Encoded features of consecutive frames.
+        start : bool, optional, default=True
+            If False, the chunk continues the trajectory of the previous chunk, and pairs of frames
+            across the two chunks are included.
+
+        Returns
+        -------
+        self : StreamingTICA
+
+        """
+        import numpy as np
+
+        X, _ = self._valid(X)
+        if not start and self._tail is not None:
+            X = np.concatenate([self._tail, X])
+        # the last lag frames pair with the first frames of the next chunk of the same trajectory
+        self._tail = X[-self.lag:]
+        if len(X) <= self.lag:
+            self._tail = X
+            return self
+
+        X0, Xt = X[:-self.lag], X[self.lag:]
+        valid = np.isfinite(X0).all(axis=1) & np.isfinite(Xt).all(axis=1)
+        X0, Xt = X0[valid], Xt[valid]
+        if not len(X0):
+            return self
+        if self._shift is None:
+            # statistics are accumulated around the first frames seen, for numerical stability
+            self._shift = X0.mean(axis=0)
+            n_features = len(self._shift)
+            self._sums = {'0': np.zeros(n_features), 't': np.zeros(n_features),
+                          '00': np.zeros((n_features, n_features)), 'tt': np.zeros((n_features, n_features)),
+                          '0t': np.zeros((n_features, n_features))}
+        X0, Xt = X0 - self._shift, Xt - self._shift
+        self._sums['0'] += X0.sum(axis=0)
+        self._sums['t'] += Xt.sum(axis=0)
+        self._sums['00'] += X0.T.dot(X0)
+        self._sums['tt'] += Xt.T.dot(Xt)
+        self._sums['0t'] += X0.T.dot(Xt)
+        self.n_samples_ += len(X0)
+        return self
+
+    def finalize(self):
+        """Compute the components from the statistics accumulated so far.
+
+        Returns
+        -------
+        self : StreamingTICA
+
+        """
+        import numpy as np
+
+        if self.n_samples_ < 2:
+            raise ValueError('At least two pairs of frames are needed to estimate components')
+        n = self.n_samples_
+        sums = self._sums
+        # reversible estimate: frames at t and t + lag are pooled
+        mean = (sums['0'] + sums['t']) / (2 * n)
+        self.mean_ = self._shift + mean
+        self.covariance_ = ((sums['00'] + sums['tt']) / 2 - n * np.outer(mean, mean)) / (n - 1)
+        lagged = ((sums['0t'] + sums['0t'].T) / 2 - n * np.outer(mean, mean)) / (n - 1)
+        self.lagged_covariance_ = lagged
+
+        # solve lagged v = lambda covariance v in the whitened space of the covariance
+        variances, directions = np.linalg.eigh(self.covariance_)
+        kept = variances > self.epsilon * max(variances.max(), 0)
+        whitening = directions[:, kept] / np.sqrt(variances[kept])
+        eigenvalues, eigenvectors = np.linalg.eigh(whitening.T.dot(lagged).dot(whitening))
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+        self.eigenvalues_ = eigenvalues[order]
+        self.components_ = whitening.dot(eigenvectors[:, order])
+        return self
+
+    @property
+    def timescales_(self):
+        """The implied timescales of the components, in frames."""
+        import numpy as np
+
+        self._check_fitted()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return -self.lag / np.log(np.abs(self.eigenvalues_))
+
+    def fit(self, chunks):
+        """Estimate the components from chunks of trajectories.
+
+        Parameters
+        ----------
+        chunks : iterable of (bool, np.ndarray)
+            (start, X) pairs, where start is True for the first chunk of every trajectory,
+            e.g. from iter_store_features. Plain arrays are taken as separate trajectories.
+
+        Returns
+        -------
+        self : StreamingTICA
+
+        """
+        for chunk in chunks:
+            start, X = chunk if isinstance(chunk, tuple) else (True, chunk)
+            self.partial_fit(X, start=start)
+        return self.finalize()
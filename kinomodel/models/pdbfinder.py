@@ -20,12 +20,9 @@ def get_pdb_biological_unit(pdb_id):
     Returns: a string with the full PDB file in it
 
     """
-    import urllib
+    from ..structures import get_structure_cache
 
-    fullurl = 'https://files.rcsb.org/download/' + pdb_id + '.pdb1'
-    req = urllib.request.Request(fullurl)
-    f = urllib.request.urlopen(req)
-    result = f.read()
+    result = get_structure_cache().read(pdb_id, 'pdb1')
     result = result.decode('unicode_escape')
     result = result.replace('XXXX', pdb_id)
 
@@ -43,8 +40,9 @@ def write_file(filename, contents):
     Returns: Nothing, just writes the file
 
     """
+    from ..instrumentation import stage
 
-    with open(filename, 'w') as outfile:
+    with stage('file.write', len(contents), path=filename), open(filename, 'w') as outfile:
         outfile.write(contents)
 
 
@@ -147,24 +145,10 @@ def search(scan_params):
     Returns: list of pdbs that should be cleaned up using clean_pdb function
 
     """
-    import urllib
-    import xmltodict
-
-    url = 'http://www.rcsb.org/pdb/rest/search'
-
-    queryText = xmltodict.unparse(scan_params, pretty=False)
-    queryText = queryText.encode()
-
-    req = urllib.request.Request(url, data=queryText)
-    f = urllib.request.urlopen(req)
-    result = f.read()
+    from .rcsb import RcsbClient
 
-    if not result:
-        warnings.warn('No results were obtained for this search')
-
-    idlist = str(result)
-
-    return idlist
+    # requests are retried with backoff on connection and server errors
+    return RcsbClient().search(scan_params)
 
 
 def clean_pdb(list_pdb_ids, querymode=None):
@@ -192,7 +176,7 @@ def clean_pdb(list_pdb_ids, querymode=None):
     return list_pdb_ids
 
 
-def pdb_fix_pdbfixer(pdbid, file_pathway, ph, chains_to_remove):
+def pdb_fix_pdbfixer(pdbid, file_pathway, ph, chains_to_remove, keep_ids=True):
     """
 
     Args:
@@ -200,18 +184,30 @@ def pdb_fix_pdbfixer(pdbid, file_pathway, ph, chains_to_remove):
         file_pathway: a string containing the pathway specifying how you want to organize the PDB files once written
         ph: the pH at which hydrogens will be determined and added
         chains_to_remove: dictionary containing pdbs with chains to remove
+        keep_ids: if True, keep the residue numbering of the PDB file
     Returns: nothing, but it does right PDB files
 
+    ***Note: use kinomodel.models.prepare.PreparationScheduler to prepare many structures in parallel
+
     """
+    import gzip
+    from ..structures import fetch_structure
+
     print(pdbid)
 
-    # Download the topology from rcsb based on pdbod
+    # Read the topology from the local structure cache, downloading it from rcsb on a miss
     from pdbfixer import PDBFixer
-    fixer = PDBFixer(pdbid=pdbid)
+    path = fetch_structure(pdbid)
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rt') as pdbfile:
+        # entries too large for the PDB format are only available as mmCIF
+        if path.endswith(('.cif', '.cif.gz')):
+            fixer = PDBFixer(pdbxfile=pdbfile)
+        else:
+            fixer = PDBFixer(pdbfile=pdbfile)
 
     # Remove chains based on hand curated .csv file
     if pdbid in chains_to_remove['pdbid']:
-        chains = chains_to_remove['chain_to_remove'][chain_to_remove['pdbid'].index(pdbid)]
+        chains = chains_to_remove['chain_to_remove'][chains_to_remove['pdbid'].index(pdbid)]
         chains_list = chains.split()
         fixer.removeChains(chainIds=chains_list)
 
@@ -240,20 +236,17 @@ def pdb_fix_pdbfixer(pdbid, file_pathway, ph, chains_to_remove):
     fixer.addMissingHydrogens(ph)
     # Write fixed PDB file, with all of the waters and ligands
     from simtk.openmm.app import PDBFile
-    PDBFile.writeFile(fixer.topology, fixer.positions, open(os.path.join(file_pathway,
-                                                                         '%s_fixed_ph%s.pdb' % (pdbid, ph)), 'w'),
-                      keepIds=keepNumbers)
+    with open(os.path.join(file_pathway, '%s_fixed_ph%s.pdb' % (pdbid, ph)), 'w') as outfile:
+        PDBFile.writeFile(fixer.topology, fixer.positions, outfile, keepIds=keep_ids)
 
     # Remove the ligand and write a pdb file
     fixer.removeHeterogens(True)
-    PDBFile.writeFile(fixer.topology, fixer.positions, open(os.path.join(file_pathway,
-                                                                         '%s_fixed_ph%s_apo.pdb' % (pdbid, ph)), 'w'),
-                      keepIds=keepNumbers)
+    with open(os.path.join(file_pathway, '%s_fixed_ph%s_apo.pdb' % (pdbid, ph)), 'w') as outfile:
+        PDBFile.writeFile(fixer.topology, fixer.positions, outfile, keepIds=keep_ids)
     # Remove the waters and write a pdb file
     fixer.removeHeterogens(False)
-    PDBFile.writeFile(fixer.topology, fixer.positions, open(os.path.join(file_pathway,
-                                                                         '%s_fixed_ph%s_apo_nowater.pdb' % (pdbid, ph)),
-                                                            'w'), keepIds=keepNumbers)
+    with open(os.path.join(file_pathway, '%s_fixed_ph%s_apo_nowater.pdb' % (pdbid, ph)), 'w') as outfile:
+        PDBFile.writeFile(fixer.topology, fixer.positions, outfile, keepIds=keep_ids)
 
 
 def pdb_fix_schrodinger(pdbid, file_pathway, ph):
@@ -265,16 +258,18 @@ def pdb_fix_schrodinger(pdbid, file_pathway, ph):
     protprep.protein_prep(input_file, output_file_pathway, pdbid, pH=ph)
 
 
-def download_pdb(pdbid, file_pathway):
+def download_pdb(pdbid, file_pathway, bunit=False):
     """
 
     Args:
         pdbid: 4 letter string specifying the PDB ID of the file yoou want to fix
         file_pathway: a string containing the pathway specifying how you want to organize the PDB files once written
+        bunit: if True, retrieve the biological unit instead of the asymmetric unit
 
     Returns: nothing, but it does write the PDB file
 
     ***Note: this function does NOT fix any mistakes with the PDB file
+    ***Note: files are retrieved through the local structure cache, so each PDB is downloaded only once
 
     """
 
@@ -285,54 +280,93 @@ def download_pdb(pdbid, file_pathway):
         pdb = get_pdb_biological_unit(pdbid)
 
     else:
-        import pypdb
-        pdb = pypdb.get_pdb_file(pdbid)
+        from ..structures import get_structure_cache
+        pdb = get_structure_cache().read(pdbid, 'pdb').decode()
 
     write_file(os.path.join(file_pathway, '%s.pdb' % pdbid), pdb)
 
 
-def ligand_search_mode(inhibitor_list, ligname, pH, fixpdb, query_mode=None):
-    pdb_list = []
+def ligand_search_mode(inhibitor_list, ligname, pH, fixpdb, query_mode=None, client=None, progress=None,
+                       bunit=False, scheduler=None, n_threads=8):
+    """Download all PDBs containing any of the Chem_IDs of a ligand
+
+    Args:
+        inhibitor_list: list of Chem_IDs of the ligand
+        ligname: name of the ligand, used for the directory the PDB files are written to
+        pH: the pH used to fix the PDB files
+        fixpdb: if True, fix the PDB files with Schrodinger's Protein Prep
+        query_mode: type of search being performed
+        client: the RcsbClient used for searches and downloads (see run_search_pipeline)
+        progress: the SearchProgress of the run, to resume an interrupted run
+        bunit: if True, retrieve the biological units
+        scheduler: the PreparationScheduler the fixing jobs are queued on (default: PrepWizard runs in parallel
+            threads, recorded in pdbs/preparation-manifest.jsonl)
+        n_threads: number of simultaneous searches and downloads (see run_search_pipeline)
+
+    Returns: a dictionary mapping each directory to the list of PDB IDs found for it and written to it
+
+    """
+    from .rcsb import run_search_pipeline
+
     pathway = 'pdbs/%s' % ligname
-    for id in inhibitor_list:
-        print('Searching for PDBS containing %s' % id)
-        query = gen_query(search_ligand=id, querymode=query_mode)
-        found_pdb = search(query)
-        found_pdb = clean_pdb(found_pdb)
-        if len(found_pdb) > 0:
-            print('found %s PDBS for %s' % (len(found_pdb), id))
-            for s in found_pdb:
-                download_pdb(s, pathway)
-                if fixpdb is True:
-                    pdb_fix_schrodinger(s, pathway, pH)
-
-
-def ligand_target_search_mode(inhibitor_list, dictionary, ligname, pH, fixpdb):
-    pdb_list = []
-    accessions = dictionary['Accession_ID'][dictionary['inhibitor'].index(ligand)]
+    searches = [(id, gen_query(search_ligand=id, querymode=query_mode), pathway) for id in inhibitor_list]
+
+    written = run_search_pipeline(searches, client=client, progress=progress, n_threads=n_threads, bunit=bunit)
+    if fixpdb is True:
+        _prepare(written, pH, scheduler)
+
+    return written
+
+
+def ligand_target_search_mode(inhibitor_list, dictionary, ligname, pH, fixpdb, client=None, progress=None,
+                              bunit=False, scheduler=None, n_threads=8):
+    """Download all PDBs containing a ligand and one of its approved targets
+
+    Args: as ligand_search_mode, and
+        dictionary: the table of approved inhibitors and targets, as returned by convert_csv_to_dict
+
+    Returns: a dictionary mapping each directory to the list of PDB IDs found for it and written to it
+
+    """
+    from .rcsb import run_search_pipeline
+
+    accessions = dictionary['Accession_ID'][dictionary['inhibitor'].index(ligname)]
     accessions_list = accessions.split()
-    targets = dictionary['approved_target'][dictionary['inhibitor'].index(ligand)]
+    targets = dictionary['approved_target'][dictionary['inhibitor'].index(ligname)]
     targets_list = targets.split()
 
-    print('The FDA approved targets for %s are:' % args.lig)
+    print('The FDA approved targets for %s are:' % ligname)
+    searches = []
     for i, ac_id in enumerate(accessions_list):  # loop through all of the ids in the human target list
         print('(%s)  %s: %s' % (i + 1, targets_list[i], ac_id))
         for id in inhibitor_list:  # Loop through all of the chem_ids for a given ligand
-            print('Searching for PDBs containing %s and %s' % (id, targets_list[i]))
             query = gen_query(search_ligand=id,
                               search_protein=ac_id)  # Generates and returns a dict() for queyring RCSB
-            found_pdb = search(query)  # Converts dict() to XML and query's PDB. Returns string with PDBIDs
-            found_pdb = clean_pdb(found_pdb)  # Cleans up extra characters and returns a list of PDBIDs
-            if len(found_pdb) > 0:
-                print('found %s PDB(s) for %s/%s' % (len(found_pdb), id, targets_list[i]))
-                for s in found_pdb:
-                    pathway = 'pdbs/%s-%s' % (ligname, targets_list[i])
-                    download_pdb(s, pathway)
-                    if fixpdb is True:
-                        pdb_fix_schrodinger(s, pathway, pH)
-
-
-def all_ligand_search_mode(dictionary, pH, fixpdb):
+            searches.append(('%s and %s' % (id, targets_list[i]), query,
+                             'pdbs/%s-%s' % (ligname, targets_list[i])))
+
+    written = run_search_pipeline(searches, client=client, progress=progress, n_threads=n_threads, bunit=bunit)
+    if fixpdb is True:
+        _prepare(written, pH, scheduler)
+
+    return written
+
+
+def all_ligand_search_mode(dictionary, pH, fixpdb, client=None, progress=None, bunit=False, scheduler=None,
+                           n_threads=8):
+    """Download all PDBs of every approved inhibitor with one of its approved targets
+
+    All searches of all ligands go through a single pipeline, so a PDB found for several ligands or
+    targets is downloaded only once.
+
+    Args: as ligand_target_search_mode
+
+    Returns: a dictionary mapping each directory to the list of PDB IDs found for it and written to it
+
+    """
+    from .rcsb import run_search_pipeline
+
+    searches = []
     for lig in dictionary['inhibitor']:
         # Make list of ChemIDs for ligand
         chem_id_list = make_chem_id_list(dictionary, lig)
@@ -348,38 +382,57 @@ def all_ligand_search_mode(dictionary, pH, fixpdb):
         for i, ac_id in enumerate(accessions_list):
             print('(%s)  %s: %s' % (i + 1, targets_list[i], ac_id))
             for chem_id in chem_id_list:
-                print('Searching for PDBs containing %s and %s' % (chem_id, targets_list[i]))
                 query = gen_query(search_ligand=chem_id, search_protein=ac_id)
-                found_pdb = search(query)
-                found_pdb = clean_pdb(found_pdb)
-                if len(found_pdb) > 0:
-                    print('found %s PDB(s) for %s/%s' % (len(found_pdb), chem_id, targets_list[i]))
-                    for s in found_pdb:
-                        pathway = 'pdbs/%s-%s' % (lig, targets_list[i])
-                        download_pdb(s, pathway)
-                        if fixpdb is True:
-                            pdb_fix_schrodinger(s, pathway, pH)
-
-
-def apo_search_mode(dictionary, pH, fixpdb):
+                searches.append(('%s and %s' % (chem_id, targets_list[i]), query,
+                                 'pdbs/%s-%s' % (lig, targets_list[i])))
+
+    written = run_search_pipeline(searches, client=client, progress=progress, n_threads=n_threads, bunit=bunit)
+    if fixpdb is True:
+        _prepare(written, pH, scheduler)
+
+    return written
+
+
+def apo_search_mode(dictionary, pH, fixpdb, client=None, progress=None, bunit=False, scheduler=None, n_threads=8):
+    """Download all kinase PDBs of the approved targets without any ligand
+
+    Args: as ligand_target_search_mode
+
+    Returns: a dictionary mapping each directory to the list of PDB IDs found for it and written to it
+
+    """
+    from .rcsb import run_search_pipeline
+
     accessions = dictionary['Accession_ID']
     accessions_list = set()
     for accession in range(len(accessions)):
         newlist = accessions[accession].split()
         for new_accession in newlist:
             accessions_list.add(new_accession)
-    for accession_id in accessions_list:
-        print('Searching for PDBs containing %s and no ligands' % accession_id)
-        query = gen_query(search_ligand=ligand, search_protein=accession_id)
-        found_pdb = search(query)
-        found_pdb = clean_pdb(found_pdb)
-        if len(found_pdb) > 0:
-            print('found %s PDB(s) for %s' % (len(found_pdb), accession_id))
-            for s in found_pdb:
-                pathway = 'pdbs/apo/%s' % accession_id
-                download_pdb(s, pathway)
-                if fixpdb is True:
-                    pdb_fix_schrodinger(s, pathway, pH)
+    searches = []
+    for accession_id in sorted(accessions_list):
+        query = gen_query(search_ligand=None, search_protein=accession_id, querymode='Apo')
+        searches.append(('%s and no ligands' % accession_id, query, 'pdbs/apo/%s' % accession_id))
+
+    written = run_search_pipeline(searches, client=client, progress=progress, n_threads=n_threads, bunit=bunit)
+    if fixpdb is True:
+        _prepare(written, pH, scheduler)
+
+    return written
+
+
+def _prepare(written, pH, scheduler=None):
+    """Fix the downloaded PDB files with Schrodinger's Protein Prep, in parallel"""
+    from .prepare import PreparationScheduler
+
+    if scheduler is None:
+        scheduler = PreparationScheduler('pdbs/preparation-manifest.jsonl', processes=False)
+    for pathway, pdb_ids in written.items():
+        for pdbid in pdb_ids:
+            scheduler.submit(pdbid, pathway, method='schrodinger', ph=pH)
+    summary = scheduler.run()
+    print('%s structure(s) fixed, %s failed, %s already fixed' % (summary['done'], summary['failed'],
+                                                                   summary['skipped']))
 
 
 def make_chem_id_list(dictionary, ligname):
@@ -429,6 +482,21 @@ def pdbfinder_cli():
     parser.add_argument('--biological_unit', required=False, action='store_true', dest='biological_unit',
                         help='Set flag to retrieve biological unit for all structures')
 
+    parser.add_argument('--workers', required=False, default=8, type=int, dest='workers',
+                        help='Maximum number of simultaneous searches and downloads')
+
+    parser.add_argument('--rate', required=False, default=5.0, type=float, dest='rate',
+                        help='Maximum number of requests per second to each host')
+
+    parser.add_argument('--retries', required=False, default=3, type=int, dest='retries',
+                        help='Number of times a failed request is retried')
+
+    parser.add_argument('--prep_workers', required=False, default=None, type=int, dest='prep_workers',
+                        help='Maximum number of structures fixed at the same time (default: number of CPUs)')
+
+    parser.add_argument('--progress', required=False, default='pdbs/pdbfinder-progress.json', dest='progress',
+                        help='File recording completed searches and downloads, used to resume an interrupted run')
+
     args = parser.parse_args()
 
     ligand = args.lig
@@ -438,6 +506,13 @@ def pdbfinder_cli():
     keepNumbers = args.keepNumbers
     bunit = args.biological_unit
 
+    from .rcsb import RcsbClient, SearchProgress
+    client = RcsbClient(max_connections=args.workers, rate=args.rate, retries=args.retries)
+    progress = SearchProgress(args.progress)
+    from .prepare import PreparationScheduler
+    scheduler = PreparationScheduler('pdbs/preparation-manifest.jsonl', n_workers=args.prep_workers, processes=False)
+    pipeline = dict(client=client, progress=progress, bunit=bunit, scheduler=scheduler, n_threads=args.workers)
+
     # Assert that query_mode is an implemented search typ
     assert query_mode in {'Lig', 'LigAndTarget', 'LigAll', 'Apo'}
 
@@ -447,22 +522,25 @@ def pdbfinder_cli():
     # Create a dictionary containing the curated PDBs that must have chains removed
     chain_to_remove = convert_csv_to_dict('remove_chains.csv')
 
-    # Query mode Lig searches for all PDBs with a given FDA-approved kinase inhibitors in them
-    if query_mode == 'Lig':
-        chem_id_list = make_chem_id_list(main_dictionary, ligand)
-        ligand_search_mode(chem_id_list, ligand, ph, fix, query_mode=query_mode)
+    # KINOMODEL_INSTRUMENT and KINOMODEL_PROFILE record the stages of the run
+    from ..instrumentation import instrument_run
+    with instrument_run('pdbfinder'):
+        # Query mode Lig searches for all PDBs with a given FDA-approved kinase inhibitors in them
+        if query_mode == 'Lig':
+            chem_id_list = make_chem_id_list(main_dictionary, ligand)
+            ligand_search_mode(chem_id_list, ligand, ph, fix, query_mode=query_mode, **pipeline)
 
-    # Query Mode LigAndTarget searches for all inhibitor:approved target PDB files
-    elif query_mode == 'LigAndTarget':
-        chem_id_list = make_chem_id_list(main_dictionary, ligand)
-        list_of_PDBS = ligand_target_search_mode(chem_id_list, main_dictionary, ligand, ph, fix)
+        # Query Mode LigAndTarget searches for all inhibitor:approved target PDB files
+        elif query_mode == 'LigAndTarget':
+            chem_id_list = make_chem_id_list(main_dictionary, ligand)
+            list_of_PDBS = ligand_target_search_mode(chem_id_list, main_dictionary, ligand, ph, fix, **pipeline)
 
-    # LigAll downloads all ligands and their HUMAN targets
-    elif query_mode == 'LigAll':
-        all_ligand_search_mode(main_dictionary, ph, fix)
+        # LigAll downloads all ligands and their HUMAN targets
+        elif query_mode == 'LigAll':
+            all_ligand_search_mode(main_dictionary, ph, fix, **pipeline)
 
-    elif query_mode == 'Apo':
-        apo_search_mode(main_dictionary, ph, fix)
+        elif query_mode == 'Apo':
+            apo_search_mode(main_dictionary, ph, fix, **pipeline)
 
-    else:
-        warnings.warn("I think you've specified a search mode that isn't supported yet! Check --mode")
+        else:
+            warnings.warn("I think you've specified a search mode that isn't supported yet! Check --mode")
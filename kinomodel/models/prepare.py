@@ -0,0 +1,186 @@
+# Parallel preparation of downloaded structures with PDBFixer or Schrodinger's PrepWizard
+#
+# Preparation jobs are queued on a PreparationScheduler and run on a pool of workers. Every finished
+# job is appended to a JSON-lines manifest with its parameters, outputs, wall time and error, if any.
+# A job is skipped when the manifest records a successful run with the same parameters and all of
+# its output files still exist, so an interrupted batch can simply be started again.
+
+import json
+import os
+
+
+def pdbfixer_outputs(pdbid, pathway, ph):
+    """Files written by pdbfinder.pdb_fix_pdbfixer
+
+    Args:
+        pdbid: 4-letter PDB code
+        pathway: the directory the files are written to
+        ph: the pH at which hydrogens are added
+
+    Returns: list of paths of the fixed structure, the structure without ligands and the structure without
+        ligands and waters
+
+    """
+    return [os.path.join(pathway, '%s_fixed_ph%s%s.pdb' % (pdbid, ph, suffix)) for suffix in ('', '_apo',
+                                                                                           '_apo_nowater')]
+
+
+def schrodinger_outputs(pdbid, pathway, ph):
+    """Files written by pdbfinder.pdb_fix_schrodinger
+
+    Args: as pdbfixer_outputs
+
+    Returns: list with the path of the prepared structure
+
+    """
+    return [os.path.join(pathway, 'fixed', '%s-fixed.pdb' % pdbid)]
+
+
+def _run_pdbfixer(job):
+    from .pdbfinder import pdb_fix_pdbfixer
+
+    pdb_fix_pdbfixer(job['pdbid'], job['pathway'], job['ph'], {'pdbid': [job['pdbid']],
+                                                               'chain_to_remove': [job['chains_to_remove']]},
+                     keep_ids=job['keep_ids'])
+
+
+def _run_schrodinger(job):
+    from .pdbfinder import pdb_fix_schrodinger
+
+    pdb_fix_schrodinger(job['pdbid'], job['pathway'], job['ph'])
+
+
+# preparation function and output files of each method
+PREPARATION_METHODS = {
+    'pdbfixer': (_run_pdbfixer, pdbfixer_outputs),
+    'schrodinger': (_run_schrodinger, schrodinger_outputs),
+}
+
+
+def prepare_structure(job):
+    """Prepare a single structure, capturing any error
+
+    Args:
+        job: dictionary with keys 'pdbid', 'pathway', 'method', 'ph', 'keep_ids' and 'chains_to_remove'
+
+    Returns: the job with 'status' ('ok' or 'failed'), 'outputs', 'wall_time' in seconds and, for failed
+        jobs, 'error'
+
+    """
+    import time
+    import traceback
+
+    result = dict(job)
+    run, outputs = PREPARATION_METHODS[job['method']]
+    result['outputs'] = outputs(job['pdbid'], job['pathway'], job['ph'])
+    start = time.time()
+    try:
+        run(job)
+        missing = [path for path in result['outputs'] if not os.path.exists(path)]
+        if missing:
+            raise RuntimeError('Preparation did not write %s' % ', '.join(missing))
+        result['status'] = 'ok'
+    except Exception as error:
+        result['status'] = 'failed'
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+        result['traceback'] = traceback.format_exc()
+    result['wall_time'] = time.time() - start
+
+    return result
+
+
+class PreparationScheduler(object):
+
+    def __init__(self, manifest, n_workers=None, processes=True):
+        """Queue of structure preparation jobs run on a pool of workers
+
+        Args:
+            manifest: the JSON-lines file every finished job is appended to
+            n_workers: maximum number of structures prepared at the same time (default: the number of CPUs)
+            processes: if True, jobs run in worker processes, otherwise in threads (enough for PrepWizard,
+                which runs as an external program in its own working directory)
+
+        """
+        self.manifest = manifest
+        self.n_workers = n_workers
+        self.processes = processes
+        self.jobs = []
+
+    def submit(self, pdbid, pathway, method='pdbfixer', ph=7.4, keep_ids=True, chains_to_remove=''):
+        """Queue the preparation of a structure
+
+        Args:
+            pdbid: 4-letter PDB code
+            pathway: the directory of the downloaded structure, where prepared files are written
+            method: 'pdbfixer' or 'schrodinger'
+            ph: the pH at which hydrogens are added
+            keep_ids: if True, keep the residue numbering of the PDB file (PDBFixer only)
+            chains_to_remove: space-separated IDs of the chains to remove (PDBFixer only)
+
+        """
+        if method not in PREPARATION_METHODS:
+            raise ValueError("Unknown preparation method '%s'" % method)
+        self.jobs.append({'pdbid': pdbid, 'pathway': pathway, 'method': method, 'ph': ph, 'keep_ids': keep_ids,
+                          'chains_to_remove': chains_to_remove})
+
+    def completed(self):
+        """Return the manifest entries of the successful jobs whose outputs still exist, keyed by job"""
+        results = {}
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as infile:
+                for line in infile:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        # a line left incomplete by an interrupted run
+                        continue
+                    results[_key(result)] = result
+
+        return {key: result for key, result in results.items()
+                if result['status'] == 'ok' and all(os.path.exists(path) for path in result['outputs'])}
+
+    def run(self):
+        """Run all queued jobs, skipping those already completed with the same parameters
+
+        Returns: dictionary with the number of jobs 'done', 'failed' and 'skipped'
+
+        """
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+        completed = self.completed()
+        jobs, self.jobs = self.jobs, []
+        pending = []
+        for job in jobs:
+            if _key(job) not in completed and job not in pending:
+                pending.append(job)
+        summary = {'done': 0, 'failed': 0, 'skipped': len(jobs) - len(pending)}
+        if not pending:
+            return summary
+
+        directory = os.path.dirname(os.path.abspath(self.manifest))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        executor_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with executor_class(max_workers=self.n_workers) as executor, open(self.manifest, 'a') as outfile:
+            futures = {executor.submit(prepare_structure, job): job for job in pending}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    # the worker process itself died
+                    result = dict(futures[future], status='failed', error='%s: %s' % (type(error).__name__, error),
+                                  outputs=[], wall_time=None)
+                outfile.write(json.dumps(result) + '\n')
+                outfile.flush()
+                if result['status'] == 'ok':
+                    summary['done'] += 1
+                else:
+                    summary['failed'] += 1
+                    print('Preparation of %s failed: %s' % (result['pdbid'], result['error']))
+
+        return summary
+
+
+def _key(job):
+    """The parameters identifying a preparation job"""
+    return json.dumps([job[name] for name in ('pdbid', 'pathway', 'method', 'ph', 'keep_ids', 'chains_to_remove')])
@@ -0,0 +1,251 @@
+# Concurrent search and download of RCSB structures for pdbfinder
+#
+# Searches and downloads go through a bounded pool of worker threads. Requests to each host are
+# rate limited and retried with exponential backoff, PDB IDs found by several queries are downloaded
+# only once, and completed searches and downloads are recorded in a progress file so that an
+# interrupted run can be resumed.
+
+import json
+import os
+import threading
+import time
+import warnings
+
+SEARCH_URL = 'http://www.rcsb.org/pdb/rest/search'
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate):
+        """Limit the rate of requests to each host.
+
+        Args:
+            rate: maximum number of requests per second to a single host (None for no limit)
+
+        """
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, host):
+        """Block until a request to host may be sent."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class RcsbClient(object):
+
+    def __init__(self, search_url=SEARCH_URL, cache=None, max_connections=8, rate=5.0, retries=3, backoff=1.0,
+                 timeout=60):
+        """HTTP client for RCSB searches and structure downloads.
+
+        Args:
+            search_url: the URL of the RCSB search service
+            cache: the kinomodel.structures.StructureCache downloaded files are stored in (default: the shared cache)
+            max_connections: maximum number of simultaneous requests
+            rate: maximum number of requests per second to each host
+            retries: number of times a failed request is retried
+            backoff: delay in seconds before the first retry, doubled for every further retry
+            timeout: timeout of each request in seconds
+
+        """
+        from ..structures import get_structure_cache
+
+        self.search_url = search_url
+        self.cache = cache if cache is not None else get_structure_cache()
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._connections = threading.BoundedSemaphore(max_connections)
+        self._limiter = RateLimiter(rate)
+
+    def request(self, url, data=None):
+        """Send a GET (or POST, if data is given) request, retrying on connection errors and server errors.
+
+        Args:
+            url: the URL to request
+            data: bytes to POST
+
+        Returns: the body of the response, as bytes
+
+        """
+        import urllib.error
+        import urllib.parse
+        from ..instrumentation import stage
+        from ..utils import read_url
+
+        host = urllib.parse.urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            self._limiter.wait(host)
+            try:
+                with self._connections, stage('network.fetch', url=url) as fetch:
+                    contents, transferred = read_url(url, data=data, timeout=self.timeout)
+                    fetch.add_bytes(transferred)
+                    return contents
+            except urllib.error.HTTPError as error:
+                # client errors other than throttling will not succeed on a retry
+                if (error.code < 500 and error.code != 429) or attempt == self.retries:
+                    raise
+            except (urllib.error.URLError, OSError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def search(self, scan_params):
+        """Send a query to the RCSB search service.
+
+        Args:
+            scan_params: a valid dict(), preferably generated by pdbfinder.gen_query
+
+        Returns: the raw result, to be cleaned up using pdbfinder.clean_pdb
+
+        """
+        import xmltodict
+
+        result = self.request(self.search_url, data=xmltodict.unparse(scan_params, pretty=False).encode())
+        if not result:
+            warnings.warn('No results were obtained for this search')
+
+        return str(result)
+
+    def download(self, pdbid, fmt='pdb'):
+        """Retrieve a structure file through the structure cache, downloading it on a miss.
+
+        Args:
+            pdbid: 4-letter PDB code
+            fmt: the file format ('pdb' for the asymmetric unit, 'pdb1' for the biological unit)
+
+        Returns: the contents of the file, as bytes
+
+        """
+        from ..structures import FORMATS
+
+        if self.cache.lookup(pdbid, fmt) is None:
+            url = '{}/{}'.format(self.cache.base_url, FORMATS[fmt][0].format(str(pdbid).upper()))
+            self.cache.store(pdbid, fmt, self.request(url))
+
+        return self.cache.read(pdbid, fmt)
+
+
+class SearchProgress(object):
+
+    def __init__(self, path=None):
+        """Record of the completed searches and downloads of a pdbfinder run.
+
+        Args:
+            path: the JSON file progress is saved to after every completed step (None to keep it in memory only)
+
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.searches = {}
+        self.downloads = set()
+        if path and os.path.exists(path):
+            with open(path) as infile:
+                progress = json.load(infile)
+            self.searches = progress['searches']
+            self.downloads = set(tuple(download) for download in progress['downloads'])
+
+    def _save(self):
+        from ..utils import atomic_write
+
+        if self.path:
+            progress = {'searches': self.searches, 'downloads': sorted(self.downloads)}
+            atomic_write(self.path, json.dumps(progress, indent=1).encode())
+
+    def add_search(self, key, pdb_ids):
+        with self._lock:
+            self.searches[key] = pdb_ids
+            self._save()
+
+    def add_download(self, pdbid, pathway):
+        with self._lock:
+            self.downloads.add((pdbid, pathway))
+            self._save()
+
+
+def run_search_pipeline(searches, client=None, progress=None, n_threads=8, bunit=False, on_download=None):
+    """Run RCSB searches and download every structure found, concurrently.
+
+    Args:
+        searches: list of (description, query, pathway) tuples; the structures found by each query
+            are written to pathway
+        client: the RcsbClient used for all requests (default: a client with default settings)
+        progress: a SearchProgress; searches and downloads it records as completed are skipped
+        n_threads: number of worker threads
+        bunit: if True, retrieve biological units instead of asymmetric units
+        on_download: optional function called as on_download(pdbid, pathway) after each file is written
+
+    Returns: a dictionary mapping each pathway to the list of PDB IDs found for it and written to it
+
+    ***Note: a failed search or download is reported with a warning and does not stop the other ones;
+    ***      it is attempted again when the run is resumed with the same progress
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .pdbfinder import clean_pdb, write_file
+
+    client = client if client is not None else RcsbClient()
+    progress = progress if progress is not None else SearchProgress()
+
+    def run_search(search):
+        description, query, pathway = search
+        key = json.dumps(query, sort_keys=True)
+        if key not in progress.searches:
+            print('Searching for PDBs containing %s' % description)
+            try:
+                progress.add_search(key, clean_pdb(client.search(query)))
+            except Exception as error:
+                # the search is not recorded as completed, and will be sent again when the run is resumed
+                warnings.warn('Search for %s failed: %s' % (description, error))
+                return []
+        found_pdb = [pdbid for pdbid in progress.searches[key] if pdbid]
+        if len(found_pdb) > 0:
+            print('found %s PDB(s) for %s' % (len(found_pdb), description))
+        return found_pdb
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        found = list(executor.map(run_search, searches))
+
+    # every PDB ID is downloaded once, even if it was found by several queries
+    destinations = {}
+    for (_, _, pathway), found_pdb in zip(searches, found):
+        for pdbid in found_pdb:
+            pathways = destinations.setdefault(pdbid, [])
+            if pathway not in pathways:
+                pathways.append(pathway)
+
+    def fetch(pdbid):
+        pending = [pathway for pathway in destinations[pdbid] if (pdbid, pathway) not in progress.downloads]
+        if not pending:
+            return
+        try:
+            pdb = client.download(pdbid, 'pdb1' if bunit else 'pdb').decode('unicode_escape' if bunit else 'utf-8')
+            if bunit:
+                pdb = pdb.replace('XXXX', pdbid)
+            for pathway in pending:
+                os.makedirs(pathway, exist_ok=True)
+                write_file(os.path.join(pathway, '%s.pdb' % pdbid), pdb)
+                if on_download is not None:
+                    on_download(pdbid, pathway)
+                progress.add_download(pdbid, pathway)
+        except Exception as error:
+            warnings.warn('Download of %s failed: %s' % (pdbid, error))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(fetch, sorted(destinations)))
+
+    # structures whose download failed are left out, so that they are not queued for preparation
+    written = {}
+    for pdbid in sorted(destinations):
+        for pathway in destinations[pdbid]:
+            if (pdbid, pathway) in progress.downloads:
+                written.setdefault(pathway, []).append(pdbid)
+
+    return written
@@ -41,7 +41,8 @@ def protein_prep(input_file_path, output_file_path, pdbid, pH=7.4, fillsidechain
     output_file_path = os.path.abspath(output_file_path)
     output_dir = os.path.join(output_file_path, '%s-fixed' % pdbid)
 
-    output_file_name = '../%s-fixed.pdb' % pdbid
+    # absolute paths, as jobs may run in parallel threads sharing the working directory
+    output_file_name = os.path.join(output_file_path, '%s-fixed.pdb' % pdbid)
 
     # Check for output file pathway
     if not os.path.exists(output_dir):
@@ -64,7 +65,10 @@ def protein_prep(input_file_path, output_file_path, pdbid, pH=7.4, fillsidechain
     cmd.append(input_file_path)
     cmd.append(output_file_name)
 
-    from openmoltools import units, schrodinger
-    with utils.temporary_cd(output_dir):
-        log = schrodinger.run_and_log_error(cmd)
-        write_file('%s.log' % pdbid, log)
+    # PrepWizard writes its intermediate files to its working directory; it is run in output_dir without
+    # changing the working directory of this process
+    import subprocess
+    process = subprocess.run(cmd, cwd=output_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+    write_file(os.path.join(output_dir, '%s.log' % pdbid), process.stdout)
+    process.check_returncode()
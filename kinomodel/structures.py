@@ -0,0 +1,576 @@
+"""
+structures.py
+A local, content-addressed cache of structure files shared by all kinomodel modules.
+
+Each downloaded file is stored once under its SHA-256 digest, and a small reference file maps
+every (format, PDB code) pair to the stored object. Featurization, pdbfinder and any other code
+retrieving structures from the PDB go through this cache, so a structure is downloaded only once.
+Files are transferred gzip-compressed when the server supports it, and entries that have no legacy
+PDB file (large structures) are retrieved as mmCIF, following the format preference of the cache.
+
+Parsed structures are kept in memory and in a native binary cache (NumPy arrays of the coordinates
+and topology), so a structure file is parsed from text once per machine; see load_structure.
+
+"""
+
+import os
+
+DEFAULT_BASE_URL = 'https://files.rcsb.org/download'
+
+# file name on the server and extension of the cached object for each supported format
+FORMATS = {
+    'pdb': ('{}.pdb', '.pdb'),
+    'pdb1': ('{}.pdb1', '.pdb'),  # first biological assembly
+    'cif': ('{}.cif', '.cif'),
+}
+
+# formats tried in turn when none is requested; legacy PDB first, as featurization indexes chains in
+# the order of the PDB file, and mmCIF for entries too large to be distributed as PDB files
+DEFAULT_FORMATS = ('pdb', 'cif')
+
+
+class StructureCache(object):
+
+    def __init__(self, root=None, max_size=10 * 1024**3, compress=False, base_url=DEFAULT_BASE_URL, timeout=60,
+                 formats=None):
+        """A size-bounded, on-disk cache of structure files downloaded from the PDB.
+
+        Parameters
+        ----------
+        root: str, optional
+            The cache directory. Defaults to the 'structures' directory under KINOMODEL_CACHE_DIR
+            (~/.cache/kinomodel by default).
+        max_size: int or None, optional, default=10 GiB
+            Maximum total size of the cached files in bytes; least recently used files are evicted
+            beyond it. None disables eviction.
+        compress: bool, optional, default=False
+            If True, newly cached files are stored gzip-compressed.
+        base_url: str, optional
+            The URL the files are downloaded from, as {base_url}/{PDBID}.{format}.
+        timeout: float, optional, default=60
+            Timeout of each download in seconds.
+        formats: list of str, optional
+            The formats tried in turn when none is requested, the first one available being used. Defaults to
+            the comma-separated KINOMODEL_STRUCTURE_FORMATS, or DEFAULT_FORMATS.
+
+        """
+        from .utils import get_cache_dir
+
+        self.root = root if root else get_cache_dir('structures')
+        self.max_size = max_size
+        self.compress = compress
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        if formats is None:
+            formats = [fmt.strip() for fmt in os.environ.get('KINOMODEL_STRUCTURE_FORMATS', '').split(',')
+                       if fmt.strip()] or DEFAULT_FORMATS
+        unknown = [fmt for fmt in formats if fmt not in FORMATS]
+        if unknown:
+            raise ValueError("Unknown structure formats: {}".format(', '.join(unknown)))
+        self.formats = list(formats)
+
+    def _ref_path(self, pdbid, fmt):
+        return os.path.join(self.root, 'refs', fmt, str(pdbid).upper())
+
+    def _object_path(self, name):
+        return os.path.join(self.root, 'objects', name[:2], name)
+
+    def lookup(self, pdbid, fmt='pdb'):
+        """Return the path of a cached structure file, or None if it is not in the cache.
+
+        Parameters
+        ----------
+        pdbid: str
+            The PDB code of the structure.
+        fmt: str, optional, default='pdb'
+            The file format, one of FORMATS.
+
+        Returns
+        -------
+        path: str or None
+            The path to the cached file (gzip-compressed if it ends with .gz).
+
+        """
+        try:
+            with open(self._ref_path(pdbid, fmt)) as ref:
+                path = self._object_path(ref.read().strip())
+            # mark the file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return path
+
+    def fetch(self, pdbid, fmt=None):
+        """Return the path of a structure file, downloading it into the cache on a miss.
+
+        Parameters
+        ----------
+        pdbid: str
+            The PDB code of the structure.
+        fmt: str, optional
+            The file format, one of FORMATS. By default, the first of the preferred formats that is cached, or
+            else the first one the server has.
+
+        Returns
+        -------
+        path: str
+            The path to the cached file (gzip-compressed if it ends with .gz); its extension gives its format.
+
+        """
+        if fmt is None:
+            return self._fetch_preferred(pdbid)
+        if fmt not in FORMATS:
+            raise ValueError("Unknown structure format '{}'".format(fmt))
+        path = self.lookup(pdbid, fmt)
+        if path is None:
+            path = self.store(pdbid, fmt, self._download(pdbid, fmt))
+
+        return path
+
+    def _fetch_preferred(self, pdbid):
+        import urllib.error
+
+        for fmt in self.formats:
+            path = self.lookup(pdbid, fmt)
+            if path is not None:
+                return path
+        for i, fmt in enumerate(self.formats):
+            try:
+                return self.store(pdbid, fmt, self._download(pdbid, fmt))
+            except urllib.error.HTTPError as error:
+                # the entry is not distributed in this format
+                if error.code != 404 or i == len(self.formats) - 1:
+                    raise
+
+    def read(self, pdbid, fmt=None):
+        """Return the (uncompressed) contents of a structure file, downloading it on a miss.
+
+        Parameters
+        ----------
+        pdbid: str
+            The PDB code of the structure.
+        fmt: str, optional
+            The file format, one of FORMATS. By default, the first of the preferred formats available.
+
+        Returns
+        -------
+        contents: bytes
+            The contents of the file.
+
+        """
+        import gzip
+
+        path = self.fetch(pdbid, fmt)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as infile:
+            return infile.read()
+
+    def store(self, pdbid, fmt, contents):
+        """Add the contents of a structure file to the cache.
+
+        Parameters
+        ----------
+        pdbid: str
+            The PDB code of the structure.
+        fmt: str
+            The file format, one of FORMATS.
+        contents: bytes
+            The (uncompressed) contents of the file.
+
+        Returns
+        -------
+        path: str
+            The path to the cached file.
+
+        """
+        import gzip
+        import hashlib
+        from .utils import atomic_write
+
+        name = hashlib.sha256(contents).hexdigest() + FORMATS[fmt][1]
+        if self.compress:
+            name += '.gz'
+        path = self._object_path(name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            atomic_write(path, gzip.compress(contents) if self.compress else contents)
+        atomic_write(self._ref_path(pdbid, fmt), name.encode())
+        self.evict()
+
+        return path
+
+    def _download(self, pdbid, fmt):
+        from kinomodel.instrumentation import stage
+        from .utils import read_url
+
+        url = '{}/{}'.format(self.base_url, FORMATS[fmt][0].format(str(pdbid).upper()))
+        with stage('network.fetch', url=url) as fetch:
+            contents, transferred = read_url(url, timeout=self.timeout)
+            fetch.add_bytes(transferred)
+        return contents
+
+    def _objects(self):
+        """List (last use, size, path) of every cached file."""
+        from .utils import cached_files
+
+        return cached_files(os.path.join(self.root, 'objects'))
+
+    def size(self):
+        """Return the total size of the cached files in bytes."""
+        return sum(size for _, size, _ in self._objects())
+
+    def evict(self):
+        """Remove least recently used files until the cache fits in max_size.
+
+        References to evicted files are left in place and are treated as cache misses.
+
+        """
+        from .utils import evict_least_recently_used
+
+        evict_least_recently_used(os.path.join(self.root, 'objects'), self.max_size)
+
+
+_structure_cache = None
+
+
+def get_structure_cache():
+    """Return the structure cache used by default by all kinomodel modules."""
+    global _structure_cache
+    if _structure_cache is None:
+        _structure_cache = StructureCache()
+
+    return _structure_cache
+
+
+def set_structure_cache(cache):
+    """Replace the structure cache used by default by all kinomodel modules.
+
+    Parameters
+    ----------
+    cache: StructureCache
+        The new default cache.
+
+    """
+    global _structure_cache
+    _structure_cache = cache
+
+
+def fetch_structure(pdbid, fmt=None):
+    """Return the path of a structure file from the default cache, downloading it on a miss.
+
+    Parameters
+    ----------
+    pdbid: str
+        The PDB code of the structure.
+    fmt: str, optional
+        The file format, one of FORMATS. By default, the first of the preferred formats of the cache available.
+
+    Returns
+    -------
+    path: str
+        The path to the cached file.
+
+    """
+    return get_structure_cache().fetch(pdbid, fmt)
+
+
+# files parsed whole into coordinates and topology by load_structure
+STRUCTURE_EXTENSIONS = ('.pdb', '.pdb.gz', '.cif', '.cif.gz', '.gro', '.mol2')
+
+
+def is_structure_file(path):
+    """Return True if path is a structure file (coordinates and topology) that load_structure parses."""
+    return isinstance(path, str) and path.lower().endswith(STRUCTURE_EXTENSIONS)
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of the contents of a file."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1024**2), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+_atom_tables = None
+
+
+def atom_table(topology):
+    """
+    Return the atom table of a topology as NumPy arrays, computed once per topology object.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        The topology.
+
+    Returns
+    -------
+    table : dict of str: np.ndarray, shape (n_atoms,)
+        'name', 'element' (symbol), 'resName', 'resSeq' and 'chainID' (the chain index) of every atom,
+        in atom order, as the columns of mdtraj.Topology.to_dataframe.
+
+    """
+    import weakref
+    import numpy as np
+
+    global _atom_tables
+    if _atom_tables is None:
+        _atom_tables = weakref.WeakKeyDictionary()
+    table = _atom_tables.get(topology)
+    if table is None:
+        atoms = list(topology.atoms)
+        table = {
+            'name': np.array([atom.name for atom in atoms], dtype=str),
+            'element': np.array([atom.element.symbol if atom.element is not None else '' for atom in atoms],
+                                dtype=str),
+            'resName': np.array([atom.residue.name for atom in atoms], dtype=str),
+            'resSeq': np.array([atom.residue.resSeq for atom in atoms], dtype=int),
+            'chainID': np.array([atom.residue.chain.index for atom in atoms], dtype=int),
+        }
+        _atom_tables[topology] = table
+
+    return table
+
+
+class Structure(object):
+
+    def __init__(self, trajectory, key=None):
+        """A parsed structure: its coordinates, topology and atom table.
+
+        Parameters
+        ----------
+        trajectory: mdtraj.Trajectory
+            The coordinates and topology of the structure.
+        key: str, optional
+            The SHA-256 of the file the structure was parsed from.
+
+        """
+        self.trajectory = trajectory
+        self.key = key
+
+    @property
+    def topology(self):
+        """The mdtraj topology of the structure."""
+        return self.trajectory.topology
+
+    @property
+    def atoms(self):
+        """The atom table of the structure, see atom_table."""
+        return atom_table(self.trajectory.topology)
+
+
+_parsed_structures = None
+
+
+def get_parsed_structure_cache():
+    """Return the in-process LRU cache of parsed structures used by default."""
+    global _parsed_structures
+    if _parsed_structures is None:
+        from .utils import LRUCache
+        _parsed_structures = LRUCache(int(os.environ.get('KINOMODEL_PARSED_STRUCTURES', 16)))
+
+    return _parsed_structures
+
+
+def set_parsed_structure_cache(cache):
+    """Replace the in-process LRU cache of parsed structures used by default.
+
+    Parameters
+    ----------
+    cache: kinomodel.utils.LRUCache
+        The new default cache.
+
+    """
+    global _parsed_structures
+    _parsed_structures = cache
+
+
+# version of the arrays written by save_parsed_structure; files of other versions are ignored
+PARSED_FORMAT_VERSION = 1
+
+# default size bound of the binary cache of parsed structures, in bytes
+PARSED_CACHE_SIZE = 2 * 1024**3
+
+
+def parsed_cache_size():
+    """Return the size bound of the binary cache of parsed structures in bytes.
+
+    It is given by KINOMODEL_PARSED_CACHE_SIZE, PARSED_CACHE_SIZE (2 GiB) by default.
+
+    """
+    return int(os.environ.get('KINOMODEL_PARSED_CACHE_SIZE', PARSED_CACHE_SIZE))
+
+
+def save_parsed_structure(trajectory, path):
+    """
+    Write a parsed structure as uncompressed NumPy arrays (.npz), which read back much faster than text.
+
+    Parameters
+    ----------
+    trajectory : mdtraj.Trajectory
+        The coordinates and topology of the structure.
+    path : str
+        The file to write.
+
+    """
+    import io
+    import numpy as np
+    from .utils import atomic_write
+
+    topology = trajectory.topology
+    atoms, residues, bonds = list(topology.atoms), list(topology.residues), list(topology.bonds)
+    unitcell = trajectory.unitcell_vectors is not None
+    arrays = {
+        'version': np.array(PARSED_FORMAT_VERSION),
+        'xyz': trajectory.xyz,
+        'time': trajectory.time,
+        'unitcell_lengths': trajectory.unitcell_lengths if unitcell else np.zeros((0, 3), dtype=np.float32),
+        'unitcell_angles': trajectory.unitcell_angles if unitcell else np.zeros((0, 3), dtype=np.float32),
+        'chain_id': np.array([chain.chain_id or '' for chain in topology.chains], dtype=str),
+        'residue_name': np.array([residue.name for residue in residues], dtype=str),
+        'residue_seq': np.array([residue.resSeq for residue in residues], dtype=np.int32),
+        'residue_segment': np.array([residue.segment_id for residue in residues], dtype=str),
+        'residue_chain': np.array([residue.chain.index for residue in residues], dtype=np.int32),
+        'atom_name': np.array([atom.name for atom in atoms], dtype=str),
+        'atom_element': np.array([atom.element.symbol if atom.element is not None else '' for atom in atoms],
+                                 dtype=str),
+        'atom_residue': np.array([atom.residue.index for atom in atoms], dtype=np.int32),
+        'atom_serial': np.array([atom.serial if atom.serial is not None else -1 for atom in atoms], dtype=np.int32),
+        'atom_charge': np.array([atom.formal_charge if atom.formal_charge is not None else np.nan
+                                 for atom in atoms], dtype=np.float32),
+        'bond_atoms': np.array([[bond.atom1.index, bond.atom2.index] for bond in bonds],
+                               dtype=np.int32).reshape(-1, 2),
+        'bond_type': np.array([str(bond.type) if bond.type is not None else '' for bond in bonds], dtype=str),
+        'bond_order': np.array([bond.order if bond.order is not None else 0 for bond in bonds], dtype=np.int8),
+    }
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    atomic_write(path, buffer.getvalue())
+
+
+def read_parsed_structure(path):
+    """
+    Read a structure written by save_parsed_structure.
+
+    Parameters
+    ----------
+    path : str
+        The .npz file.
+
+    Returns
+    -------
+    trajectory : mdtraj.Trajectory
+        The coordinates and topology of the structure.
+
+    Raises
+    ------
+    ValueError
+        If the file was written by another version of kinomodel.
+
+    """
+    import numpy as np
+    import mdtraj as md
+    from mdtraj.core import element
+    from mdtraj.core.topology import Aromatic, Amide, Double, Single, Triple
+
+    bond_types = {str(bond_type): bond_type for bond_type in (Single, Double, Triple, Amide, Aromatic)}
+    with np.load(path, allow_pickle=False) as arrays:
+        arrays = dict(arrays)
+    if int(arrays['version']) != PARSED_FORMAT_VERSION:
+        raise ValueError('{} is not a parsed structure of version {}'.format(path, PARSED_FORMAT_VERSION))
+
+    topology = md.Topology()
+    chains = [topology.add_chain(chain_id or None) for chain_id in arrays['chain_id'].tolist()]
+    residues = [topology.add_residue(name, chains[chain], resSeq, segment_id)
+                for name, resSeq, segment_id, chain in zip(arrays['residue_name'].tolist(),
+                                                           arrays['residue_seq'].tolist(),
+                                                           arrays['residue_segment'].tolist(),
+                                                           arrays['residue_chain'].tolist())]
+    elements = {symbol: element.get_by_symbol(symbol) if symbol else None
+                for symbol in set(arrays['atom_element'].tolist())}
+    atoms = [topology.add_atom(name, elements[symbol], residues[residue], serial if serial >= 0 else None,
+                               None if np.isnan(charge) else int(charge))
+             for name, symbol, residue, serial, charge in zip(arrays['atom_name'].tolist(),
+                                                              arrays['atom_element'].tolist(),
+                                                              arrays['atom_residue'].tolist(),
+                                                              arrays['atom_serial'].tolist(),
+                                                              arrays['atom_charge'].tolist())]
+    for (atom1, atom2), bond_type, order in zip(arrays['bond_atoms'].tolist(), arrays['bond_type'].tolist(),
+                                                arrays['bond_order'].tolist()):
+        topology.add_bond(atoms[atom1], atoms[atom2], bond_types.get(bond_type), order or None)
+
+    unitcell = len(arrays['unitcell_lengths']) > 0
+    return md.Trajectory(arrays['xyz'], topology, time=arrays['time'],
+                         unitcell_lengths=arrays['unitcell_lengths'] if unitcell else None,
+                         unitcell_angles=arrays['unitcell_angles'] if unitcell else None)
+
+
+def load_structure(path, cache=None, binary_cache=True):
+    """
+    Parse a structure file once per process, returning its coordinates, topology and atom table.
+
+    Parsed structures are kept in a bounded LRU cache keyed by the SHA-256 of the file, so all
+    featurization code in a process shares one parse of each structure, whatever its path. They are
+    also written to a native binary cache on disk, so other processes read NumPy arrays instead of
+    parsing the text again.
+
+    Parameters
+    ----------
+    path : str
+        A structure file (see STRUCTURE_EXTENSIONS).
+    cache : kinomodel.utils.LRUCache or False, optional
+        The cache of parsed structures. Defaults to the shared in-process cache, whose size is given by
+        KINOMODEL_PARSED_STRUCTURES (16 by default); False disables caching.
+    binary_cache : bool or str, optional, default=True
+        The directory of the binary cache: True for the 'parsed' directory under KINOMODEL_CACHE_DIR,
+        False to always parse the file. Least recently used files are evicted from it beyond
+        parsed_cache_size().
+
+    Returns
+    -------
+    structure : Structure
+        The parsed structure. Its trajectory is shared; do not modify it in place.
+
+    """
+    import mdtraj as md
+    from .instrumentation import stage
+    from .utils import evict_least_recently_used, get_cache_dir
+
+    key = file_hash(path)
+    if cache is None:
+        cache = get_parsed_structure_cache()
+    structure = cache.get(key) if cache is not False else None
+    if structure is not None:
+        return structure
+
+    binary = None
+    if binary_cache is not False:
+        directory = get_cache_dir('parsed') if binary_cache is True else binary_cache
+        binary = os.path.join(directory, key[:2], '{}.v{}.npz'.format(key, PARSED_FORMAT_VERSION))
+    trajectory = None
+    if binary is not None and os.path.exists(binary):
+        try:
+            with stage('topology.parse', path=path, binary=True):
+                trajectory = read_parsed_structure(binary)
+            # mark the file as recently used
+            os.utime(binary)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            pass
+    if trajectory is None:
+        with stage('topology.parse', path=path):
+            trajectory = md.load(path)
+        if binary is not None:
+            save_parsed_structure(trajectory, binary)
+            evict_least_recently_used(directory, parsed_cache_size())
+    structure = Structure(trajectory, key)
+    if cache is not False:
+        cache.put(key, structure)
+
+    return structure
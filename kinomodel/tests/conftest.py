@@ -0,0 +1,37 @@
+"""
+Shared test configuration: keep the test session out of the user's kinomodel cache.
+"""
+
+import os
+
+import pytest
+
+
+def _reset_default_caches():
+    """Drop the default caches, so they are created again under the current KINOMODEL_CACHE_DIR."""
+    from kinomodel import structures
+    from kinomodel.docking import ligand_cache, receptor_cache
+    from kinomodel.features import atom_index, klifs_cache
+
+    structures.set_structure_cache(None)
+    structures.set_parsed_structure_cache(None)
+    atom_index.set_atom_index_cache(None)
+    klifs_cache.set_klifs_cache(None)
+    ligand_cache.set_ligand_cache(None)
+    receptor_cache.set_receptor_cache(None)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmp_path_factory):
+    """Point KINOMODEL_CACHE_DIR at a temporary directory for the whole test session."""
+    previous = os.environ.get('KINOMODEL_CACHE_DIR')
+    os.environ['KINOMODEL_CACHE_DIR'] = str(tmp_path_factory.mktemp('kinomodel-cache'))
+    _reset_default_caches()
+
+    yield os.environ['KINOMODEL_CACHE_DIR']
+
+    if previous is None:
+        del os.environ['KINOMODEL_CACHE_DIR']
+    else:
+        os.environ['KINOMODEL_CACHE_DIR'] = previous
+    _reset_default_caches()
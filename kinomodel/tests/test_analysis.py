@@ -0,0 +1,57 @@
+"""
+Test the assignment of kinase conformational states
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import numpy as np
+
+
+class StatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # distances (K_E1, K_E2, DFG_conf1, DFG_conf2, fret) of frames in each state
+        self.distances = np.array([
+            [0.30, 0.50, 0.90, 1.30, 2.0],  # aC-in, DFG-in
+            [0.80, 0.90, 1.30, 1.00, 2.0],  # aC-out, DFG-out
+            [0.90, 0.35, 0.80, 0.70, 2.0],  # aC-in (second oxygen), DFG-inter
+            [np.nan, 0.0, 1.50, 1.60, 2.0],  # aC missing, DFG-other
+            [1.00, 1.00, 0.0, 1.20, 2.0],  # aC-out, DFG missing (computed without atoms)
+        ])
+
+    def test_classify_states(self):
+        from kinomodel.analysis import classify_states, DFG_STATES, AC_STATES
+
+        states = classify_states(self.distances)
+        self.assertEqual(states['dfg'].dtype, np.int8)
+        self.assertEqual(states['dfg'].tolist(), [0, 1, 2, 3, -1])
+        self.assertEqual(states['ac'].tolist(), [0, 1, 0, -1, 1])
+        self.assertEqual(DFG_STATES[states['dfg'][1]], 'DFG-out')
+        self.assertEqual(AC_STATES[states['ac'][0]], 'aC-in')
+        # custom cutoffs, and trajectories of several chains at once
+        states = classify_states(np.stack([self.distances] * 3), ac_cutoff=0.32, out_cutoff=0.9)
+        self.assertEqual(states['ac'].shape, (3, 5))
+        self.assertEqual(states['ac'][2].tolist(), [0, 1, 1, -1, 1])
+        self.assertEqual(states['dfg'][0].tolist(), [0, 3, 2, 3, -1])
+
+    def test_populations(self):
+        from kinomodel.analysis import classify_dfg, state_populations, store_state_populations
+        from kinomodel.features.store import FeatureStore
+
+        populations, n_missing = state_populations(classify_dfg(self.distances), 4)
+        self.assertEqual(populations.tolist(), [0.25, 0.25, 0.25, 0.25])
+        self.assertEqual(n_missing, 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with FeatureStore(directory) as store:
+                store.append('3PP0', 'A', distances=self.distances)
+                store.append('3PP0', 'A', distances=self.distances[:2], first_frame=5)
+                store.append('1M17', 'A', distances=self.distances[4:])
+            populations = store_state_populations(directory, batch_size=3)
+        self.assertEqual(populations['pdb'].tolist(), ['3PP0', '1M17'])
+        self.assertEqual(populations['n_frames'].tolist(), [7, 1])
+        self.assertAlmostEqual(populations['DFG-in'][0], 2 / 6)
+        self.assertEqual(populations['DFG-missing'].tolist(), [1, 1])
+        self.assertTrue(np.isnan(populations['DFG-in'][1]))
+        self.assertEqual(populations['aC-out'][1], 1.0)
@@ -0,0 +1,46 @@
+"""
+Test the OpenMM collective variables of kinase conformation
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import numpy as np
+
+
+class KinaseCVTestCase(unittest.TestCase):
+
+    def test_kinase_cvs(self):
+        import mdtraj as md
+        from simtk import openmm, unit
+        from kinomodel.cv import create_kinase_cv_force, get_cv_values
+        from kinomodel.features.klifs import Klifs
+        from kinomodel.features.protein import compute_simple_protein_features, dih_names, dis_names
+        from kinomodel.tests.utils import PDB_3CS9 as pdb, numbering_3cs9
+
+        # Abl:nilotinib (PDBID:3CS9) with the KLIFS positions used by the features mapped onto chain A
+        traj = md.load(pdb)
+        numbering = numbering_3cs9()
+        klifs = Klifs('3CS9', 'A', 392, 'ABL1', 1, 'NIL', 'K' * 85, numbering)
+
+        system = openmm.System()
+        for _ in range(traj.n_atoms):
+            system.addParticle(1.0)
+        force = create_kinase_cv_force(traj.topology.to_openmm(), klifs)
+        system.addForce(force)
+        context = openmm.Context(system, openmm.VerletIntegrator(0.001), openmm.Platform.getPlatformByName('CPU'))
+        context.setPositions(traj.xyz[0] * unit.nanometers)
+        values = get_cv_values(force, context)
+
+        # the aC-aE dihedral has unresolved atoms (residues 275-278) and is left out
+        self.assertEqual(list(values), dih_names[1:] + dis_names)
+        dihedrals, distances = compute_simple_protein_features('3CS9', 'A', pdb, numbering)
+        expected = dict(zip(dih_names + dis_names, np.concatenate([dihedrals[0], distances[0]])))
+        for name, value in values.items():
+            self.assertAlmostEqual(value, expected[name], places=4, msg=name)
+
+        # a subset of the collective variables, with a bias on one of them
+        force = create_kinase_cv_force(traj.topology, chainid='A', numbering=numbering, names=['K_E1'],
+                                       energy='100*(K_E1-0.3)^2')
+        self.assertEqual(force.getNumCollectiveVariables(), 1)
+        with self.assertRaises(ValueError):
+            create_kinase_cv_force(traj.topology, klifs, names=['aC_rot'])
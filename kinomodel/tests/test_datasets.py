@@ -0,0 +1,85 @@
+"""
+Test the kinase:inhibitor affinity store
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+
+
+class AffinityStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # a ChEMBL-style dump, with gene names, units, relations and a measurement of an unknown kinase
+        self.chembl = os.path.join(self.directory.name, 'chembl.csv')
+        pd.DataFrame({
+            'target': ['EGFR', 'EGFR', 'EGFR', 'ABL1', 'ABL1', 'PIM1', 'ABL1'],
+            'canonical_smiles': [' c1ccccc1', 'c1ccccc1', 'CCO', 'c1ccccc1', 'CCO', 'CCO', 'CCN'],
+            'standard_type': ['Kd', 'Ki', 'Kd', 'IC50', 'Kd', 'Kd', 'Kd'],
+            'standard_relation': ['=', '=', '=', '=', '>', '=', '='],
+            'standard_value': [10.0, 1.0, 100.0, 1.0, 10000.0, 5.0, -1.0],
+            'standard_units': ['nM', 'uM', 'nM', 'uM', 'nM', 'nM', 'nM'],
+        }).to_csv(self.chembl, index=False)
+        self.kinase_ids = {'EGFR': 406, 'ABL1': 392}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_affinities(self):
+        from kinomodel.datasets import read_affinities
+
+        affinities = read_affinities(self.chembl, 'target', 'canonical_smiles', 'standard_value',
+                                     units_column='standard_units', measure_column='standard_type',
+                                     relation_column='standard_relation', kinase_ids=self.kinase_ids,
+                                     canonicalize=str.strip, chunksize=3)
+        self.assertEqual(affinities['kinase_id'].tolist(), [406, 406, 406, 392])
+        self.assertEqual(affinities['smiles'].tolist(), ['c1ccccc1', 'c1ccccc1', 'CCO', 'c1ccccc1'])
+        self.assertTrue(np.allclose(affinities['p_affinity'], [8, 6, 7, 6]))
+        self.assertEqual(affinities['source'].unique().tolist(), ['chembl.csv'])
+
+        # pAffinities in a TSV file, already identified by KLIFS kinase_ID
+        davis = os.path.join(self.directory.name, 'davis.tsv')
+        pd.DataFrame({'kinase_ID': [392], 'smiles': ['CCN'], 'pKd': [7.5]}).to_csv(davis, sep='\t', index=False)
+        affinities = read_affinities(davis, 'kinase_ID', 'smiles', 'pKd', units='p', canonicalize=None)
+        self.assertEqual(affinities.values.tolist(), [[392, 'CCN', 7.5, 'Kd', 'davis.tsv']])
+        with self.assertRaises(ValueError):
+            read_affinities(davis, 'kinase_ID', 'smiles', 'pKd', measure='pIC50')
+
+    def test_store(self):
+        from kinomodel.datasets import read_affinities, build_affinity_store, AffinityStore
+
+        affinities = [
+            read_affinities(self.chembl, 'target', 'canonical_smiles', 'standard_value', units_column='standard_units',
+                            measure_column='standard_type', relation_column='standard_relation',
+                            kinase_ids=self.kinase_ids, canonicalize=str.strip),
+            read_affinities(pd.DataFrame({'kinase': [392], 'smiles': ['CCO'], 'Kd': [1e-8]}), 'kinase', 'smiles',
+                            'Kd', units='M', source='davis', canonicalize=None),
+        ]
+        path = os.path.join(self.directory.name, 'affinities')
+        build_affinity_store(path, affinities)
+        store = AffinityStore(path, canonicalize=None)
+        self.assertEqual((len(store), store.n_records), (4, 5))
+        self.assertIn((406, 'c1ccccc1'), store)
+        self.assertNotIn((392, 'CCN'), store)
+
+        self.assertAlmostEqual(store.get(406, 'c1ccccc1'), 7.0)
+        self.assertAlmostEqual(store.get(406, 'c1ccccc1', measure='Kd'), 8.0)
+        self.assertAlmostEqual(store.get(406, 'c1ccccc1', aggregate='max'), 8.0)
+        self.assertTrue(np.isnan(store.get(406, 'c1ccccc1', measure='IC50')))
+        self.assertEqual(store.records(392, 'CCO')['source'].tolist(), ['davis'])
+
+        # query SMILES are canonicalized when they are not found as given
+        store = AffinityStore(path, canonicalize=str.strip)
+        values = store.lookup([392, 392, 406, 1], ['c1ccccc1 ', 'CCO', 'CCO', 'CCO'])
+        self.assertTrue(np.allclose(values[:3], [6, 8, 7]))
+        self.assertTrue(np.isnan(values[3]))
+        joined = store.join(pd.DataFrame({'kinase_id': [406], 'smiles': ['CCO']}), column='pKd', measure='Kd')
+        self.assertEqual(joined['pKd'].tolist(), [7.0])
+
+        # rebuilding replaces the store
+        build_affinity_store(path, affinities[1])
+        self.assertEqual(len(AffinityStore(path)), 1)
@@ -39,3 +39,33 @@ class DockingTestCase(unittest.TestCase):
         # we also have the option to keep the docked files
         #docked_molecules_path = os.path.join(get_data_filename('docked.mol2'))
         #hybrid.hybrid_docking(receptor_path, molecules_path, docked_molecules_path)
+
+    def test_parallel_hybrid_docking(self):
+        "Test hybrid docking to Abl:nilotinib (PDBID:3CS9) with several worker processes"
+        from kinomodel.docking import hybrid
+        from openeye import oechem, oedocking
+        data = os.path.join(os.path.dirname(__file__), '..', 'data')
+        receptor_path = os.path.join(data, 'docking', '3cs9.pdb')
+        molecules_path = os.path.join(data, 'fda-approved.smi')
+
+        with tempfile.TemporaryDirectory() as docked_molecules_directory:
+            titles = []
+            for n_workers in [1, 2]:
+                docked_molecules_path = os.path.join(docked_molecules_directory, 'docked-{}.sdf'.format(n_workers))
+                hybrid.hybrid_docking(receptor_path, molecules_path, docked_molecules_path, n_workers=n_workers,
+                                      chunk=2)
+                molecules = list(oechem.oemolistream(docked_molecules_path).GetOEGraphMols())
+                titles.append([molecule.GetTitle() for molecule in molecules])
+                # every docked molecule carries its score
+                sdtag = oedocking.OEDockMethodGetName(oedocking.OEDockMethod_Hybrid2)
+                self.assertTrue(all(oechem.OEHasSDData(molecule, sdtag) for molecule in molecules))
+            # docked molecules are written in the input order
+            self.assertEqual(titles[0], titles[1])
+
+    def test_invalid_workers(self):
+        "Test that hybrid docking needs at least one worker"
+        from kinomodel.docking import hybrid
+
+        for n_workers in [0, -1]:
+            with self.assertRaises(ValueError):
+                hybrid.hybrid_docking('receptor.pdb', 'molecules.smi', 'docked.sdf', n_workers=n_workers)
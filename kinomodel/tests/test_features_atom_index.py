@@ -0,0 +1,97 @@
+"""
+Test the persisted map from KLIFS numbering to feature atom indices
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import unittest.mock
+import tempfile
+import os
+import numpy as np
+
+
+class AtomIndexTestCase(unittest.TestCase):
+
+    def test_load_atom_index(self):
+        import mdtraj as md
+        from kinomodel.features.atom_index import AtomIndexCache, load_atom_index, resolve_atom_index, topology_hash
+        from kinomodel.features.protein import resolve_protein_feature_atoms
+        from kinomodel.features.trajectory import iter_interaction_features, iter_protein_features
+        from kinomodel.instrumentation import recording
+
+        pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        topology = md.load_topology(pdb)
+        # the first KLIFS pocket residue on chain A is unresolved (residues 275-278)
+        numbering = list(range(255, 275)) + [0] + list(range(279, 343))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AtomIndexCache(root=directory)
+            index = load_atom_index(pdb, 'A', numbering, structure_id=1, cache=cache)
+            for name, expected in zip(['dih', 'dis', 'dih_missing', 'dis_missing'],
+                                      resolve_protein_feature_atoms(topology, 'A', numbering)):
+                self.assertTrue(np.array_equal(index[name], expected))
+            self.assertEqual(index['pocket_atoms'].shape, (85,))
+            self.assertEqual(index['pocket_missing'].nonzero()[0].tolist(), [20])
+            self.assertEqual(topology.atom(int(index['pocket_atoms'][0])).residue.resSeq, 255)
+
+            # later calls load the stored indices without resolving them again
+            stored = cache.get(topology_hash(pdb), 'A', 1)
+            self.assertTrue(np.array_equal(stored['dih'], index['dih']))
+            shifted = dict(stored, dis=stored['dis'] + 1)
+            cache.put(topology_hash(pdb), 'A', 1, shifted)
+            self.assertTrue(np.array_equal(load_atom_index(pdb, 'A', numbering, structure_id=1, cache=cache)['dis'],
+                                           index['dis'] + 1))
+            # another chain or KLIFS structure is a different entry
+            self.assertIsNone(cache.get(topology_hash(pdb), 'B', 1))
+            self.assertTrue(np.array_equal(load_atom_index(pdb, 'A', numbering, structure_id=2, cache=cache)['dis'],
+                                           index['dis']))
+
+            # a trajectory with a separate topology file shares the entries of that topology
+            traj = md.load(pdb)
+            dcd = os.path.join(directory, 'traj.dcd')
+            md.join([traj, traj]).save_dcd(dcd)
+            cache.put(topology_hash(pdb), 'A', 3, resolve_atom_index(topology, 'A', numbering))
+            n_files = sum(len(files) for _, _, files in os.walk(directory))
+            with recording() as recorder:
+                chunks = list(iter_protein_features(dcd, 'A', numbering, top=pdb, structure_id=3, index_cache=cache))
+            self.assertEqual(chunks[0][0].shape, (2, 8))
+            self.assertTrue(np.allclose(chunks[0][0], md.compute_dihedrals(md.join([traj, traj]), index['dih']),
+                                        atol=1e-4))
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(directory)), n_files)
+            # with known atom indices, the topology file is not parsed
+            self.assertNotIn('topology.parse', recorder.summary())
+
+            # interaction atoms are stored with the ligand, and read back without parsing the topology
+            interactions = list(iter_interaction_features(dcd, 'A', 'NIL', numbering, top=pdb, structure_id=3,
+                                                          index_cache=cache))
+            stored = cache.get(topology_hash(pdb), 'A', 3, ligand_name='NIL')
+            self.assertEqual({topology.atom(int(i)).residue.name for i in stored['ligand_atoms']}, {'NIL'})
+            with recording() as recorder:
+                cached = list(iter_interaction_features(dcd, 'A', 'NIL', numbering, top=pdb, structure_id=3,
+                                                        index_cache=cache))
+            self.assertNotIn('topology.parse', recorder.summary())
+            self.assertTrue(np.allclose(cached[0]['mean'], interactions[0]['mean']))
+
+            # the stored indices depend on the definition of the features
+            with unittest.mock.patch('kinomodel.features.protein.DISTANCE_ATOMS', []):
+                self.assertIsNone(cache.get(topology_hash(pdb), 'A', 3))
+
+    def test_evict(self):
+        from kinomodel.features.atom_index import AtomIndexCache
+
+        index = {'dih': np.arange(16, dtype=np.int64)}
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AtomIndexCache(root=directory)
+            cache.put('abcdef', 'A', 1, index)
+            size = cache.size()
+            cache.max_size = 2 * size
+            first = cache.path('abcdef', 'A', 1)
+            os.utime(first, (0, 0))
+            cache.put('abcdef', 'A', 2, index)
+            os.utime(cache.path('abcdef', 'A', 2), (1, 1))
+            # reading the first entry makes the second one the least recently used
+            self.assertIsNotNone(cache.get('abcdef', 'A', 1))
+            cache.put('abcdef', 'A', 3, index)
+            self.assertIsNotNone(cache.get('abcdef', 'A', 1))
+            self.assertIsNone(cache.get('abcdef', 'A', 2))
+            self.assertIsNotNone(cache.get('abcdef', 'A', 3))
+            self.assertEqual(cache.size(), 2 * size)
@@ -0,0 +1,78 @@
+"""
+Test the batch featurization driver
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import json
+import os
+
+
+class BatchFeaturizeTestCase(unittest.TestCase):
+
+    def test_read_jobs(self):
+        from kinomodel.features.batch import read_jobs
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv = os.path.join(directory, 'jobs.csv')
+            with open(csv, 'w') as outfile:
+                outfile.write('pdb,chain,coord\n3pp0,A,pdb\n# a comment\n3RCD,B,\n')
+            tsv = os.path.join(directory, 'jobs.tsv')
+            with open(tsv, 'w') as outfile:
+                outfile.write('3pp0\tA\n3RCD\tB\tdcd\n')
+            self.assertEqual(read_jobs(csv), [{'pdb': '3PP0', 'chain': 'A', 'coord': 'pdb'},
+                                              {'pdb': '3RCD', 'chain': 'B', 'coord': 'pdb'}])
+            self.assertEqual(read_jobs(tsv)[1], {'pdb': '3RCD', 'chain': 'B', 'coord': 'dcd'})
+        self.assertEqual(read_jobs([('1m17', 'A'), {'pdb': '3pp0', 'chain': 'A'}])[0]['pdb'], '1M17')
+        with self.assertRaises(ValueError):
+            read_jobs([('3PP0',)])
+
+    def test_batch_featurize(self):
+        from kinomodel.features.batch import batch_featurize, read_results, featurize_job
+        from kinomodel.features.store import read_features
+        from kinomodel.features.klifs_cache import KlifsCache, set_klifs_cache
+        from kinomodel.structures import StructureCache, set_structure_cache
+
+        with tempfile.TemporaryDirectory() as directory:
+            # offline caches holding Abl:nilotinib (PDBID:3CS9); nothing answers on the server port
+            klifs = KlifsCache(path=os.path.join(directory, 'klifs.sqlite'), base_url='http://127.0.0.1:9', timeout=1)
+            record = {'structure_ID': 1, 'kinase_ID': 392, 'pdb': '3cs9', 'chain': 'A', 'kinase': 'ABL1',
+                      'pocket': 'K' * 85, 'ligand': 'NIL'}
+            with klifs._db() as db:
+                db.execute('INSERT INTO entries VALUES (?, ?)', ('3CS9', 4e9))
+                db.execute('INSERT INTO structures VALUES (?, ?, ?, ?)', (1, '3CS9', 'A', json.dumps(record)))
+                db.execute('INSERT INTO numberings VALUES (?, ?, ?)',
+                           (1, json.dumps(list(range(255, 275)) + [-1] + list(range(279, 343))), 4e9))
+            structures = StructureCache(root=os.path.join(directory, 'structures'), base_url='http://127.0.0.1:9',
+                                        timeout=1)
+            with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb'), 'rb') as infile:
+                structures.store('3CS9', 'pdb', infile.read())
+            set_klifs_cache(klifs)
+            set_structure_cache(structures)
+            try:
+                output = os.path.join(directory, 'results.jsonl')
+                jobs = [('3CS9', 'A'), ('3CS9', 'Z'), ('0BAD', 'A')]
+                store = os.path.join(directory, 'features')
+                summary = batch_featurize(jobs, output, feature='both', n_workers=2, store=store)
+                self.assertEqual(summary, {'done': 1, 'failed': 2, 'skipped': 0})
+
+                results = {(result['pdb'], result['chain']): result for result in read_results(output)}
+                self.assertEqual(results['3CS9', 'A'], featurize_job({'pdb': '3CS9', 'chain': 'A', 'coord': 'pdb'},
+                                                                     feature='both'))
+                self.assertEqual(len(results['3CS9', 'A']['dihedrals'][0]), 8)
+                self.assertEqual(len(results['3CS9', 'A']['mean_dist']), 1)
+                self.assertIn('ValueError', results['3CS9', 'Z']['error'])
+                self.assertEqual(results['0BAD', 'A']['status'], 'failed')
+                features = read_features(store)
+                self.assertEqual(features[['pdb', 'chain', 'kinase', 'ligand']].values.tolist(),
+                                 [['3CS9', 'A', 'ABL1', 'NIL']])
+                self.assertAlmostEqual(features['mean_dist'][0], results['3CS9', 'A']['mean_dist'][0], places=5)
+
+                # completed jobs are skipped, failed jobs are attempted again
+                summary = batch_featurize(jobs, output, feature='both', n_workers=2, prefetch_data=False)
+                self.assertEqual(summary, {'done': 0, 'failed': 2, 'skipped': 1})
+                self.assertEqual(len(read_results(output)), 3)
+            finally:
+                set_klifs_cache(None)
+                set_structure_cache(None)
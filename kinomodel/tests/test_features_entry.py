@@ -0,0 +1,69 @@
+"""
+Test featurization of all kinase chains of a PDB entry at once
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import json
+import os
+import numpy as np
+
+
+class EntryFeaturesTestCase(unittest.TestCase):
+
+    def test_featurize_entry(self):
+        from kinomodel.features.entry import featurize_entry
+        from kinomodel.features.protein import compute_simple_protein_features
+        from kinomodel.features.interactions import compute_simple_interaction_features
+        from kinomodel.features.store import read_features
+        from kinomodel.features.klifs_cache import KlifsCache
+        from kinomodel.structures import StructureCache, set_structure_cache
+
+        pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        with tempfile.TemporaryDirectory() as directory:
+            # offline caches holding three chains of Abl:nilotinib (PDBID:3CS9), chain C being apo
+            klifs = KlifsCache(path=os.path.join(directory, 'klifs.sqlite'), base_url='http://127.0.0.1:9', timeout=1)
+            numbering = list(range(255, 275)) + [-1] + list(range(279, 343))
+            with klifs._db() as db:
+                db.execute('INSERT INTO entries VALUES (?, ?)', ('3CS9', 4e9))
+                for structure_id, chain, ligand in [(1, 'A', 'NIL'), (2, 'B', 'NIL'), (3, 'C', 0)]:
+                    record = {'structure_ID': structure_id, 'kinase_ID': 392, 'pdb': '3cs9', 'chain': chain,
+                              'kinase': 'ABL1', 'pocket': 'K' * 85, 'ligand': ligand}
+                    db.execute('INSERT INTO structures VALUES (?, ?, ?, ?)',
+                               (structure_id, '3CS9', chain, json.dumps(record)))
+                    db.execute('INSERT INTO numberings VALUES (?, ?, ?)', (structure_id, json.dumps(numbering), 4e9))
+            structures = StructureCache(root=os.path.join(directory, 'structures'), base_url='http://127.0.0.1:9',
+                                        timeout=1)
+            with open(pdb, 'rb') as infile:
+                structures.store('3CS9', 'pdb', infile.read())
+            set_structure_cache(structures)
+            try:
+                store = os.path.join(directory, 'features')
+                features = featurize_entry('3CS9', feature='both', store=store, cache=klifs)
+                self.assertEqual([info.chain for info in features['klifs']], ['A', 'B', 'C'])
+                self.assertEqual(features['dihedrals'].shape, (3, 1, 8))
+                self.assertEqual(features['distances'].shape, (3, 1, 5))
+                self.assertEqual(features['mean_dist'].shape, (3, 1))
+                self.assertTrue(np.isnan(features['mean_dist'][2]).all())
+
+                # the same features as chain by chain featurization
+                numbering = [resid if resid > 0 else 0 for resid in numbering]
+                for i, chain in enumerate('ABC'):
+                    dihedrals, distances = compute_simple_protein_features('3CS9', chain, pdb, numbering)
+                    self.assertTrue(np.allclose(features['dihedrals'][i], dihedrals))
+                    self.assertTrue(np.allclose(features['distances'][i], distances))
+                for i, chain in enumerate('AB'):
+                    mean_dist = compute_simple_interaction_features('3CS9', chain, pdb, 'NIL', numbering)
+                    self.assertTrue(np.allclose(features['mean_dist'][i], mean_dist))
+
+                self.assertEqual(read_features(store)[['chain', 'structure_id']].values.tolist(),
+                                 [['A', 1], ['B', 2], ['C', 3]])
+
+                # a subset of the chains
+                features = featurize_entry('3CS9', chains=['B'], cache=klifs)
+                self.assertEqual(features['dihedrals'].shape, (1, 1, 8))
+                with self.assertRaises(ValueError):
+                    featurize_entry('3CS9', chains=['Z'], cache=klifs)
+            finally:
+                set_structure_cache(None)
@@ -66,3 +66,33 @@ class KinomodelTestCase(unittest.TestCase):
             round(
                 np.asscalar(distances[0][0]), 7),
             0.3558538)  # the first distance value
+
+    def test_resolve_protein_feature_atoms(self):
+        # absolute import (with kinomodel installed)
+        from kinomodel.features.protein import resolve_protein_feature_atoms
+        from kinomodel.tests.utils import PDB_3CS9, numbering_3cs9
+        import mdtraj as md
+
+        # Abl:nilotinib (PDBID:3CS9) with the KLIFS positions used by the features mapped onto chain A
+        topology = md.load(PDB_3CS9).topology
+        numbering = numbering_3cs9()
+
+        dih, dis, dih_missing, dis_missing = resolve_protein_feature_atoms(topology, 'A', numbering)
+        self.assertEqual(dih.shape, (8, 4))
+        self.assertEqual(dis.shape, (5, 2))
+        # residues 275-278 are not resolved, so the aC-aE dihedral cannot be computed
+        self.assertEqual(dih_missing[0].tolist(), [True, False, False, False])
+        self.assertFalse(dih_missing[1:].any() or dis_missing.any())
+        self.assertFalse(dih[0].any())
+        # DFG-Phe Chi and the K-E salt bridge
+        self.assertEqual([(topology.atom(i).residue.resSeq, topology.atom(i).name) for i in dih[7]],
+                         [(382, 'N'), (382, 'CA'), (382, 'CB'), (382, 'CG')])
+        self.assertEqual([(topology.atom(i).residue.resSeq, topology.atom(i).name) for i in dis[0]],
+                         [(271, 'NZ'), (286, 'OE1')])
+
+        # a gap at the DFG-Phe removes every feature involving it
+        numbering[81] = 0
+        dih, dis, dih_missing, dis_missing = resolve_protein_feature_atoms(topology, 'A', numbering)
+        self.assertEqual(dih_missing.any(axis=1).tolist(), [True, False, False, False, True, True, True, True])
+        self.assertEqual(dis_missing.any(axis=1).tolist(), [False, False, True, True, False])
+        self.assertFalse(dih[4:].any() or dis[2:4].any())
@@ -0,0 +1,84 @@
+"""
+Test the featurization service
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import threading
+import json
+import os
+import numpy as np
+
+
+class ServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from kinomodel.features.klifs_cache import KlifsCache
+        from kinomodel.structures import StructureCache, set_structure_cache
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        # offline caches holding chain A of Abl:nilotinib (PDBID:3CS9)
+        self.klifs = KlifsCache(path=os.path.join(self.directory.name, 'klifs.sqlite'), base_url='http://127.0.0.1:9',
+                                timeout=1)
+        self.numbering = list(range(255, 275)) + [-1] + list(range(279, 343))
+        record = {'structure_ID': 1, 'kinase_ID': 392, 'pdb': '3cs9', 'chain': 'A', 'kinase': 'ABL1',
+                  'pocket': 'K' * 85, 'ligand': 'NIL'}
+        with self.klifs._db() as db:
+            db.execute('INSERT INTO entries VALUES (?, ?)', ('3CS9', 4e9))
+            db.execute('INSERT INTO structures VALUES (?, ?, ?, ?)', (1, '3CS9', 'A', json.dumps(record)))
+            db.execute('INSERT INTO numberings VALUES (?, ?, ?)', (1, json.dumps(self.numbering), 4e9))
+        structures = StructureCache(root=os.path.join(self.directory.name, 'structures'),
+                                    base_url='http://127.0.0.1:9', timeout=1)
+        with open(self.pdb, 'rb') as infile:
+            structures.store('3CS9', 'pdb', infile.read())
+        set_structure_cache(structures)
+
+    def tearDown(self):
+        from kinomodel.structures import set_structure_cache
+
+        set_structure_cache(None)
+        self.directory.cleanup()
+
+    def test_service(self):
+        from kinomodel.features.service import FeaturizationService, ServiceClient, create_server
+        from kinomodel.features.protein import compute_simple_protein_features
+        from kinomodel.features.interactions import compute_simple_interaction_features
+        from kinomodel.features.store import read_features
+
+        service = FeaturizationService(max_structures=1, klifs_cache=self.klifs)
+        address = os.path.join(self.directory.name, 'kinomodel.sock')
+        server = create_server(address, service)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = ServiceClient(address, timeout=60)
+            self.assertEqual(client.request('ping'), 'pong')
+            store = os.path.join(self.directory.name, 'features')
+            key_res, dihedrals, distances, mean_dist = client.featurize(pdb='3CS9', chain='A', feature='both',
+                                                                        coord='pdb', store=store)
+            numbering = [resid if resid > 0 else 0 for resid in self.numbering]
+            expected_dihedrals, expected_distances = compute_simple_protein_features('3CS9', 'A', self.pdb, numbering)
+            self.assertTrue(np.allclose(dihedrals, expected_dihedrals))
+            self.assertTrue(np.allclose(distances, expected_distances))
+            self.assertTrue(np.allclose(mean_dist, compute_simple_interaction_features('3CS9', 'A', self.pdb, 'NIL',
+                                                                                       numbering)))
+            self.assertEqual(len(read_features(store)), 1)
+
+            # the second request is answered from the caches of the service
+            self.assertTrue(np.allclose(client.featurize(pdb='3CS9', chain='A', feature='interact', coord='pdb'),
+                                        mean_dist))
+            stats = client.stats()
+            self.assertEqual(stats['klifs'], {'size': 1, 'max_size': 4096, 'hits': 1, 'misses': 1})
+            self.assertEqual((stats['structures']['size'], stats['structures']['hits']), (1, 1))
+            self.assertEqual(stats['indices']['size'], 2)
+
+            # a structure file given by path
+            self.assertEqual(len(client.featurize(pdb='3CS9', chain='A', feature='conf', coord=self.pdb)[1]), 1)
+            with self.assertRaises(ValueError):
+                client.featurize(pdb='3CS9', chain='Z', feature='conf', coord='pdb')
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
@@ -0,0 +1,46 @@
+"""
+Test the columnar feature store
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import os
+import numpy as np
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+
+    def test_append_and_read(self):
+        from kinomodel.features.protein import dih_names, dis_names
+        from kinomodel.features.store import FeatureStore, read_features
+
+        random = np.random.RandomState(0)
+        dihedrals, distances = random.uniform(-np.pi, np.pi, (5, 8)), random.uniform(0, 3, (5, 5))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'features')
+            with FeatureStore(path) as store:
+                # a trajectory appended in two chunks, with KLIFS metadata
+                store.append('3pp0', 'A', dihedrals[:3], distances[:3], kinase_id=407, kinase='ErbB2',
+                             structure_id=4820, ligand='03Q')
+                store.append('3pp0', 'A', dihedrals[3:], distances[3:], kinase_id=407, kinase='ErbB2',
+                             structure_id=4820, ligand='03Q', first_frame=3)
+                # nothing is visible before the session is closed
+                self.assertEqual(len(read_features(path)), 0)
+            with FeatureStore(path, compression='snappy') as store:
+                store.append('1M17', 'A', mean_dist=[0.9, 1.1], kinase_id=406, kinase='EGFR', structure_id=873)
+            with self.assertRaises(ValueError):
+                FeatureStore(path).append('1M17', 'A')
+
+            features = read_features(path)
+            self.assertEqual(len(features), 7)
+            self.assertEqual(list(features.columns[7:]), dih_names + dis_names + ['mean_dist'])
+            self.assertEqual(features['frame'].tolist(), [0, 1, 2, 3, 4, 0, 1])
+            self.assertTrue(np.allclose(features[dih_names].values[:5], dihedrals))
+            self.assertTrue(np.isnan(features['fret'].values[5:]).all())
+            self.assertTrue(features['ligand'].isnull().values[5:].all())
+
+            # selected columns and rows
+            features = FeatureStore(path).read(columns=['frame', 'K_E1'], filters=[('pdb', '=', '3PP0')])
+            self.assertEqual(list(features.columns), ['frame', 'K_E1'])
+            self.assertTrue(np.allclose(features['K_E1'], distances[:, 0]))
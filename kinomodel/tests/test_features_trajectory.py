@@ -0,0 +1,94 @@
+"""
+Test featurization of trajectories streamed in chunks
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import os
+import numpy as np
+
+
+class TrajectoryFeaturesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import mdtraj as md
+
+        # a 5-frame trajectory of Abl:nilotinib (PDBID:3CS9) with perturbed coordinates
+        self.pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        structure = md.load(self.pdb)
+        self.traj = md.join([structure] * 5)
+        self.traj.xyz += np.random.RandomState(0).normal(scale=0.01, size=self.traj.xyz.shape).astype(np.float32)
+        # the first KLIFS pocket residue on chain A is unresolved (residues 275-278)
+        self.numbering = list(range(255, 275)) + [0] + list(range(279, 343))
+
+    def test_protein_features(self):
+        import mdtraj as md
+        from kinomodel.features.protein import resolve_protein_feature_atoms, compute_simple_protein_features
+        from kinomodel.features.trajectory import iter_protein_features
+
+        dih, dis, _, _ = resolve_protein_feature_atoms(self.traj.topology, 'A', self.numbering)
+        chunks = list(iter_protein_features(self.traj, 'A', self.numbering, chunk=2))
+        self.assertEqual([len(dihedrals) for dihedrals, _ in chunks], [2, 2, 1])
+        self.assertTrue(np.allclose(np.concatenate([dihedrals for dihedrals, _ in chunks]),
+                                    md.compute_dihedrals(self.traj, dih)))
+        self.assertTrue(np.allclose(np.concatenate([distances for _, distances in chunks]),
+                                    md.compute_distances(self.traj, dis)))
+
+        # a trajectory file with a separate topology gives the same features
+        with tempfile.TemporaryDirectory() as directory:
+            dcd = os.path.join(directory, 'traj.dcd')
+            self.traj.save_dcd(dcd)
+            dihedrals, distances = compute_simple_protein_features('3CS9', 'A', dcd, self.numbering, top=self.pdb,
+                                                                   chunk=3)
+        self.assertEqual(dihedrals.shape, (5, 8))
+        self.assertTrue(np.allclose(distances, md.compute_distances(self.traj, dis), atol=1e-5))
+
+    def test_interaction_features(self):
+        import mdtraj as md
+        from kinomodel.features.interactions import resolve_interaction_atoms, compute_simple_interaction_features
+        from kinomodel.features.trajectory import iter_interaction_features
+
+        ligand_atoms, pocket_atoms, pocket_missing = resolve_interaction_atoms(self.traj.topology, 'A', 'NIL',
+                                                                               self.numbering)
+        self.assertEqual(pocket_missing.tolist(), [resid == 0 for resid in self.numbering])
+        self.assertEqual({self.traj.topology.atom(i).residue.name for i in ligand_atoms}, {'NIL'})
+        pairs = np.array([(i, j) for i in ligand_atoms for j in pocket_atoms[~pocket_missing]])
+        distances = md.compute_distances(self.traj, pairs).reshape(5, len(ligand_atoms), -1)
+
+        features = list(iter_interaction_features(self.traj, 'A', 'NIL', self.numbering, chunk=2,
+                                                  statistics=['mean', 'min', 'per_residue', 'contacts'],
+                                                  contact_cutoff=0.6))
+        self.assertEqual([len(chunk['mean']) for chunk in features], [2, 2, 1])
+        self.assertTrue(np.allclose(np.concatenate([chunk['mean'] for chunk in features]),
+                                    distances.mean(axis=(1, 2))))
+        self.assertTrue(np.allclose(np.concatenate([chunk['min'] for chunk in features]),
+                                    distances.min(axis=(1, 2))))
+        self.assertEqual(np.concatenate([chunk['contacts'] for chunk in features]).tolist(),
+                         (distances < 0.6).sum(axis=(1, 2)).tolist())
+        per_residue = np.concatenate([chunk['per_residue'] for chunk in features])
+        self.assertEqual(per_residue.shape, (5, 85))
+        self.assertTrue(np.isnan(per_residue[:, pocket_missing]).all())
+
+        # missing pocket residues count as zero distances in the mean ligand-pocket distance
+        mean_dist = compute_simple_interaction_features('3CS9', 'A', self.traj, 'NIL', self.numbering, chunk=2)
+        self.assertTrue(np.allclose(mean_dist, distances.sum(axis=(1, 2)) / (85 * len(ligand_atoms))))
+
+    def test_triclinic_box(self):
+        import mdtraj as md
+        from kinomodel.features.interactions import resolve_interaction_atoms
+        from kinomodel.features.trajectory import iter_interaction_features
+
+        # a truncated octahedron smaller than the complex, so that periodic images are closer than the atoms
+        traj = self.traj[:2]
+        box = np.array(md.utils.lengths_and_angles_to_box_vectors(4.0, 4.0, 4.0, 70.53, 109.47, 70.53))
+        traj.unitcell_vectors = np.tile(box, (traj.n_frames, 1, 1)).astype(np.float32)
+        ligand_atoms, pocket_atoms, pocket_missing = resolve_interaction_atoms(traj.topology, 'A', 'NIL',
+                                                                               self.numbering)
+        pairs = np.array([(i, j) for i in ligand_atoms for j in pocket_atoms[~pocket_missing]])
+        distances = md.compute_distances(traj, pairs).reshape(2, len(ligand_atoms), -1)
+
+        features = next(iter_interaction_features(traj, 'A', 'NIL', self.numbering, statistics=['mean', 'min']))
+        self.assertTrue(np.allclose(features['mean'], distances.mean(axis=(1, 2)), atol=1e-5))
+        self.assertTrue(np.allclose(features['min'], distances.min(axis=(1, 2)), atol=1e-5))
+        self.assertFalse(np.allclose(features['mean'], md.compute_distances(traj, pairs, periodic=False).mean(axis=1)))
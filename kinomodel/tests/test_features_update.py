@@ -0,0 +1,150 @@
+"""
+Test incremental updates of a kinome-wide feature database
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import json
+import os
+
+
+class FeatureDatabaseTestCase(unittest.TestCase):
+
+    def test_list_structures(self):
+        from http.server import BaseHTTPRequestHandler
+        from kinomodel.features.klifs_cache import KlifsCache
+        from kinomodel.tests.utils import LocalServer
+
+        # a local stand-in for the KLIFS API
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                if self.path == '/api/kinase_names':
+                    body = [{'kinase_ID': 392, 'name': 'ABL1'}, {'kinase_ID': 1, 'name': 'AAK1'}]
+                else:
+                    kinase_ids = self.path.split('=')[1].split(',')
+                    body = [{'structure_ID': 7 - int(kinase_id) // 100, 'kinase_ID': int(kinase_id), 'pdb': '3cs9',
+                             'chain': 'A', 'ligand': 'NIL'} for kinase_id in kinase_ids if kinase_id == '392']
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+
+        with LocalServer(Handler) as server, tempfile.TemporaryDirectory() as directory:
+            cache = KlifsCache(path=os.path.join(directory, 'klifs.sqlite'), base_url=server.url)
+            records = cache.list_structures(batch_size=1)
+            self.assertEqual([record['structure_ID'] for record in records], [4])
+            self.assertEqual(requests, ['/api/kinase_names', '/api/structures_list?kinase_ID=1',
+                                        '/api/structures_list?kinase_ID=392'])
+            # the records are cached for later queries by PDB code
+            self.assertEqual(cache.structures('3CS9'), records)
+
+    def _offline_caches(self, directory):
+        """Return a KLIFS cache and make the default structure cache hold Abl:nilotinib (PDBID:3CS9), offline."""
+        from kinomodel.features.klifs_cache import KlifsCache
+        from kinomodel.structures import StructureCache, set_structure_cache
+
+        # nothing answers on the server port
+        klifs = KlifsCache(path=os.path.join(directory, 'klifs.sqlite'), base_url='http://127.0.0.1:9', timeout=1)
+        numbering = list(range(255, 275)) + [-1] + list(range(279, 343))
+        with klifs._db() as db:
+            for structure_id in [1, 2, 3]:
+                db.execute('INSERT INTO numberings VALUES (?, ?, ?)', (structure_id, json.dumps(numbering), 4e9))
+        structures = StructureCache(root=os.path.join(directory, 'structures'), base_url='http://127.0.0.1:9',
+                                    timeout=1)
+        with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb'), 'rb') as infile:
+            structures.store('3CS9', 'pdb', infile.read())
+        set_structure_cache(structures)
+        self.addCleanup(set_structure_cache, None)
+
+        return klifs
+
+    @staticmethod
+    def _record(structure_id, chain, ligand='NIL', pdb='3cs9'):
+        return {'structure_ID': structure_id, 'kinase_ID': 392, 'kinase': 'ABL1', 'pdb': pdb, 'chain': chain,
+                'alt': '', 'pocket': 'K' * 85, 'ligand': ligand}
+
+    def test_update(self):
+        from kinomodel.features.update import FeatureDatabase
+
+        record = self._record
+        with tempfile.TemporaryDirectory() as directory:
+            klifs = self._offline_caches(directory)
+            database = FeatureDatabase(os.path.join(directory, 'features'))
+            records = [record(1, 'A'), record(2, 'B'), record(4, 'A', pdb='0bad')]
+            summary = database.update(records, n_workers=1, cache=klifs)
+            self.assertEqual(summary, {'added': 3, 'changed': 0, 'incomplete': 0, 'removed': 0, 'unchanged': 0,
+                                       'retried': 0, 'failed': 1})
+            features = database.read(columns=['structure_id', 'chain', 'mean_dist'])
+            self.assertEqual(features[['structure_id', 'chain']].values.tolist(), [[1, 'A'], [2, 'B']])
+            self.assertEqual(database.catalog()[4]['status'], 'failed')
+
+            # nothing changed in KLIFS: only the failed structure is attempted again
+            summary = database.update(records, n_workers=1, cache=klifs)
+            self.assertEqual(summary, {'added': 0, 'changed': 0, 'incomplete': 0, 'removed': 0, 'unchanged': 2,
+                                       'retried': 1, 'failed': 1})
+
+            # structure 1 is removed, 2 changed (now apo) and 3 added
+            records = [record(2, 'B', ligand=0), record(3, 'C')]
+            self.assertEqual(database.diff(records), {'added': [3], 'changed': [2], 'failed': [], 'incomplete': [],
+                                                      'removed': [1, 4], 'unchanged': []})
+            summary = database.update(records, n_workers=1, cache=klifs)
+            self.assertEqual(summary, {'added': 1, 'changed': 1, 'incomplete': 0, 'removed': 2, 'unchanged': 0,
+                                       'retried': 0, 'failed': 0})
+            features = database.read()
+            self.assertEqual(features[['structure_id', 'chain']].values.tolist(), [[2, 'B'], [3, 'C']])
+            self.assertTrue(features['mean_dist'].isna()[0])
+            self.assertEqual(len(database.read(filters=[('chain', '=', 'C')])), 1)
+            self.assertEqual(database.catalog()[1]['status'], 'removed')
+
+            # an update limited to other kinases leaves the structures of Abl in place
+            self.assertEqual(database.catalog()[3]['kinase_id'], 392)
+            self.assertEqual(database.diff([], kinase_ids=[1])['removed'], [])
+            self.assertEqual(database.diff([], kinase_ids=[392])['removed'], [2, 3])
+            summary = database.update([], kinase_ids=[1], n_workers=1, cache=klifs)
+            self.assertEqual(summary['removed'], 0)
+            self.assertEqual(len(database.read()), 2)
+
+    def test_update_feature(self):
+        from kinomodel.features.protein import dih_names
+        from kinomodel.features.update import FeatureDatabase
+
+        with tempfile.TemporaryDirectory() as directory:
+            klifs = self._offline_caches(directory)
+            database = FeatureDatabase(os.path.join(directory, 'features'))
+            records = [self._record(1, 'A'), self._record(2, 'B', ligand=0)]
+            database.update(records, feature='conf', n_workers=1, cache=klifs)
+            self.assertTrue(database.read()['mean_dist'].isna().all())
+            self.assertEqual(database.catalog()[1]['feature'], 'conf')
+            self.assertEqual(database.diff(records, feature='conf')['unchanged'], [1, 2])
+
+            # the interaction features were not computed, so the structures are featurized again
+            self.assertEqual(database.diff(records, feature='both')['incomplete'], [1, 2])
+            summary = database.update(records, feature='both', n_workers=1, cache=klifs)
+            self.assertEqual((summary['incomplete'], summary['unchanged'], summary['failed']), (2, 0, 0))
+            features = database.read()
+            self.assertEqual(features['structure_id'].tolist(), [1, 2])
+            self.assertFalse(features['mean_dist'].isna()[0])
+            self.assertFalse(features[dih_names].isna().any().any())
+            self.assertEqual(database.catalog()[1]['feature'], 'both')
+
+            # an update with fewer features has nothing to do
+            summary = database.update(records, feature='conf', n_workers=1, cache=klifs)
+            self.assertEqual(summary['unchanged'], 2)
+
+    def test_catalog_migration(self):
+        import sqlite3
+        from kinomodel.features.update import FeatureDatabase
+
+        with tempfile.TemporaryDirectory() as directory:
+            # a catalog written before the kinase and the choice of features were recorded
+            with sqlite3.connect(os.path.join(directory, 'catalog.sqlite')) as db:
+                db.execute('CREATE TABLE structures (structure_id INTEGER PRIMARY KEY, pdb TEXT, chain TEXT, '
+                           'fingerprint TEXT, status TEXT, part TEXT, updated REAL, error TEXT)')
+                db.execute("INSERT INTO structures VALUES (1, '3CS9', 'A', 'x', 'ok', 'part', 0, NULL)")
+            database = FeatureDatabase(directory)
+            entry = database.catalog()[1]
+            self.assertIsNone(entry['kinase_id'])
+            self.assertIsNone(entry['feature'])
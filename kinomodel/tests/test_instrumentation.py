@@ -0,0 +1,95 @@
+"""
+Test the recording of stage timings and profiles
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import unittest.mock
+import tempfile
+import json
+import os
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def test_recording(self):
+        from kinomodel.instrumentation import stage, recording, instrumented, get_recorder, read_events
+        from kinomodel.utils import atomic_write
+
+        # nothing is recorded by default
+        with stage('network.fetch') as fetch:
+            fetch.add_bytes(10)
+        self.assertIsNone(get_recorder())
+
+        @instrumented('docking')
+        def dock(n):
+            return n + 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stages.jsonl')
+            with recording(path) as recorder:
+                with stage('network.fetch', 5, url='https://files.rcsb.org/download/3PP0.pdb') as fetch:
+                    fetch.add_bytes(10)
+                self.assertEqual(dock(1), 2)
+                atomic_write(os.path.join(directory, 'file'), b'contents')
+            self.assertIsNone(get_recorder())
+
+            summary = recorder.summary()
+            self.assertEqual(sorted(summary), ['docking', 'file.write', 'network.fetch'])
+            self.assertEqual(summary['network.fetch']['bytes'], 15)
+            self.assertEqual(summary['file.write']['bytes'], 8)
+            self.assertEqual(summary['docking']['count'], 1)
+            events = read_events(path)
+            self.assertEqual(events, recorder.events)
+            self.assertEqual(events[0]['url'], 'https://files.rcsb.org/download/3PP0.pdb')
+            self.assertEqual(events[1]['function'], 'InstrumentationTestCase.test_recording.<locals>.dock')
+
+    def test_featurization_stages(self):
+        from kinomodel.instrumentation import recording
+        from kinomodel.features.protein import compute_simple_protein_features
+        from kinomodel.features.interactions import compute_simple_interaction_features
+        from kinomodel.features.atom_index import AtomIndexCache, set_atom_index_cache
+        from kinomodel.structures import set_parsed_structure_cache
+        from kinomodel.utils import LRUCache
+
+        pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        numbering = list(range(255, 275)) + [0] + list(range(279, 343))
+        # fresh caches of parsed structures and atom indices, so that both are computed while recording
+        set_parsed_structure_cache(LRUCache(1))
+        with tempfile.TemporaryDirectory() as directory:
+            set_atom_index_cache(AtomIndexCache(root=directory))
+            try:
+                with recording() as recorder:
+                    compute_simple_protein_features('3CS9', 'A', pdb, numbering)
+                    compute_simple_interaction_features('3CS9', 'A', pdb, 'NIL', numbering)
+            finally:
+                set_parsed_structure_cache(None)
+                set_atom_index_cache(None)
+        summary = recorder.summary()
+        # the structure is parsed once for both features
+        self.assertEqual(summary['topology.parse']['count'], 1)
+        for name in ('index.resolve', 'features.compute', 'interactions.compute'):
+            self.assertGreater(summary[name]['count'], 0, name)
+        self.assertTrue(all(event['wall'] >= 0 for event in recorder.events))
+
+    def test_instrument_run(self):
+        from kinomodel.instrumentation import instrument_run, stage, read_events
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stages.jsonl')
+            environment = {'KINOMODEL_INSTRUMENT': path, 'KINOMODEL_PROFILE': 'cprofile, tracemalloc',
+                           'KINOMODEL_PROFILE_DIR': directory}
+            with unittest.mock.patch.dict(os.environ, environment):
+                with instrument_run('test'):
+                    with stage('klifs.parse'):
+                        sum(range(1000))
+            self.assertEqual([event['stage'] for event in read_events(path)], ['klifs.parse'])
+            prefix = os.path.join(directory, 'test-{}'.format(os.getpid()))
+            self.assertTrue(os.path.exists(prefix + '.prof'))
+            with open(prefix + '.memory.jsonl') as infile:
+                self.assertIn('peak_bytes', json.loads(infile.readline()))
+
+            with unittest.mock.patch.dict(os.environ, {'KINOMODEL_PROFILE': 'perf'}):
+                with self.assertRaises(ValueError):
+                    with instrument_run():
+                        pass
@@ -0,0 +1,43 @@
+"""
+Test the on-disk cache of prepared docking ligands
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import pickle
+import os
+
+
+class LigandCacheTestCase(unittest.TestCase):
+
+    def test_ligand_cache_key(self):
+        from kinomodel.docking.ligand_cache import ligand_cache_key, OMEGA_SETTINGS
+
+        key = ligand_cache_key('c1ccccc1', OMEGA_SETTINGS)
+        self.assertEqual(key, ligand_cache_key('c1ccccc1', dict(reversed(list(OMEGA_SETTINGS.items())))))
+        self.assertNotEqual(key, ligand_cache_key('c1ccncc1', OMEGA_SETTINGS))
+        self.assertNotEqual(key, ligand_cache_key('c1ccccc1', dict(OMEGA_SETTINGS, max_confs=200)))
+
+    def test_shards_and_index(self):
+        from kinomodel.docking.ligand_cache import LigandCache
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = LigandCache(root=directory, shard_size=100)
+            self.assertIsNone(cache.get('a'))
+            cache.put('a', b'x' * 60, smiles='C')
+            cache.put('b', b'y' * 60, smiles='CC')
+            cache.put('c', b'z' * 10)
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'shards'))), 2)
+            self.assertEqual(cache.get('a'), b'x' * 60)
+
+            # the cache is shared across instances and processes
+            for other in [LigandCache(root=directory), pickle.loads(pickle.dumps(cache))]:
+                self.assertEqual(len(other), 3)
+                self.assertEqual(other.get('b'), b'y' * 60)
+                self.assertEqual(other.get('c'), b'z' * 10)
+
+            # records whose shard disappeared are misses
+            for shard in os.listdir(os.path.join(directory, 'shards')):
+                os.remove(os.path.join(directory, 'shards', shard))
+            self.assertIsNone(cache.get('a'))
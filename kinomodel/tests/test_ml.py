@@ -0,0 +1,70 @@
+"""
+Test the streaming dimensionality reduction of kinase features
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import numpy as np
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # two trajectories of a slow and a fast process, in 8 dihedrals and 5 distances
+        random = np.random.RandomState(0)
+        self.trajectories = []
+        for n_frames in [600, 400]:
+            slow = np.cumsum(random.normal(scale=0.05, size=n_frames))
+            dihedrals = np.outer(slow, np.linspace(0.5, 1.5, 8)) + random.normal(scale=0.3, size=(n_frames, 8))
+            distances = 1 + np.outer(np.sin(slow), np.ones(5)) + random.normal(scale=0.1, size=(n_frames, 5))
+            self.trajectories.append((dihedrals, distances))
+
+    def test_pca(self):
+        from kinomodel.ml import encode_features, StreamingPCA
+
+        X = np.concatenate([encode_features(*trajectory) for trajectory in self.trajectories])
+        X[5, 3] = np.nan
+        pca = StreamingPCA(n_components=3).fit(np.array_split(X, 7))
+        self.assertEqual(pca.n_samples_, len(X) - 1)
+        self.assertEqual(pca.n_skipped_, 1)
+
+        complete = X[np.isfinite(X).all(axis=1)]
+        self.assertTrue(np.allclose(pca.mean_, complete.mean(axis=0)))
+        eigenvalues, eigenvectors = np.linalg.eigh(np.cov(complete.T))
+        self.assertTrue(np.allclose(pca.eigenvalues_, eigenvalues[::-1][:3]))
+        self.assertTrue(np.allclose(np.abs(pca.components_), np.abs(eigenvectors[:, ::-1][:, :3])))
+        # projections are computed chunk by chunk
+        Y = np.concatenate(list(pca.iter_transform(np.array_split(complete, 3))))
+        self.assertTrue(np.allclose(Y, (complete - complete.mean(axis=0)).dot(pca.components_)))
+
+    def test_tica(self):
+        from kinomodel.ml import encode_features, iter_store_features, StreamingTICA
+        from kinomodel.features.store import FeatureStore
+
+        lag = 5
+        encoded = [encode_features(*trajectory) for trajectory in self.trajectories]
+        # the whole trajectories in memory
+        reference = StreamingTICA(lag, n_components=2).fit(encoded)
+        # the same trajectories split into chunks, with pairs of frames across chunk boundaries
+        chunked = StreamingTICA(lag, n_components=2).fit(
+            [(i == 0, chunk) for X in encoded for i, chunk in enumerate(np.array_split(X, 9))])
+        self.assertEqual(chunked.n_samples_, sum(len(X) - lag for X in encoded))
+        self.assertTrue(np.allclose(chunked.eigenvalues_, reference.eigenvalues_))
+        self.assertTrue(np.allclose(np.abs(chunked.components_), np.abs(reference.components_)))
+        # the slow process dominates the first component
+        self.assertGreater(reference.eigenvalues_[0], 0.9)
+        self.assertGreater(reference.timescales_[0], reference.timescales_[1])
+
+        # the lagged covariance in the whitened space is diagonalized
+        Y = np.concatenate([reference.transform(X) for X in encoded])
+        self.assertTrue(np.allclose(np.cov(Y.T), np.eye(2), atol=0.05))
+
+        # features read back from a feature store, in batches smaller than the trajectories
+        with tempfile.TemporaryDirectory() as directory:
+            with FeatureStore(directory) as store:
+                for i, (dihedrals, distances) in enumerate(self.trajectories):
+                    store.append('3PP0', 'A' if i == 0 else 'B', dihedrals, distances)
+            stored = StreamingTICA(lag, n_components=2).fit(iter_store_features(directory, batch_size=128))
+        self.assertEqual(stored.n_samples_, chunked.n_samples_)
+        self.assertTrue(np.allclose(stored.eigenvalues_, reference.eigenvalues_, atol=1e-4))
@@ -0,0 +1,108 @@
+"""
+Test the concurrent RCSB search and download pipeline of pdbfinder
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import os
+
+
+class PdbfinderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from http.server import BaseHTTPRequestHandler
+        from kinomodel.tests.utils import LocalServer
+
+        # a local stand-in for the RCSB search and download services
+        self.hits = {'STI': ['1IEP', '3CS9'], 'NIL': ['3CS9', '3CS9'], 'P17948': ['4AGD']}
+        self.requests = []
+        self.failures = {'/4AGD.pdb': 1}
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                query = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                test.requests.append(('POST', query))
+                found = [pdbid for key, pdb_ids in test.hits.items() if key in query for pdbid in pdb_ids]
+                self.respond(200, ''.join(pdbid + '\n' for pdbid in found))
+
+            def do_GET(self):
+                test.requests.append(('GET', self.path))
+                if test.failures.get(self.path):
+                    test.failures[self.path] -= 1
+                    self.respond(503, '')
+                elif self.path == '/0BAD.pdb':
+                    self.respond(404, '')
+                else:
+                    self.respond(200, 'HEADER    {}\nEND\n'.format(self.path[1:5]))
+
+            def respond(self, code, body):
+                self.send_response(code)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+        self.server = LocalServer(Handler)
+        self.url = self.server.url
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+        self.server.close()
+
+    def client(self):
+        from kinomodel.models.rcsb import RcsbClient
+        from kinomodel.structures import StructureCache
+
+        cache = StructureCache(root='cache', base_url=self.url)
+        return RcsbClient(search_url=self.url + '/search', cache=cache, max_connections=2, rate=None, backoff=0.01)
+
+    def test_all_ligand_search_mode(self):
+        from kinomodel.models import pdbfinder
+        from kinomodel.models.rcsb import SearchProgress
+
+        dictionary = {'inhibitor': ['imatinib', 'nilotinib'], 'Chem_ID': ['STI', 'NIL'],
+                      'Accession_ID': ['P00519 P17948', 'P00519'], 'approved_target': ['ABL1 VEGFR2', 'ABL1']}
+        progress = SearchProgress('progress.json')
+        written = pdbfinder.all_ligand_search_mode(dictionary, 7.4, False, client=self.client(), progress=progress)
+        self.assertEqual(written, {'pdbs/imatinib-ABL1': ['1IEP', '3CS9'], 'pdbs/nilotinib-ABL1': ['3CS9'],
+                                   'pdbs/imatinib-VEGFR2': ['1IEP', '3CS9', '4AGD']})
+        with open('pdbs/nilotinib-ABL1/3CS9.pdb') as infile:
+            self.assertEqual(infile.read(), 'HEADER    3CS9\nEND\n')
+
+        # three searches; every structure downloaded once, and 4AGD once more after a server error
+        downloads = sorted(path for method, path in self.requests if method == 'GET')
+        self.assertEqual(len([method for method, _ in self.requests if method == 'POST']), 3)
+        self.assertEqual(downloads, ['/1IEP.pdb', '/3CS9.pdb', '/4AGD.pdb', '/4AGD.pdb'])
+
+        # a resumed run sends no request
+        del self.requests[:]
+        written = pdbfinder.all_ligand_search_mode(dictionary, 7.4, False, client=self.client(),
+                                                   progress=SearchProgress('progress.json'))
+        self.assertEqual(len(written), 3)
+        self.assertEqual(self.requests, [])
+
+    def test_failed_download(self):
+        from kinomodel.models import pdbfinder
+
+        self.hits['STI'] = ['0BAD', '1IEP']
+        with self.assertWarns(UserWarning):
+            written = pdbfinder.ligand_search_mode(['STI'], 'imatinib', 7.4, False, client=self.client())
+        # the structure that could not be downloaded is not returned, so it is not prepared
+        self.assertEqual(written, {'pdbs/imatinib': ['1IEP']})
+        self.assertTrue(os.path.exists('pdbs/imatinib/1IEP.pdb'))
+        self.assertFalse(os.path.exists('pdbs/imatinib/0BAD.pdb'))
+
+    def test_apo_search_mode(self):
+        from kinomodel.models import pdbfinder
+
+        dictionary = {'inhibitor': ['imatinib'], 'Chem_ID': ['STI'], 'Accession_ID': ['P00519 P17948'],
+                      'approved_target': ['ABL1 VEGFR2']}
+        self.hits = {'P17948': ['4AGD'], 'P00519': ['1IEP']}
+        self.failures = {}
+        written = pdbfinder.apo_search_mode(dictionary, 7.4, False, client=self.client(), n_threads=2)
+        self.assertEqual(written, {'pdbs/apo/P00519': ['1IEP'], 'pdbs/apo/P17948': ['4AGD']})
+        self.assertTrue(os.path.exists('pdbs/apo/P17948/4AGD.pdb'))
@@ -0,0 +1,54 @@
+"""
+Test the parallel structure preparation scheduler
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import json
+import os
+
+
+def fake_preparation(job):
+    """Write the PDBFixer outputs of a job, or fail for PDB code 0BAD"""
+    from kinomodel.models.prepare import pdbfixer_outputs
+
+    if job['pdbid'] == '0BAD':
+        raise ValueError('cannot fix %s' % job['pdbid'])
+    for path in pdbfixer_outputs(job['pdbid'], job['pathway'], job['ph']):
+        with open(path, 'w') as outfile:
+            outfile.write('END\n')
+
+
+class PreparationSchedulerTestCase(unittest.TestCase):
+
+    def test_scheduler(self):
+        from kinomodel.models import prepare
+
+        prepare.PREPARATION_METHODS['fake'] = (fake_preparation, prepare.pdbfixer_outputs)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                manifest = os.path.join(directory, 'manifest.jsonl')
+                scheduler = prepare.PreparationScheduler(manifest, n_workers=2, processes=False)
+                for pdbid in ['3CS9', '1IEP', '0BAD', '3CS9']:
+                    scheduler.submit(pdbid, directory, method='fake', ph=7.4)
+                self.assertEqual(scheduler.run(), {'done': 2, 'failed': 1, 'skipped': 1})
+                self.assertEqual(sorted(os.listdir(directory)),
+                                 ['{}_fixed_ph7.4{}.pdb'.format(pdbid, suffix) for pdbid in ['1IEP', '3CS9']
+                                  for suffix in ['', '_apo', '_apo_nowater']] + ['manifest.jsonl'])
+                with open(manifest) as infile:
+                    results = {result['pdbid']: result for result in map(json.loads, infile)}
+                self.assertIn('ValueError: cannot fix 0BAD', results['0BAD']['error'])
+                self.assertGreaterEqual(results['3CS9']['wall_time'], 0)
+
+                # a restart only runs failed jobs, jobs with other parameters and jobs whose outputs were removed
+                os.remove(os.path.join(directory, '1IEP_fixed_ph7.4_apo.pdb'))
+                for pdbid in ['3CS9', '1IEP', '0BAD']:
+                    scheduler.submit(pdbid, directory, method='fake', ph=7.4)
+                scheduler.submit('3CS9', directory, method='fake', ph=7.4, keep_ids=False)
+                self.assertEqual(scheduler.run(), {'done': 2, 'failed': 1, 'skipped': 1})
+
+                with self.assertRaises(ValueError):
+                    scheduler.submit('3CS9', directory, method='unknown')
+        finally:
+            del prepare.PREPARATION_METHODS['fake']
@@ -91,3 +91,56 @@ class KinomodelTestCase(unittest.TestCase):
             809, 810, 811, 812, 813, 814, 815, 816, 817, 818, 819, 820, 821,
             829, 830, 831, 832, 833, 834, 835
         ])
+
+    def test_klifs_cache(self):
+        # absolute import (with kinomodel installed)
+        from kinomodel.features import query_klifs
+        from kinomodel.features.klifs_cache import KlifsCache
+        import json
+        import tempfile
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+        from kinomodel.tests.utils import LocalServer
+
+        # a local stand-in for the KLIFS server
+        records = {
+            '3PP0': [{'structure_ID': 4820, 'kinase_ID': 407, 'pdb': '3pp0', 'chain': 'A', 'kinase': 'ErbB2',
+                      'pocket': 'K' * 85, 'ligand': '03Q'}],
+            '2G1T': [{'structure_ID': 1001, 'kinase_ID': 1, 'pdb': '2g1t', 'chain': 'A', 'kinase': 'Abl1',
+                      'pocket': 'K' * 85, 'ligand': 0}],
+        }
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                requests.append(url.path)
+                if url.path == '/api/structures_pdb_list':
+                    codes = parse_qs(url.query)['pdb-codes'][0].split(',')
+                    body = json.dumps([record for code in codes for record in records.get(code, [])])
+                else:
+                    body = 'var pocketResidues=[{}];\n'.format(','.join(['-1'] + ['1'] * 84))
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+        with LocalServer(Handler) as server, tempfile.TemporaryDirectory() as directory:
+            cache = KlifsCache(path=directory + '/klifs.sqlite', base_url=server.url)
+            # one batched structure query and one numbering query per structure
+            query_klifs.prefetch_klifs(['3pp0', '2G1T', '1ABC'], cache=cache)
+            self.assertEqual(sorted(requests), ['/api/structures_pdb_list', '/details.php', '/details.php'])
+
+            klifs_info = query_klifs.query_klifs_database('3PP0', 'A', cache=cache)
+            self.assertEqual(klifs_info.struct_id, 4820)
+            self.assertEqual(klifs_info.ligand, '03Q')
+            self.assertEqual(klifs_info.numbering, [0] + [1] * 84)
+            self.assertEqual(query_klifs.query_klifs_database('2G1T', 'A', cache=cache).ligand, None)
+            with self.assertRaises(ValueError):
+                query_klifs.query_klifs_database('1ABC', 'A', cache=cache)
+            # everything was served from the cache
+            self.assertEqual(len(requests), 3)
+
+            # expired entries are queried again
+            cache.ttl = 0
+            query_klifs.query_klifs_database('3PP0', 'A', cache=cache)
+            self.assertEqual(len(requests), 5)
@@ -0,0 +1,34 @@
+"""
+Test the on-disk cache of prepared docking receptors
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import os
+
+
+class ReceptorCacheTestCase(unittest.TestCase):
+
+    def test_receptor_cache_key(self):
+        from kinomodel.docking.receptor_cache import receptor_cache_key
+
+        versions = {'oechem': '2.1', 'oedocking': '3.2'}
+        key = receptor_cache_key(b'ATOM', [0, 0, 0, 10, 10, 10], versions)
+        reordered = dict(reversed(list(versions.items())))
+        self.assertEqual(key, receptor_cache_key(b'ATOM', [0., 0., 0., 10., 10., 10.], reordered))
+        self.assertNotEqual(key, receptor_cache_key(b'HETATM', [0, 0, 0, 10, 10, 10], versions))
+        self.assertNotEqual(key, receptor_cache_key(b'ATOM', [0, 0, 0, 10, 10, 11], versions))
+        self.assertNotEqual(key, receptor_cache_key(b'ATOM', b'ligand', versions))
+        self.assertNotEqual(key, receptor_cache_key(b'ATOM', [0, 0, 0, 10, 10, 10], dict(versions, oedocking='3.3')))
+
+    def test_receptor_cache(self):
+        from kinomodel.docking.receptor_cache import ReceptorCache
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReceptorCache(root=directory)
+            self.assertIsNone(cache.get('a'))
+            cache.put('a', b'receptor')
+            self.assertEqual(ReceptorCache(root=directory).get('a'), b'receptor')
+            # no temporary files are left behind
+            self.assertEqual(os.listdir(directory), ['a.oeb'])
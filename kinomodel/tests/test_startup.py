@@ -0,0 +1,47 @@
+"""
+Test that importing kinomodel and its command-line modules stays cheap
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+# dependencies that must only be imported by the functions using them
+HEAVY = ['mdtraj', 'openeye', 'pdbfixer', 'simtk', 'openmm', 'numpy', 'pandas', 'pyarrow', 'scipy', 'requests']
+
+
+def _run(code):
+    """Run code in a fresh interpreter and return what it prints as JSON."""
+    environment = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+    output = subprocess.check_output([sys.executable, '-c', code], env=environment, universal_newlines=True)
+    return json.loads(output.splitlines()[-1])
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        imported = _run(
+            'import sys, json, logging\n'
+            'import kinomodel, kinomodel.features.featurize, kinomodel.features.batch, kinomodel.features.update\n'
+            'import kinomodel.features.protein, kinomodel.features.interactions, kinomodel.features.query_klifs\n'
+            'import kinomodel.analysis, kinomodel.ml, kinomodel.cv, kinomodel.datasets, kinomodel.structures\n'
+            'print(json.dumps({"modules": sorted(name for name in sys.modules if name.split(".")[0] in %r),\n'
+            '                  "version": "kinomodel._version" in sys.modules,\n'
+            '                  "handlers": len(logging.root.handlers)}))' % HEAVY)
+        self.assertEqual(imported['modules'], [])
+        # the version is not resolved, and logging not configured, at import time
+        self.assertFalse(imported['version'])
+        self.assertEqual(imported['handlers'], 0)
+
+    def test_lazy_attributes(self):
+        values = _run('import json, kinomodel\n'
+                      'print(json.dumps([kinomodel.__version__, kinomodel.analysis.AC_STATES,\n'
+                      '                  "ml" in dir(kinomodel)]))')
+        self.assertTrue(values[0])
+        self.assertEqual(values[1:], [['aC-in', 'aC-out'], True])
+        with self.assertRaises(subprocess.CalledProcessError):
+            _run('import kinomodel; kinomodel.unknown')
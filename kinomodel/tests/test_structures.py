@@ -0,0 +1,188 @@
+"""
+Test the local structure cache
+"""
+
+# Import package, test suite, and other packages as needed
+import unittest
+import tempfile
+import shutil
+import gzip
+import os
+from http.server import SimpleHTTPRequestHandler
+
+
+class StructureCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from kinomodel.tests.utils import LocalServer
+
+        # serve a copy of the bundled 3CS9 structure as a local stand-in for the PDB
+        self.served = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+        shutil.copy(self.pdb, os.path.join(self.served, '3CS9.pdb'))
+        shutil.copy(self.pdb, os.path.join(self.served, '3CS9.pdb1'))
+        self.requests = []
+
+        served, requests = self.served, self.requests
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=served, **kwargs)
+
+            def do_GET(self):
+                requests.append(self.path)
+                super().do_GET()
+
+        self.server = LocalServer(Handler)
+        self.base_url = self.server.url
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.served)
+        shutil.rmtree(self.root)
+
+    def test_fetch(self):
+        from kinomodel.structures import StructureCache
+
+        cache = StructureCache(root=self.root, base_url=self.base_url)
+        self.assertIsNone(cache.lookup('3cs9'))
+        path = cache.fetch('3cs9')
+        with open(self.pdb, 'rb') as infile:
+            contents = infile.read()
+        with open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), contents)
+
+        # a warm cache does not touch the network, whatever the case of the PDB code
+        self.assertEqual(cache.fetch('3CS9'), path)
+        self.assertEqual(cache.read('3cs9'), contents)
+        self.assertEqual(self.requests, ['/3CS9.pdb'])
+
+        # the biological unit has identical contents here, so it is stored only once
+        self.assertEqual(cache.fetch('3cs9', 'pdb1'), path)
+        self.assertEqual(cache.size(), len(contents))
+
+        with self.assertRaises(ValueError):
+            cache.fetch('3cs9', 'xyz')
+
+    def test_compress(self):
+        from kinomodel.structures import StructureCache
+
+        cache = StructureCache(root=self.root, base_url=self.base_url, compress=True)
+        path = cache.fetch('3cs9')
+        self.assertTrue(path.endswith('.pdb.gz'))
+        with open(self.pdb, 'rb') as infile:
+            contents = infile.read()
+        with gzip.open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), contents)
+        self.assertEqual(cache.read('3cs9'), contents)
+
+    def test_evict(self):
+        from kinomodel.structures import StructureCache
+
+        cache = StructureCache(root=self.root, base_url=self.base_url, max_size=25)
+        first = cache.store('1abc', 'pdb', b'0123456789')
+        os.utime(first, (0, 0))
+        second = cache.store('2abc', 'pdb', b'abcdefghij')
+        os.utime(second, (1, 1))
+        # using the first file makes the second one the least recently used
+        self.assertEqual(cache.lookup('1abc'), first)
+        cache.store('3abc', 'pdb', b'ABCDEFGHIJ')
+        self.assertIsNotNone(cache.lookup('1abc'))
+        self.assertIsNone(cache.lookup('2abc'))
+        self.assertIsNotNone(cache.lookup('3abc'))
+        self.assertEqual(cache.size(), 20)
+
+    def test_preferred_format(self):
+        from kinomodel.structures import StructureCache
+
+        # an entry only distributed as mmCIF
+        shutil.copy(self.pdb, os.path.join(self.served, '4XYZ.cif'))
+        cache = StructureCache(root=self.root, base_url=self.base_url, formats=['pdb', 'cif'])
+        self.assertTrue(cache.fetch('4xyz').endswith('.cif'))
+        self.assertEqual(self.requests, ['/4XYZ.pdb', '/4XYZ.cif'])
+        # a cached file in any preferred format is used without a request
+        self.assertTrue(cache.fetch('4xyz').endswith('.cif'))
+        self.assertEqual(len(self.requests), 2)
+
+        with self.assertRaises(ValueError):
+            StructureCache(root=self.root, formats=['mmtf'])
+
+
+class LoadStructureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pdb = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_shared_parse(self):
+        from kinomodel.structures import load_structure
+        from kinomodel.utils import LRUCache
+
+        cache = LRUCache(1)
+        copy = os.path.join(self.root, 'copy.pdb')
+        shutil.copy(self.pdb, copy)
+        structure = load_structure(self.pdb, cache=cache, binary_cache=False)
+        # the same contents under another path are not parsed again
+        self.assertIs(load_structure(copy, cache=cache, binary_cache=False), structure)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertIsNot(load_structure(self.pdb, cache=False, binary_cache=False), structure)
+
+    def test_binary_cache(self):
+        import numpy as np
+        from kinomodel.instrumentation import recording
+        from kinomodel.structures import load_structure
+
+        with recording() as recorder:
+            parsed = load_structure(self.pdb, cache=False, binary_cache=self.root)
+            cached = load_structure(self.pdb, cache=False, binary_cache=self.root)
+        # the second load reads the arrays written by the first one
+        parses = [event.get('binary', False) for event in recorder.events if event['stage'] == 'topology.parse']
+        self.assertEqual(parses, [False, True])
+        self.assertEqual(cached.topology, parsed.topology)
+        self.assertEqual([chain.chain_id for chain in cached.topology.chains],
+                         [chain.chain_id for chain in parsed.topology.chains])
+        np.testing.assert_array_equal(cached.trajectory.xyz, parsed.trajectory.xyz)
+        np.testing.assert_array_equal(cached.trajectory.unitcell_lengths, parsed.trajectory.unitcell_lengths)
+        for column, values in parsed.atoms.items():
+            np.testing.assert_array_equal(cached.atoms[column], values)
+
+    def test_binary_cache_evict(self):
+        from unittest import mock
+        from kinomodel.structures import load_structure
+        from kinomodel.utils import cached_files
+
+        parsed = os.path.join(self.root, 'parsed')
+        load_structure(self.pdb, cache=False, binary_cache=parsed)
+        [(_, size, first)] = cached_files(parsed)
+        stale = os.path.join(parsed, 'st', 'stale.v1.npz')
+        os.makedirs(os.path.dirname(stale))
+        with open(stale, 'wb') as outfile:
+            outfile.write(b'0' * 4 * size)
+        os.utime(first, (0, 0))
+        os.utime(stale, (1, 1))
+        # reading the first file makes the stale one the least recently used
+        load_structure(self.pdb, cache=False, binary_cache=parsed)
+        copy = os.path.join(self.root, 'copy.pdb')
+        with open(self.pdb) as infile, open(copy, 'w') as outfile:
+            outfile.write('REMARK   1 COPY\n' + infile.read())
+        with mock.patch.dict(os.environ, {'KINOMODEL_PARSED_CACHE_SIZE': str(3 * size)}):
+            load_structure(copy, cache=False, binary_cache=parsed)
+        paths = [path for _, _, path in cached_files(parsed)]
+        self.assertEqual(len(paths), 2)
+        self.assertIn(first, paths)
+        self.assertNotIn(stale, paths)
+
+    def test_atom_table(self):
+        import numpy as np
+        from kinomodel.structures import load_structure
+
+        structure = load_structure(self.pdb, cache=False, binary_cache=False)
+        table = structure.atoms
+        self.assertIs(structure.atoms, table)
+        dataframe = structure.topology.to_dataframe()[0]
+        for column in ('name', 'element', 'resName', 'resSeq', 'chainID'):
+            np.testing.assert_array_equal(table[column], dataframe[column].values)
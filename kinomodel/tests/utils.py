@@ -0,0 +1,56 @@
+"""
+Helpers shared by the kinomodel tests
+"""
+
+import os
+import threading
+
+# Abl:nilotinib (PDBID:3CS9), bundled with the package
+PDB_3CS9 = os.path.join(os.path.dirname(__file__), '..', 'data', 'docking', '3cs9.pdb')
+
+
+def numbering_3cs9():
+    """
+    Return a pocket numbering mapping the KLIFS positions used by the features onto chain A of PDB_3CS9.
+
+    Returns
+    -------
+    numbering : list of int
+        The residue numbers of the 85 pocket residues; a new list on every call.
+
+    """
+    numbering = list(range(255, 340))
+    numbering[16], numbering[23], numbering[27] = 271, 286, 290
+    numbering[78:83] = [379, 380, 381, 382, 383]
+
+    return numbering
+
+
+class LocalServer(object):
+
+    def __init__(self, handler):
+        """A local HTTP stand-in for a remote service, answering on a free port from a background thread.
+
+        Parameters
+        ----------
+        handler: type
+            The http.server.BaseHTTPRequestHandler subclass answering the requests; its log messages are muted.
+
+        """
+        from http.server import ThreadingHTTPServer
+
+        quiet = type(handler.__name__, (handler,), {'log_message': lambda self, *args: None})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), quiet)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stop the server and release its port."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
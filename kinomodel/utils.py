@@ -0,0 +1,236 @@
+"""
+utils.py
+Small helpers shared by kinomodel modules.
+
+"""
+
+import os
+
+
+def get_cache_dir(name):
+    """
+    Return the directory used to cache data of the given kind, creating it if needed.
+
+    The cache root is taken from the KINOMODEL_CACHE_DIR environment variable and
+    defaults to ~/.cache/kinomodel.
+
+    Parameters
+    ----------
+    name : str
+        The name of the subdirectory (e.g. 'structures').
+
+    Returns
+    -------
+    path : str
+        The path to the cache directory.
+
+    """
+    root = os.environ.get('KINOMODEL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'kinomodel'))
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def atomic_write(path, contents):
+    """
+    Write a file so that readers see either the previous or the complete new contents.
+
+    The contents are written to a temporary file in the same directory, which is then
+    renamed over the destination.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to be written.
+    contents : bytes
+        What will be written to the file.
+
+    """
+    import tempfile
+    from kinomodel.instrumentation import stage
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with stage('file.write', len(contents), path=path), os.fdopen(handle, 'wb') as outfile:
+            outfile.write(contents)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def cached_files(root):
+    """
+    List the files of a cache directory with the time they were last used.
+
+    Temporary files being written by atomic_write are left out.
+
+    Parameters
+    ----------
+    root : str
+        The cache directory, walked recursively.
+
+    Returns
+    -------
+    files : list of (float, int, str)
+        The modification time, size in bytes and path of each file.
+
+    """
+    files = []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.startswith('.tmp-'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    return files
+
+
+def evict_least_recently_used(root, max_size):
+    """
+    Remove the least recently used files of a cache directory until it fits in a size.
+
+    Caches mark files as used by updating their modification time (os.utime) on every hit.
+
+    Parameters
+    ----------
+    root : str
+        The cache directory, walked recursively.
+    max_size : int or None
+        The maximum total size of the files in bytes. None disables eviction.
+
+    """
+    if max_size is None:
+        return
+    files = cached_files(root)
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def read_url(url, data=None, timeout=60):
+    """
+    Download the body of a URL, letting the server compress it on the wire.
+
+    The request accepts a gzip-compressed response (Content-Encoding: gzip), which is decompressed here;
+    text formats such as PDB and mmCIF files shrink several-fold in transfer.
+
+    Parameters
+    ----------
+    url : str
+        The URL to request.
+    data : bytes, optional
+        A body to POST instead of sending a GET request.
+    timeout : float, optional, default=60
+        Timeout of the request in seconds.
+
+    Returns
+    -------
+    contents : bytes
+        The (uncompressed) body of the response.
+    transferred : int
+        The number of bytes received.
+
+    """
+    import gzip
+    import urllib.request
+
+    request = urllib.request.Request(url, data=data, headers={'Accept-Encoding': 'gzip'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        contents = response.read()
+        encoding = response.headers.get('Content-Encoding', '')
+    transferred = len(contents)
+    if encoding.lower() == 'gzip':
+        contents = gzip.decompress(contents)
+
+    return contents, transferred
+
+
+def configure_logging(level=None):
+    """
+    Send log messages to the terminal, as the command-line tools do.
+
+    This is not done when kinomodel modules are imported, so that programs using them keep their own
+    logging configuration and do not pay for it at startup.
+
+    Parameters
+    ----------
+    level : int, optional
+        The level of the messages shown. logging.INFO by default.
+
+    """
+    import logging
+
+    level = logging.INFO if level is None else level
+    logging.root.setLevel(level)
+    logging.basicConfig(level=level, format="%(message)s")
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size=128):
+        """A thread-safe in-memory mapping that keeps the most recently used entries.
+
+        Parameters
+        ----------
+        max_size : int, optional, default=128
+            The number of entries kept; the least recently used entry is dropped beyond it.
+
+        """
+        import collections
+        import threading
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the entry of a key, marking it as recently used, or default on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        """Store the entry of a key, dropping the least recently used entries beyond max_size."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the number of entries, hits and misses."""
+        return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
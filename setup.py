@@ -30,6 +30,8 @@ setup(
     entry_points={
         'console_scripts': [
             'kinomodel = kinomodel.features.featurize:featurize',
+            'kinomodel-batch = kinomodel.features.batch:main',
+            'kinomodel-update = kinomodel.features.update:main',
         ],
     }
 